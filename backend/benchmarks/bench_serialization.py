@@ -0,0 +1,95 @@
+"""Serialization CPU and bytes on the wire for large list responses.
+
+Builds the seeded client rows used by the load test and serves them from
+three minimal apps that mirror how list endpoints can respond:
+
+- `model`: `response_model=List[dict]` with the stock JSONResponse (the old
+  `get_clients`/`get_notes`)
+- `encoder`: no response model, a dict returned through `jsonable_encoder`
+  and the stock JSONResponse (the old `get_client_messages`/`list_events`)
+- `fast`: `FastJSONResponse(rows)` returned directly (all four now)
+
+Each variant is requested in-process through ASGI, so the reported CPU time
+is the server's work per request without any network stack. Bytes are
+reported per Accept-Encoding for the real CompressionMiddleware.
+
+    python benchmarks/bench_serialization.py --rows 500 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from compression import CompressionMiddleware  # noqa: E402
+from fakes import CalendarStore, PostgrestStore, seed  # noqa: E402
+from responses import FastJSONResponse  # noqa: E402
+
+
+def build_rows(count: int) -> List[dict]:
+    store = PostgrestStore()
+    seed(store, CalendarStore(), clients=count, events=0)
+    return store.tables["clients"]
+
+
+def build_app(rows: List[dict]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/model", response_model=List[dict])
+    async def model():
+        return rows
+
+    @app.get("/encoder")
+    async def encoder():
+        return {"rows": rows}
+
+    @app.get("/fast", response_class=FastJSONResponse)
+    async def fast():
+        return FastJSONResponse(rows)
+
+    app.add_middleware(CompressionMiddleware)
+    return app
+
+
+async def measure(app: FastAPI, path: str, encoding: str,
+                  repeat: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Accept-Encoding": encoding}
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://bench") as client:
+        response = await client.get(path, headers=headers)
+        # httpx decodes the body; num_bytes_downloaded counts it as sent
+        wire = response.num_bytes_downloaded
+        started = time.process_time()
+        for _ in range(repeat):
+            await client.get(path, headers=headers)
+        cpu_ms = (time.process_time() - started) * 1000 / repeat
+    return {"bytes": wire, "cpu_ms": cpu_ms}
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{'rows':>6} {'variant':<8} {'encoding':<9} {'bytes':>9} "
+          f"{'cpu_ms':>8}")
+    for count in args.rows:
+        app = build_app(build_rows(count))
+        for variant in ("model", "encoder", "fast"):
+            for encoding in ("identity", "gzip", "br"):
+                result = await measure(app, f"/{variant}", encoding,
+                                       args.repeat)
+                print(f"{count:>6} {variant:<8} {encoding:<9} "
+                      f"{result['bytes']:>9} {result['cpu_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[500, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
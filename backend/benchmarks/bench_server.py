@@ -0,0 +1,129 @@
+"""Startup and throughput benchmark for the server launchers.
+
+Starts the API in a subprocess, measures the time until /api/health first
+answers, then drives it with concurrent keep-alive clients for a fixed
+duration and reports requests/sec. Results are printed as JSON.
+
+    python benchmarks/bench_server.py --workers 1 2 4 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATH = "/api/health"
+
+
+def _start(mode: str, port: int, workers: int) -> subprocess.Popen:
+    if mode == "dev":
+        cmd = [
+            sys.executable, "-m", "uvicorn", "main:app", "--port",
+            str(port), "--log-level", "warning"
+        ]
+    else:
+        cmd = [
+            sys.executable, "server.py", "--port",
+            str(port), "--workers",
+            str(workers)
+        ]
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    return subprocess.Popen(cmd,
+                            cwd=BACKEND_DIR,
+                            env=env,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+
+def _wait_ready(port: int, timeout: float = 60.0) -> float:
+    started = time.perf_counter()
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}{PATH}",
+                         timeout=0.5).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError("server did not become ready")
+
+
+async def _drive(port: int, concurrency: int, duration: float) -> dict:
+    url = f"http://127.0.0.1:{port}{PATH}"
+    limits = httpx.Limits(max_connections=concurrency)
+    done = 0
+    errors = 0
+    stop_at = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(limits=limits, timeout=10) as client:
+
+        async def worker():
+            nonlocal done, errors
+            while time.perf_counter() < stop_at:
+                try:
+                    response = await client.get(url)
+                    if response.status_code == 200:
+                        done += 1
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": done,
+        "errors": errors,
+        "requests_per_sec": round(done / elapsed, 1)
+    }
+
+
+def run_case(mode: str, workers: int, port: int, concurrency: int,
+             duration: float) -> dict:
+    proc = _start(mode, port, workers)
+    try:
+        startup = _wait_ready(port)
+        result = asyncio.run(_drive(port, concurrency, duration))
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=60)
+    return {
+        "mode": mode,
+        "workers": 1 if mode == "dev" else workers,
+        "startup_ms": round(startup * 1000, 1),
+        **result
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--skip-dev", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    if not args.skip_dev:
+        results.append(
+            run_case("dev", 1, args.port, args.concurrency, args.duration))
+    for workers in args.workers:
+        results.append(
+            run_case("prod", workers, args.port, args.concurrency,
+                     args.duration))
+    print(json.dumps({"cpu_count": os.cpu_count(), "results": results},
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Cold-start benchmark: import cost per router and warmup cost per SDK.
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter and
+attributes the cumulative import time to each module `main` imports
+directly (the routers, database, fastapi, ...). A second fresh interpreter
+times each warmup step separately. Results are printed as JSON; pass
+--repeat to take the median over several runs.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WARMUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import main
+timings = {"import_main": time.perf_counter() - started}
+for name, step in [("database", main.database.warmup),
+                   ("messages", main.messages.warmup),
+                   ("calendar", main.calendar.warmup)]:
+    t = time.perf_counter()
+    step()
+    timings[name] = time.perf_counter() - t
+print(json.dumps({k: round(v * 1000, 1) for k, v in timings.items()}))
+"""
+
+
+def _env() -> dict:
+    return dict(os.environ, LOG_LEVEL="CRITICAL")
+
+
+def import_breakdown() -> dict:
+    """Cumulative import time (ms) of each module imported by main"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import main"],
+                            cwd=BACKEND_DIR,
+                            env=_env(),
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    breakdown = {}
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        module = name.strip()
+        ms = int(cumulative) / 1000
+        if module == "main" and depth == 0:
+            total = ms
+        elif depth == 1:
+            breakdown[module] = breakdown.get(module, 0.0) + ms
+    breakdown["total"] = total
+    return breakdown
+
+
+def warmup_breakdown() -> dict:
+    result = subprocess.run([sys.executable, "-c", WARMUP_SCRIPT],
+                            cwd=BACKEND_DIR,
+                            env=_env(),
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _median(runs: list) -> dict:
+    keys = sorted({key for run in runs for key in run})
+    return {
+        key: round(statistics.median(run.get(key, 0.0) for run in runs), 1)
+        for key in keys
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=12)
+    args = parser.parse_args()
+
+    imports = _median([import_breakdown() for _ in range(args.repeat)])
+    total = imports.pop("total")
+    top = dict(
+        sorted(imports.items(), key=lambda item: item[1],
+               reverse=True)[:args.top])
+    print(
+        json.dumps(
+            {
+                "import_main_ms": total,
+                "import_ms_by_module": top,
+                "warmup_ms": _median(
+                    [warmup_breakdown() for _ in range(args.repeat)]),
+            },
+            indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1284 @@
+"""Local stand-ins for Supabase (PostgREST + Storage), Telnyx and Google
+Calendar, with configurable injected latency.
+
+Each service listens on its own port and keeps its data in memory. Only the
+parts of the upstream APIs this backend calls are implemented.
+
+    python benchmarks/fakes.py --supabase-port 54321 --latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# singleEvents=True is answered with the backend's own expansion engine
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import recurrence  # noqa: E402
+
+
+class Latency:
+    """Injected per-request delay: a base value plus uniform jitter"""
+
+    def __init__(self, base_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+
+    async def wait(self) -> None:
+        delay = self.base_ms + random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+
+# --------------------------------------------------------------------------
+# PostgREST
+# --------------------------------------------------------------------------
+
+
+def _coerce(value: str, sample: Any) -> Any:
+    """Convert a filter operand to the type of the stored value"""
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    if value == "null":
+        return None
+    if isinstance(sample, bool):
+        return value.lower() == "true"
+    if isinstance(sample, int):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(sample, float):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _like(pattern: str, value: Any, flags: int = 0) -> bool:
+    if value is None:
+        return False
+    regex = "^" + re.escape(pattern).replace(r"\*", ".*").replace(
+        "%", ".*") + "$"
+    return re.match(regex, str(value), flags | re.DOTALL) is not None
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that are not inside parentheses or braces"""
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char in "({":
+            depth += 1
+        elif char in ")}":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _contains(container: Any, contained: Any) -> bool:
+    if isinstance(contained, dict):
+        return isinstance(container, dict) and all(
+            key in container and _contains(container[key], value)
+            for key, value in contained.items())
+    if isinstance(contained, list):
+        return isinstance(container, list) and all(
+            any(_contains(item, wanted) for item in container)
+            for wanted in contained)
+    return container == contained
+
+
+def _get_path(row: dict, column: str) -> Any:
+    """Resolve `col` or a JSON path such as `col->key` / `col->>key`"""
+    parts = re.split(r"->>?", column)
+    value = row.get(parts[0])
+    for key in parts[1:]:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    if "->>" in column and value is not None and not isinstance(value, str):
+        value = json.dumps(value)
+    return value
+
+
+def _match_op(row: dict, column: str, op: str, operand: str) -> bool:
+    negate = op.startswith("not.")
+    if negate:
+        op = op[4:]
+    # Text search config, as in wfts(english)
+    op = re.sub(r"\(\w+\)$", "", op)
+    value = _get_path(row, column)
+
+    if op == "eq":
+        result = value == _coerce(operand, value)
+    elif op == "neq":
+        result = value != _coerce(operand, value)
+    elif op in ("gt", "gte", "lt", "lte"):
+        if value is None:
+            result = False
+        else:
+            other = _coerce(operand, value)
+            try:
+                result = {
+                    "gt": value > other,
+                    "gte": value >= other,
+                    "lt": value < other,
+                    "lte": value <= other
+                }[op]
+            except TypeError:
+                result = False
+    elif op == "like":
+        result = _like(operand, value)
+    elif op == "ilike":
+        result = _like(operand, value, re.IGNORECASE)
+    elif op == "is":
+        result = value is None if operand == "null" else (
+            value is (operand == "true"))
+    elif op == "in":
+        items = [
+            item.strip().strip('"')
+            for item in operand.strip("()").split(",") if item
+        ]
+        result = value in [_coerce(item, value) for item in items]
+    elif op == "cs":
+        try:
+            wanted = json.loads(operand)
+        except ValueError:
+            wanted = operand.strip("{}").split(",")
+        result = _contains(value, wanted)
+    elif op in ("fts", "plfts", "wfts"):
+        terms = [t for t in re.split(r"[\s&|'\"]+", operand) if t]
+        text = str(value or "").lower()
+        result = all(term.lower() in text for term in terms)
+    else:
+        raise ValueError(f"unsupported operator {op}")
+    return not result if negate else result
+
+
+def _match_condition(row: dict, condition: str) -> bool:
+    """Evaluate `col.op.value`, `or(...)` or `and(...)` from a logic tree"""
+    if condition.startswith(("or(", "and(")):
+        kind, _, inner = condition.partition("(")
+        return _match_logic(row, kind, inner[:-1])
+    column, _, rest = condition.partition(".")
+    op, _, operand = rest.partition(".")
+    if op == "not":
+        inner_op, _, operand = operand.partition(".")
+        op = f"not.{inner_op}"
+    return _match_op(row, column, op, operand)
+
+
+def _match_logic(row: dict, kind: str, inner: str) -> bool:
+    results = (_match_condition(row, part)
+               for part in _split_top_level(inner))
+    return any(results) if kind == "or" else all(results)
+
+
+class PostgrestStore:
+    """In-memory tables addressed through PostgREST query syntax"""
+
+    RESERVED = {"select", "order", "limit", "offset", "on_conflict"}
+    # Tables keyed by something other than a generated id
+    PRIMARY_KEYS = {"idempotency_keys": "key"}
+    # Column defaults the migrations declare
+    DEFAULTS = {
+        "scheduled_messages": {
+            "status": "pending",
+            "kind": "follow_up",
+            "attempts": 0,
+            "lease_owner": None,
+            "lease_expires_at": None
+        },
+        "calendar_channels": {
+            "status": "active",
+            "change_seq": 0,
+            "last_changes": None,
+            "changed_at": None
+        }
+    }
+
+    def __init__(self):
+        self.tables: Dict[str, List[dict]] = {}
+        self.sequences: Dict[str, int] = {}
+
+    def insert_row(self, table: str, row: dict) -> dict:
+        row = {**self.DEFAULTS.get(table, {}), **row}
+        if "id" not in row:
+            self.sequences[table] = self.sequences.get(table, 0) + 1
+            row["id"] = self.sequences[table]
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def add_stats(self, item: dict) -> None:
+        """Add to a message_stats_hourly bucket, as the migration's upsert"""
+        key = ("operator_phone", "hour", "direction", "status")
+        hour = datetime.fromisoformat(item["hour"]).astimezone(timezone.utc)
+        item = {**item, "hour": hour.isoformat()}
+        for row in self.tables.get("message_stats_hourly", []):
+            if all(row[column] == item[column] for column in key):
+                row["messages"] += item["messages"]
+                return
+        self.insert_row("message_stats_hourly",
+                        {column: item[column]
+                         for column in key + ("messages",)})
+
+    def touch_thread(self, args: dict) -> dict:
+        """Fold a message into message_threads, as the migration's upsert"""
+        at = datetime.fromisoformat(args["p_at"]).astimezone(timezone.utc)
+        inbound = args["p_direction"] == "inbound"
+        thread = next((row for row in self.tables.get("message_threads", [])
+                       if row["operator_phone"] == args["p_operator_phone"]
+                       and row["client_id"] == args["p_client_id"]), None)
+        if thread is None:
+            return self.insert_row(
+                "message_threads", {
+                    "operator_phone": args["p_operator_phone"],
+                    "client_id": args["p_client_id"],
+                    "client_phone": args["p_client_phone"],
+                    "last_message_at": at.isoformat(),
+                    "last_direction": args["p_direction"],
+                    "last_preview": args["p_preview"],
+                    "unread_count": 1 if inbound else 0,
+                    "message_count": 1,
+                    "last_reply_at": None if inbound else at.isoformat(),
+                    "last_read_at": None
+                })
+        # Client messages before the last reply or read aren't unread
+        seen = max((datetime.fromisoformat(thread[column])
+                    for column in ("last_reply_at", "last_read_at")
+                    if thread.get(column)),
+                   default=None)
+        unread = inbound and (seen is None or at > seen)
+        if at >= datetime.fromisoformat(thread["last_message_at"]):
+            thread.update({
+                "client_phone": args["p_client_phone"]
+                or thread["client_phone"],
+                "last_message_at": at.isoformat(),
+                "last_direction": args["p_direction"],
+                "last_preview": args["p_preview"],
+                "unread_count": thread["unread_count"] + unread
+                if inbound else 0
+            })
+        elif unread:
+            thread["unread_count"] += 1
+        if not inbound and (
+                thread.get("last_reply_at") is None
+                or at > datetime.fromisoformat(thread["last_reply_at"])):
+            thread["last_reply_at"] = at.isoformat()
+        thread["message_count"] += 1
+        return thread
+
+    def filter_rows(self, table: str, params) -> List[dict]:
+        rows = self.tables.get(table, [])
+        for key, raw in params.multi_items():
+            if key in self.RESERVED:
+                continue
+            if key in ("or", "and"):
+                rows = [r for r in rows if _match_logic(r, key, raw[1:-1])]
+                continue
+            op, _, operand = raw.partition(".")
+            if op == "not":
+                inner_op, _, operand = operand.partition(".")
+                op = f"not.{inner_op}"
+            rows = [r for r in rows if _match_op(r, key, op, operand)]
+        return rows
+
+    @staticmethod
+    def order_rows(rows: List[dict], order: Optional[str]) -> List[dict]:
+        if not order:
+            return rows
+        for term in reversed(order.split(",")):
+            column, _, direction = term.partition(".")
+            desc = direction.startswith("desc")
+            present = [r for r in rows if _get_path(r, column) is not None]
+            missing = [r for r in rows if _get_path(r, column) is None]
+            present.sort(key=lambda r: _get_path(r, column), reverse=desc)
+            rows = present + missing if not desc else missing + present
+        return rows
+
+    @staticmethod
+    def project(rows: List[dict], select: Optional[str]) -> List[dict]:
+        if not select or select.strip() == "*":
+            return rows
+        columns = [c.strip() for c in select.split(",") if c.strip()]
+        projected = []
+        for row in rows:
+            item = {}
+            for column in columns:
+                alias, sep, source = column.partition(":")
+                if not sep:
+                    alias, source = column, column
+                item[alias.split("->")[-1].strip(">")] = _get_path(
+                    row, source)
+            projected.append(item)
+        return projected
+
+    @staticmethod
+    def aggregate(rows: List[dict], select: str) -> List[dict]:
+        """PostgREST aggregate select: plain columns become the group key"""
+        keys, metrics = [], []
+        for column in (c.strip() for c in select.split(",") if c.strip()):
+            alias, sep, source = column.partition(":")
+            if not sep:
+                alias, source = "", column
+            if source == "count()":
+                metrics.append((alias or "count", None, "count"))
+            elif source.endswith(("min()", "max()", "sum()", "avg()")):
+                name, _, func = source[:-2].rpartition(".")
+                metrics.append((alias or func, name, func))
+            else:
+                keys.append((alias or source, source))
+
+        groups: Dict[tuple, List[dict]] = {}
+        for row in rows:
+            group = tuple(_get_path(row, source) for _, source in keys)
+            groups.setdefault(group, []).append(row)
+
+        result = []
+        for group, members in groups.items():
+            item = {alias: value for (alias, _), value in zip(keys, group)}
+            for alias, column, func in metrics:
+                if func == "count":
+                    item[alias] = len(members)
+                    continue
+                values = [
+                    _get_path(r, column) for r in members
+                    if _get_path(r, column) is not None
+                ]
+                if not values:
+                    item[alias] = None
+                elif func == "min":
+                    item[alias] = min(values)
+                elif func == "max":
+                    item[alias] = max(values)
+                elif func == "sum":
+                    item[alias] = sum(values)
+                else:
+                    item[alias] = sum(values) / len(values)
+            result.append(item)
+        return result
+
+
+def create_postgrest_app(store: PostgrestStore, latency: Latency) -> Starlette:
+
+    def _page(request: Request, rows: List[dict]) -> List[dict]:
+        offset = int(request.query_params.get("offset", 0))
+        limit = request.query_params.get("limit")
+        rows = rows[offset:]
+        if limit is not None:
+            rows = rows[:int(limit)]
+        return rows
+
+    def _respond(request: Request, rows: List[dict], total: int,
+                 status_code: int = 200) -> Response:
+        headers = {}
+        prefer = request.headers.get("prefer", "")
+        if "count=" in prefer:
+            headers["content-range"] = f"0-{max(len(rows) - 1, 0)}/{total}"
+        if "return=minimal" in prefer:
+            return Response(status_code=status_code, headers=headers)
+        rows = store.project(rows, request.query_params.get("select"))
+        accept = request.headers.get("accept", "")
+        if "vnd.pgrst.object" in accept:
+            return JSONResponse(rows[0] if rows else None,
+                                status_code=status_code,
+                                headers=headers)
+        return JSONResponse(rows, status_code=status_code, headers=headers)
+
+    async def table(request: Request) -> Response:
+        await latency.wait()
+        name = request.path_params["table"]
+        params = request.query_params
+
+        if request.method in ("GET", "HEAD"):
+            rows = store.filter_rows(name, params)
+            if "(" in params.get("select", ""):
+                rows = store.aggregate(rows, params["select"])
+                rows = store.order_rows(rows, params.get("order"))
+                return JSONResponse(_page(request, rows))
+            rows = store.order_rows(rows, params.get("order"))
+            return _respond(request, _page(request, rows), len(rows))
+
+        if request.method == "POST":
+            body = await request.json()
+            items = body if isinstance(body, list) else [body]
+            key = store.PRIMARY_KEYS.get(name)
+            existing = {row.get(key) for row in store.tables.get(name, [])}
+            if key and any(item.get(key) in existing for item in items):
+                return JSONResponse(
+                    {
+                        "code": "23505",
+                        "message": "duplicate key value violates unique "
+                        "constraint",
+                        "details": None,
+                        "hint": None
+                    },
+                    status_code=409)
+            conflict = params.get("on_conflict")
+            if conflict and "merge-duplicates" in request.headers.get(
+                    "prefer", ""):
+                columns = conflict.split(",")
+                created = []
+                for item in items:
+                    match = next((row for row in store.tables.get(name, [])
+                                  if all(
+                                      row.get(column) == item.get(column)
+                                      for column in columns)), None)
+                    if match is None:
+                        created.append(store.insert_row(name, item))
+                    else:
+                        match.update(item)
+                        created.append(match)
+                return _respond(request, created, len(created), 201)
+            created = [store.insert_row(name, item) for item in items]
+            return _respond(request, created, len(created), 201)
+
+        if request.method == "PATCH":
+            changes = await request.json()
+            rows = store.filter_rows(name, params)
+            for row in rows:
+                row.update(changes)
+            return _respond(request, rows, len(rows))
+
+        if request.method == "DELETE":
+            rows = store.filter_rows(name, params)
+            doomed = {id(row) for row in rows}
+            store.tables[name] = [
+                row for row in store.tables.get(name, [])
+                if id(row) not in doomed
+            ]
+            return _respond(request, rows, len(rows))
+
+        return Response(status_code=405)
+
+    buckets: Dict[str, tuple] = {}
+
+    async def rate_limit_take(request: Request) -> Response:
+        # Local stand-in for the plpgsql function in migrations/004
+        await latency.wait()
+        args = await request.json()
+        now = time.monotonic()
+        rate, burst, cost = args["p_rate"], args["p_burst"], args.get(
+            "p_cost", 1)
+        tokens, updated = buckets.get(args["p_key"], (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        if tokens >= cost:
+            buckets[args["p_key"]] = (tokens - cost, now)
+            return JSONResponse(0)
+        buckets[args["p_key"]] = (tokens, now)
+        return JSONResponse((cost - tokens) / rate)
+
+    async def scheduled_messages_lease(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/005
+        await latency.wait()
+        args = await request.json()
+        now = datetime.now(timezone.utc)
+        until = datetime.fromisoformat(args["p_until"])
+        rows = sorted(
+            (row for row in store.tables.get("scheduled_messages", [])
+             if row["status"] == "pending"
+             and datetime.fromisoformat(row["send_at"]) <= until and (
+                 not row["lease_expires_at"]
+                 or datetime.fromisoformat(row["lease_expires_at"]) < now)),
+            key=lambda row: row["send_at"])[:args["p_limit"]]
+        for row in rows:
+            send_at = datetime.fromisoformat(row["send_at"])
+            row["lease_owner"] = args["p_owner"]
+            row["lease_expires_at"] = (
+                max(send_at, now) +
+                timedelta(seconds=args.get("p_grace", 60))).isoformat()
+        return JSONResponse(rows)
+
+    def _client(client_id) -> Optional[dict]:
+        return next((row for row in store.tables.get("clients", [])
+                     if str(row["id"]) == str(client_id)), None)
+
+    async def client_document_put(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/011
+        await latency.wait()
+        args = await request.json()
+        client = _client(args["p_client_id"])
+        if client is None:
+            return JSONResponse(False)
+        client["client_documents"] = {
+            **(client.get("client_documents") or {}),
+            args["p_document_id"]: args["p_entry"]
+        }
+        return JSONResponse(True)
+
+    async def client_document_remove(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/011
+        await latency.wait()
+        args = await request.json()
+        client = _client(args["p_client_id"])
+        if client is None:
+            return JSONResponse(None)
+        return JSONResponse((client.get("client_documents")
+                             or {}).pop(args["p_document_id"], None))
+
+    async def calendar_channel_touch(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/007
+        await latency.wait()
+        args = await request.json()
+        for row in store.tables.get("calendar_channels", []):
+            if str(row["id"]) == str(args["p_id"]):
+                row["change_seq"] += 1
+                row["last_changes"] = args["p_changes"]
+                row["changed_at"] = datetime.now(timezone.utc).isoformat()
+                return JSONResponse(row["change_seq"])
+        return JSONResponse(None)
+
+    def _report_rows(args: dict, pad: timedelta = timedelta(0)):
+        start = datetime.fromisoformat(args["p_from"]) - pad
+        end = datetime.fromisoformat(args["p_to"])
+        for row in store.tables.get("messages", []):
+            created = datetime.fromisoformat(row["created_at"])
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            operator = (row["from_number"] if row["direction"] == "outbound"
+                        else row["to_number"])
+            if (start <= created < end and args.get("p_operator")
+                    in (None, operator)):
+                yield row, operator, created
+
+    async def message_stats(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/009
+        await latency.wait()
+        args = await request.json()
+        start = datetime.fromisoformat(args["p_from"]).replace(minute=0,
+                                                               second=0,
+                                                               microsecond=0)
+        end = datetime.fromisoformat(args["p_to"])
+        counts: Dict[tuple, int] = {}
+        for row in store.tables.get("message_stats_hourly", []):
+            hour = datetime.fromisoformat(row["hour"])
+            if (start <= hour < end and args.get("p_operator")
+                    in (None, row["operator_phone"])):
+                key = (hour.astimezone(timezone.utc).date().isoformat(),
+                       row["operator_phone"] or None, row["direction"],
+                       row["status"])
+                counts[key] = counts.get(key, 0) + row["messages"]
+        return JSONResponse([{
+            "day": day,
+            "operator_phone": operator,
+            "direction": direction,
+            "status": message_status,
+            "messages": messages
+        } for (day, operator, direction, message_status), messages in sorted(
+            counts.items(), key=lambda item: tuple(
+                part or "" for part in item[0])) if messages])
+
+    async def message_stats_hourly_add(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/009
+        await latency.wait()
+        args = await request.json()
+        for item in args["p_rows"]:
+            store.add_stats(item)
+        return Response(status_code=204)
+
+    async def message_thread_touch(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/010
+        await latency.wait()
+        return JSONResponse([store.touch_thread(await request.json())])
+
+    async def message_set_status(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/009
+        await latency.wait()
+        args = await request.json()
+        changed = []
+        for row in store.tables.get("messages", []):
+            if (row.get("telnyx_message_id") == args["p_telnyx_message_id"]
+                    and row.get("status") != args["p_status"]):
+                changed.append({
+                    "from_number": row.get("from_number"),
+                    "to_number": row.get("to_number"),
+                    "direction": row.get("direction"),
+                    "created_at": row.get("created_at"),
+                    "old_status": row.get("status")
+                })
+                row["status"] = args["p_status"]
+        return JSONResponse(changed)
+
+    async def message_response_times(request: Request) -> Response:
+        # Local stand-in for the SQL function in migrations/008
+        await latency.wait()
+        args = await request.json()
+        start = datetime.fromisoformat(args["p_from"])
+        threads: Dict[tuple, list] = {}
+        for row, operator, created in _report_rows(args, timedelta(days=7)):
+            if row.get("client_id") is not None:
+                threads.setdefault((row["client_id"], operator),
+                                   []).append((created, row["direction"]))
+        samples: Dict[tuple, list] = {}
+        for (_, operator), rows in threads.items():
+            rows.sort()
+            run_starts = [
+                item for i, item in enumerate(rows)
+                if i == 0 or rows[i - 1][1] != item[1]
+            ]
+            for (asked, before), (answered, after) in zip(
+                    run_starts, run_starts[1:]):
+                if (before, after) == ("inbound",
+                                       "outbound") and answered >= start:
+                    seconds = (answered - asked).total_seconds()
+                    day = answered.astimezone(timezone.utc).date().isoformat()
+                    samples.setdefault((day, operator), []).append(seconds)
+                    samples.setdefault((None, operator), []).append(seconds)
+
+        def percentile(values: list, fraction: float) -> float:
+            values = sorted(values)
+            position = (len(values) - 1) * fraction
+            low = int(position)
+            high = min(low + 1, len(values) - 1)
+            return values[low] + (values[high] - values[low]) * (position -
+                                                                 low)
+
+        return JSONResponse([{
+            "day": day,
+            "operator_phone": operator,
+            "replies": len(values),
+            "avg_seconds": sum(values) / len(values),
+            "p50_seconds": percentile(values, 0.5),
+            "p90_seconds": percentile(values, 0.9)
+        } for (day, operator), values in sorted(
+            samples.items(), key=lambda item: (item[0][1], item[0][0] or "~"))])
+
+    return Starlette(routes=[
+        Route("/rest/v1/rpc/rate_limit_take",
+              rate_limit_take,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/scheduled_messages_lease",
+              scheduled_messages_lease,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/client_document_put",
+              client_document_put,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/client_document_remove",
+              client_document_remove,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/calendar_channel_touch",
+              calendar_channel_touch,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/message_stats", message_stats, methods=["POST"]),
+        Route("/rest/v1/rpc/message_stats_hourly_add",
+              message_stats_hourly_add,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/message_thread_touch",
+              message_thread_touch,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/message_set_status",
+              message_set_status,
+              methods=["POST"]),
+        Route("/rest/v1/rpc/message_response_times",
+              message_response_times,
+              methods=["POST"]),
+        Route("/rest/v1/{table}",
+              table,
+              methods=["GET", "HEAD", "POST", "PATCH", "DELETE"]),
+    ])
+
+
+# --------------------------------------------------------------------------
+# Supabase Storage
+# --------------------------------------------------------------------------
+
+
+class StorageStore:
+
+    def __init__(self):
+        self.buckets: Dict[str, Dict[str, bytes]] = {}
+
+
+def create_storage_app(store: StorageStore, latency: Latency) -> Starlette:
+
+    async def remove(request: Request) -> Response:
+        await latency.wait()
+        bucket = store.buckets.setdefault(request.path_params["bucket"], {})
+        body = await request.json()
+        removed = []
+        for name in body.get("prefixes", []):
+            if bucket.pop(name, None) is not None:
+                removed.append({"name": name})
+        return JSONResponse(removed)
+
+    async def list_objects(request: Request) -> Response:
+        await latency.wait()
+        bucket = store.buckets.setdefault(request.path_params["bucket"], {})
+        body = await request.json()
+        prefix = body.get("prefix", "").rstrip("/")
+        limit = int(body.get("limit", 100))
+        offset = int(body.get("offset", 0))
+        entries = {}
+        for key in bucket:
+            if not key.startswith(prefix + "/"):
+                continue
+            name, _, rest = key[len(prefix) + 1:].partition("/")
+            # Folders are listed with a null id, like the real API
+            entries[name] = None if rest else {"size": len(bucket[key])}
+        page = sorted(entries)[offset:offset + limit]
+        return JSONResponse([{
+            "name": name,
+            "id": name if entries[name] is not None else None,
+            "metadata": entries[name]
+        } for name in page])
+
+    async def upload(request: Request) -> Response:
+        await latency.wait()
+        bucket = store.buckets.setdefault(request.path_params["bucket"], {})
+        data = b""
+        async for chunk in request.stream():
+            data += chunk
+        bucket[request.path_params["path"]] = data
+        return JSONResponse({"Key": request.path_params["path"]})
+
+    async def download(request: Request) -> Response:
+        await latency.wait()
+        bucket = store.buckets.setdefault(request.path_params["bucket"], {})
+        data = bucket.get(request.path_params["path"])
+        if data is None:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        return Response(data)
+
+    async def sign(request: Request) -> Response:
+        await latency.wait()
+        path = request.path_params["path"]
+        return JSONResponse({
+            "signedURL":
+            f"/object/sign/{request.path_params['bucket']}/{path}?token=fake"
+        })
+
+    return Starlette(routes=[
+        Route("/storage/v1/object/{bucket}", remove, methods=["DELETE"]),
+        Route("/storage/v1/object/list/{bucket}",
+              list_objects,
+              methods=["POST"]),
+        Route("/storage/v1/object/sign/{bucket}/{path:path}",
+              sign,
+              methods=["POST"]),
+        Route("/storage/v1/object/{bucket}/{path:path}",
+              upload,
+              methods=["POST", "PUT"]),
+        Route("/storage/v1/object/{bucket}/{path:path}",
+              download,
+              methods=["GET"]),
+    ])
+
+
+# --------------------------------------------------------------------------
+# Telnyx
+# --------------------------------------------------------------------------
+
+
+def create_telnyx_app(latency: Latency, error_rate: float = 0.0) -> Starlette:
+
+    async def messages(request: Request) -> Response:
+        await latency.wait()
+        if error_rate and random.random() < error_rate:
+            return JSONResponse(
+                {"errors": [{
+                    "code": "40300",
+                    "title": "Injected failure"
+                }]},
+                status_code=503)
+        body = await request.json()
+        return JSONResponse({
+            "data": {
+                "record_type": "message",
+                "id": str(uuid.uuid4()),
+                "from": {
+                    "phone_number": body.get("from")
+                },
+                "to": [{
+                    "phone_number": body.get("to"),
+                    "status": "queued"
+                }],
+                "text": body.get("text"),
+                "messaging_profile_id": body.get("messaging_profile_id"),
+            }
+        })
+
+    async def messaging_profile(request: Request) -> Response:
+        await latency.wait()
+        return JSONResponse({
+            "data": {
+                "record_type": "messaging_profile",
+                "id": request.path_params["profile_id"]
+            }
+        })
+
+    return Starlette(routes=[
+        Route("/v2/messages", messages, methods=["POST"]),
+        Route("/v2/messaging_profiles/{profile_id}",
+              messaging_profile,
+              methods=["GET"]),
+    ])
+
+
+# --------------------------------------------------------------------------
+# Google Calendar
+# --------------------------------------------------------------------------
+
+
+PRIMARY_CALENDAR_ID = "operator@example.com"
+
+
+class CalendarStore:
+    """Events per calendar; a version counter stands in for sync tokens"""
+
+    def __init__(self):
+        self.calendars: Dict[str, Dict[str, dict]] = {}
+        self.version = 0
+        # Push channels (events.watch) by channel id
+        self.channels: Dict[str, dict] = {}
+
+    def add_event(self, calendar_id: str, event: dict) -> dict:
+        event = dict(event)
+        event.setdefault("id", uuid.uuid4().hex)
+        now = datetime.now(timezone.utc).isoformat()
+        event.setdefault("created", now)
+        event["updated"] = now
+        event.setdefault("status", "confirmed")
+        event.setdefault(
+            "organizer", {
+                "email": (PRIMARY_CALENDAR_ID
+                          if calendar_id == "primary" else calendar_id),
+                "self": True
+            })
+        self.version += 1
+        event["_version"] = self.version
+        self.calendars.setdefault(calendar_id, {})[event["id"]] = event
+        return event
+
+    def cancel_event(self, calendar_id: str, event_id: str) -> None:
+        # Deleted events stay behind as cancelled, as Google reports them
+        # to incremental syncs
+        event = self.calendars[calendar_id][event_id]
+        self.version += 1
+        event.update(status="cancelled", _version=self.version)
+
+
+def _public(event: dict) -> dict:
+    return {key: value for key, value in event.items() if key != "_version"}
+
+
+def _event_start(event: dict) -> str:
+    start = event.get("start", {})
+    return start.get("dateTime") or start.get("date") or ""
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _single_events(items: List[dict], time_min: Optional[str],
+                   time_max: Optional[str]) -> List[dict]:
+    """Recurring masters replaced by their occurrences in the window"""
+    window_start, window_end = _parse_time(time_min), _parse_time(time_max)
+    exceptions: Dict[str, List[dict]] = {}
+    for item in items:
+        if item.get("recurringEventId"):
+            exceptions.setdefault(item["recurringEventId"], []).append(item)
+    expanded = []
+    for item in items:
+        if item.get("recurringEventId") or item["status"] == "cancelled":
+            continue
+        if item.get("recurrence"):
+            expanded.extend(
+                recurrence.expand(item, exceptions.get(item["id"], ()),
+                                  window_start, window_end))
+        elif recurrence.overlaps(item, window_start, window_end):
+            expanded.append(item)
+    return expanded
+
+
+def create_google_app(store: CalendarStore, latency: Latency) -> Starlette:
+    notifier: Dict[str, Any] = {}
+
+    async def _deliver(channel: dict, state: str) -> None:
+        channel["messages"] += 1
+        try:
+            if "client" not in notifier:
+                notifier["client"] = httpx.AsyncClient(timeout=10)
+            await notifier["client"].post(
+                channel["address"],
+                headers={
+                    "X-Goog-Channel-ID": channel["id"],
+                    "X-Goog-Channel-Token": channel.get("token") or "",
+                    "X-Goog-Resource-ID": channel["resourceId"],
+                    "X-Goog-Resource-State": state,
+                    "X-Goog-Message-Number": str(channel["messages"]),
+                })
+        except Exception as e:
+            print(f"push to {channel['address']} failed: {e}")
+
+    def _notify(calendar_id: str) -> None:
+        """Push an "exists" notification to the calendar's channels"""
+        for channel in list(store.channels.values()):
+            if channel["calendar"] == calendar_id:
+                asyncio.create_task(_deliver(channel, "exists"))
+
+    async def watch(request: Request) -> Response:
+        await latency.wait()
+        body = await request.json()
+        ttl = int((body.get("params") or {}).get("ttl") or 604800)
+        channel = {
+            "id": body["id"],
+            "address": body["address"],
+            "token": body.get("token"),
+            "resourceId": uuid.uuid4().hex,
+            "calendar": request.path_params["calendar_id"],
+            "expiration": int((time.time() + ttl) * 1000),
+            "messages": 0,
+        }
+        store.channels[channel["id"]] = channel
+        asyncio.create_task(_deliver(channel, "sync"))
+        return JSONResponse({
+            "kind": "api#channel",
+            "id": channel["id"],
+            "resourceId": channel["resourceId"],
+            "token": channel["token"],
+            "expiration": str(channel["expiration"])
+        })
+
+    async def stop_channel(request: Request) -> Response:
+        await latency.wait()
+        body = await request.json()
+        if store.channels.pop(body.get("id"), None) is None:
+            return JSONResponse({"error": {"code": 404}}, status_code=404)
+        return Response(status_code=204)
+
+    async def token(request: Request) -> Response:
+        await latency.wait()
+        return JSONResponse({
+            "access_token": uuid.uuid4().hex,
+            "expires_in": 3600,
+            "token_type": "Bearer"
+        })
+
+    async def events(request: Request) -> Response:
+        await latency.wait()
+        calendar = store.calendars.setdefault(
+            request.path_params["calendar_id"], {})
+        if request.method == "POST":
+            created = store.add_event(request.path_params["calendar_id"],
+                                      await request.json())
+            _notify(request.path_params["calendar_id"])
+            return JSONResponse(_public(created))
+
+        params = request.query_params
+        sync_token = params.get("syncToken")
+        items = list(calendar.values())
+        if sync_token:
+            items = [e for e in items if e["_version"] > int(sync_token)]
+        elif params.get("showDeleted") != "true":
+            items = [e for e in items if e["status"] != "cancelled"]
+        time_min, time_max = params.get("timeMin"), params.get("timeMax")
+        if params.get("singleEvents") == "true" and not sync_token:
+            items = _single_events(items, time_min, time_max)
+            items.sort(key=recurrence.sort_key)
+        else:
+            if time_min:
+                items = [e for e in items if _event_start(e) >= time_min]
+            if time_max:
+                items = [e for e in items if _event_start(e) < time_max]
+            items.sort(key=_event_start)
+        offset = int(params.get("pageToken") or 0)
+        limit = int(params.get("maxResults", 250))
+        page = items[offset:offset + limit]
+        body = {
+            "kind": "calendar#events",
+            "items": [_public(event) for event in page]
+        }
+        if offset + limit < len(items):
+            body["nextPageToken"] = str(offset + limit)
+        else:
+            body["nextSyncToken"] = str(store.version)
+        return JSONResponse(body)
+
+    async def event(request: Request) -> Response:
+        await latency.wait()
+        calendar = store.calendars.setdefault(
+            request.path_params["calendar_id"], {})
+        event_id = request.path_params["event_id"]
+        if event_id not in calendar:
+            return JSONResponse({"error": {"code": 404}}, status_code=404)
+        if calendar[event_id]["status"] == "cancelled":
+            return JSONResponse({"error": {"code": 410}}, status_code=410)
+        if request.method == "DELETE":
+            store.cancel_event(request.path_params["calendar_id"], event_id)
+            _notify(request.path_params["calendar_id"])
+            return Response(status_code=204)
+        if request.method in ("PUT", "PATCH"):
+            body = await request.json()
+            if request.method == "PATCH":
+                body = {**_public(calendar[event_id]), **body}
+            body["id"] = event_id
+            updated = store.add_event(request.path_params["calendar_id"],
+                                      body)
+            _notify(request.path_params["calendar_id"])
+            return JSONResponse(_public(updated))
+        return JSONResponse(_public(calendar[event_id]))
+
+    async def calendar(request: Request) -> Response:
+        await latency.wait()
+        calendar_id = request.path_params["calendar_id"]
+        return JSONResponse({
+            "kind":
+            "calendar#calendar",
+            "id":
+            PRIMARY_CALENDAR_ID if calendar_id == "primary" else calendar_id
+        })
+
+    async def colors(request: Request) -> Response:
+        await latency.wait()
+        return JSONResponse({
+            "kind": "calendar#colors",
+            "event": {
+                "1": {
+                    "background": "#a4bdfc",
+                    "foreground": "#1d1d1d"
+                }
+            }
+        })
+
+    async def calendar_list(request: Request) -> Response:
+        await latency.wait()
+        return JSONResponse({
+            "items": [{
+                "id": calendar_id
+            } for calendar_id in store.calendars]
+        })
+
+    return Starlette(routes=[
+        Route("/token", token, methods=["POST"]),
+        Route("/calendars/{calendar_id}", calendar, methods=["GET"]),
+        Route("/calendars/{calendar_id}/events",
+              events,
+              methods=["GET", "POST"]),
+        Route("/calendars/{calendar_id}/events/watch",
+              watch,
+              methods=["POST"]),
+        Route("/channels/stop", stop_channel, methods=["POST"]),
+        Route("/calendars/{calendar_id}/events/{event_id}",
+              event,
+              methods=["GET", "PUT", "PATCH", "DELETE"]),
+        Route("/colors", colors, methods=["GET"]),
+        Route("/users/me/calendarList", calendar_list, methods=["GET"]),
+    ])
+
+
+# --------------------------------------------------------------------------
+# Seeding and entry point
+# --------------------------------------------------------------------------
+
+OPERATOR_ID = "operator-1"
+OPERATOR_PHONE = "+15550000001"
+
+
+def seed(postgrest: PostgrestStore,
+         calendars: CalendarStore,
+         clients: int = 500,
+         events: int = 500,
+         recurring: int = 50,
+         messages: int = 2000) -> None:
+    postgrest.insert_row(
+        "crm_users", {
+            "id": OPERATOR_ID,
+            "email": "operator@example.com",
+            "name": "Load Test Operator",
+            "phone_number": OPERATOR_PHONE
+        })
+    statuses = ["open", "pending", "closed"]
+    case_types = ["injury", "family", "criminal", "estate"]
+    now = datetime.now(timezone.utc)
+    for index in range(clients):
+        created = (now - timedelta(days=index)).isoformat()
+        postgrest.insert_row(
+            "clients", {
+                "first_name": f"First{index}",
+                "last_name": f"Last{index}",
+                "primary_phone": f"+1555{index:07d}",
+                "primary_email": f"client{index}@example.com",
+                "case_type": case_types[index % len(case_types)],
+                "case_status": statuses[index % len(statuses)],
+                "case_date": (now - timedelta(days=index)).date().isoformat(),
+                "record_manager": f"attorney{index % 7}",
+                "created_by": OPERATOR_ID,
+                "user_defined_fields": {
+                    "insurer": ["Acme", "Globex", "Initech"][index % 3]
+                },
+                "client_documents": {},
+                "created_at": created,
+                "updated_at": created,
+            })
+    for index in range(events):
+        start = now + timedelta(hours=6 * index - 24 * 30)
+        calendars.add_event(
+            "primary", {
+                "summary": f"Hearing {index}",
+                "description": f"Client {index % max(clients, 1) + 1}",
+                "start": {
+                    "dateTime": start.isoformat()
+                },
+                "end": {
+                    "dateTime": (start + timedelta(hours=1)).isoformat()
+                },
+            })
+    # Weekly series started a year ago, like standing court dates
+    first_monday = (now - timedelta(days=365 + now.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    for index in range(recurring):
+        start = first_monday + timedelta(days=index % 5, hours=9 + index % 8)
+        calendars.add_event(
+            "primary", {
+                "summary": f"Standing hearing {index}",
+                "description": f"Client {index % max(clients, 1) + 1}",
+                "start": {
+                    "dateTime": start.isoformat(),
+                    "timeZone": "America/New_York"
+                },
+                "end": {
+                    "dateTime": (start + timedelta(hours=1)).isoformat(),
+                    "timeZone": "America/New_York"
+                },
+                "recurrence": ["RRULE:FREQ=WEEKLY"],
+            })
+    # A client's question and the operator's reply, a few hours apart,
+    # spread over the last 60 days
+    phrases = ["court date", "settlement offer", "medical records",
+               "insurance claim", "deposition schedule"]
+    for index in range(messages):
+        client = index // 2 % max(clients, 1)
+        created = now - timedelta(minutes=43 * (messages - index))
+        inbound = index % 2 == 0
+        postgrest.insert_row(
+            "messages", {
+                "client_id": client + 1,
+                "to_number": OPERATOR_PHONE if inbound else f"+1555{client:07d}",
+                "from_number": f"+1555{client:07d}" if inbound else OPERATOR_PHONE,
+                "content": f"About the {phrases[index // 2 % len(phrases)]}"
+                f" ({'question' if inbound else 'reply'} {index})",
+                "direction": "inbound" if inbound else "outbound",
+                "status": "received" if inbound else
+                ["delivered", "delivered", "delivered", "failed"][index // 2 % 4],
+                "telnyx_message_id": f"seed-{index}",
+                "user_id": None if inbound else OPERATOR_ID,
+                "created_at": created.isoformat()
+            })
+    # What the migrations' backfills would find
+    for row in postgrest.tables.get("messages", []):
+        inbound = row["direction"] == "inbound"
+        postgrest.touch_thread({
+            "p_operator_phone": row["to_number" if inbound else "from_number"],
+            "p_client_id": str(row["client_id"]),
+            "p_client_phone": row["from_number" if inbound else "to_number"],
+            "p_direction": row["direction"],
+            "p_preview": row["content"][:160],
+            "p_at": row["created_at"]
+        })
+        postgrest.add_stats({
+            "operator_phone": row["to_number"] if row["direction"] ==
+            "inbound" else row["from_number"],
+            "hour": datetime.fromisoformat(row["created_at"]).replace(
+                minute=0, second=0, microsecond=0).isoformat(),
+            "direction": row["direction"],
+            "status": row["status"],
+            "messages": 1
+        })
+
+
+async def serve(args: argparse.Namespace) -> None:
+    jitter = args.jitter_ms
+    postgrest, storage, calendars = (PostgrestStore(), StorageStore(),
+                                     CalendarStore())
+    seed(postgrest, calendars, args.clients, args.events, args.recurring,
+         args.messages)
+
+    supabase_latency = Latency(
+        args.supabase_latency_ms
+        if args.supabase_latency_ms is not None else args.latency_ms, jitter)
+    supabase_app = Starlette(
+        routes=create_postgrest_app(postgrest, supabase_latency).routes +
+        create_storage_app(storage, supabase_latency).routes)
+
+    telnyx_app = create_telnyx_app(
+        Latency(
+            args.telnyx_latency_ms
+            if args.telnyx_latency_ms is not None else args.latency_ms,
+            jitter), args.telnyx_error_rate)
+    google_app = create_google_app(
+        calendars,
+        Latency(
+            args.google_latency_ms
+            if args.google_latency_ms is not None else args.latency_ms,
+            jitter))
+
+    servers = [
+        uvicorn.Server(
+            uvicorn.Config(app,
+                           host=args.host,
+                           port=port,
+                           log_level="warning",
+                           access_log=False))
+        for app, port in ((supabase_app, args.supabase_port),
+                          (telnyx_app, args.telnyx_port),
+                          (google_app, args.google_port))
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--supabase-port", type=int, default=54321)
+    parser.add_argument("--telnyx-port", type=int, default=54322)
+    parser.add_argument("--google-port", type=int, default=54323)
+    parser.add_argument("--latency-ms",
+                        type=float,
+                        default=0.0,
+                        help="default injected latency for every service")
+    parser.add_argument("--supabase-latency-ms", type=float)
+    parser.add_argument("--telnyx-latency-ms", type=float)
+    parser.add_argument("--google-latency-ms", type=float)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--telnyx-error-rate",
+                        type=float,
+                        default=0.0,
+                        help="fraction of Telnyx sends that fail with 503")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--recurring",
+                        type=int,
+                        default=50,
+                        help="weekly recurring events seeded into the calendar")
+    parser.add_argument("--messages",
+                        type=int,
+                        default=2000,
+                        help="SMS history seeded for search and reports")
+    return parser
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(build_parser().parse_args()))
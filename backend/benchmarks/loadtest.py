@@ -0,0 +1,320 @@
+"""Scripted load test against local stand-ins for Supabase, Telnyx and Google.
+
+Starts benchmarks/fakes.py and the API in subprocesses, runs each workload
+with a fixed number of requests at a fixed concurrency, and prints latency
+percentiles and throughput as JSON.
+
+    python benchmarks/loadtest.py --latency-ms 15 --requests 300 \\
+        --out results.json
+    python benchmarks/loadtest.py --baseline results.json --max-regression 0.2
+
+With --baseline, the run exits non-zero when any workload's p95 latency or
+throughput is worse than the baseline by more than --max-regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import OPERATOR_ID, OPERATOR_PHONE  # noqa: E402
+
+# (method, path, json body, headers)
+RequestSpec = Tuple[str, str, object, Dict[str, str]]
+
+
+class Workloads:
+    """Request generators for each scripted workload"""
+
+    def __init__(self, clients: int, google_base: str):
+        self.clients = clients
+        self.google_base = google_base
+        self.auth = {"Authorization": f"Bearer {OPERATOR_ID}"}
+        self.counter = 0
+
+    def _client_id(self) -> str:
+        return str(random.randint(1, self.clients))
+
+    def _credentials(self) -> dict:
+        expiry = datetime.now(timezone.utc) + timedelta(hours=1)
+        return {
+            "token": "fake-token",
+            "refresh_token": "fake-refresh",
+            "token_uri": f"{self.google_base}token",
+            "client_id": "fake-client",
+            "client_secret": "fake-secret",
+            "scopes": ["https://www.googleapis.com/auth/calendar"],
+            "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+    def client_list(self) -> RequestSpec:
+        return "GET", "/api/clients", None, {}
+
+    def client_get(self) -> RequestSpec:
+        return "GET", f"/api/clients/{self._client_id()}", None, {}
+
+    def sms_send(self) -> RequestSpec:
+        return "POST", "/api/messages/send", {
+            "client_id": self._client_id(),
+            "content": "Reminder: your hearing is tomorrow at 9am."
+        }, self.auth
+
+    def webhook(self) -> RequestSpec:
+        self.counter += 1
+        if self.counter % 2:
+            client = int(self._client_id()) - 1
+            body = {
+                "data": {
+                    "event_type": "message.received",
+                    "payload": {
+                        "id": f"in-{self.counter}",
+                        "from": {
+                            "phone_number": f"+1555{client:07d}"
+                        },
+                        "to": [{
+                            "phone_number": OPERATOR_PHONE
+                        }],
+                        "text": "Thanks, see you then."
+                    }
+                }
+            }
+        else:
+            body = {
+                "data": {
+                    "event_type": "message.delivered",
+                    "payload": {
+                        "id": f"out-{self.counter}"
+                    }
+                }
+            }
+        return "POST", "/api/messages/webhook", body, {}
+
+    def calendar_browse(self) -> RequestSpec:
+        start = datetime.now(timezone.utc) + timedelta(
+            days=random.randint(-30, 60))
+        end = start + timedelta(days=7)
+        query = (f"?time_min={start.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+                 f"&time_max={end.strftime('%Y-%m-%dT%H:%M:%SZ')}")
+        return "POST", f"/api/calendar/events{query}", self._credentials(), {}
+
+    def messages_thread(self) -> RequestSpec:
+        return "GET", f"/api/messages/client/{self._client_id()}", None, \
+            self.auth
+
+    def get(self, name: str) -> Callable[[], RequestSpec]:
+        return getattr(self, name)
+
+
+WORKLOADS = [
+    "client_list", "client_get", "sms_send", "webhook", "calendar_browse",
+    "messages_thread"
+]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1,
+                      int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+async def run_workload(base_url: str, make_request: Callable[[], RequestSpec],
+                       total: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url,
+                                 limits=limits,
+                                 timeout=60) as client:
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                method, path, body, headers = make_request()
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method,
+                                                    path,
+                                                    json=body,
+                                                    headers=headers)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.05)
+    raise RuntimeError(f"port {port} did not open")
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    """Return a description of every workload that regressed"""
+    failures = []
+    for name, current in results["workloads"].items():
+        previous = baseline.get("workloads", {}).get(name)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            failures.append(f"{name}: p95 {previous['p95_ms']} -> "
+                            f"{current['p95_ms']} ms")
+        if current["requests_per_sec"] < previous["requests_per_sec"] * (
+                1 - max_regression):
+            failures.append(f"{name}: throughput "
+                            f"{previous['requests_per_sec']} -> "
+                            f"{current['requests_per_sec']} req/s")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workloads", nargs="+", default=WORKLOADS,
+                        choices=WORKLOADS)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per workload")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=10.0,
+                        help="injected latency for every fake service")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--telnyx-error-rate", type=float, default=0.0)
+    parser.add_argument("--clients", type=int, default=500,
+                        help="clients seeded into the fake database")
+    parser.add_argument("--events", type=int, default=500,
+                        help="events seeded into the fake calendar")
+    parser.add_argument("--app-workers", type=int, default=1)
+    parser.add_argument("--out", help="also write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    supabase_port, telnyx_port, google_port, app_port = (_free_port()
+                                                         for _ in range(4))
+    google_base = f"http://127.0.0.1:{google_port}/"
+    fakes = subprocess.Popen([
+        sys.executable,
+        os.path.join(BENCH_DIR, "fakes.py"), "--supabase-port",
+        str(supabase_port), "--telnyx-port",
+        str(telnyx_port), "--google-port",
+        str(google_port), "--latency-ms",
+        str(args.latency_ms), "--jitter-ms",
+        str(args.jitter_ms), "--telnyx-error-rate",
+        str(args.telnyx_error_rate), "--clients",
+        str(args.clients), "--events",
+        str(args.events)
+    ])
+    env = dict(os.environ,
+               SUPABASE_URL=f"http://127.0.0.1:{supabase_port}",
+               TELNYX_API_KEY="fake-key",
+               TELNYX_MESSAGING_PROFILE_ID="fake-profile",
+               TELNYX_PHONE_NUMBER="+15550009999",
+               TELNYX_API_BASE=f"http://127.0.0.1:{telnyx_port}",
+               GOOGLE_CALENDAR_API_ENDPOINT=google_base,
+               # The harness drives one operator far past the SMS and
+               # calendar limits on purpose
+               RATE_LIMIT_ENABLED=os.getenv("RATE_LIMIT_ENABLED", "false"),
+               LOG_LEVEL="WARNING")
+    app = subprocess.Popen([
+        sys.executable, "server.py", "--host", "127.0.0.1", "--port",
+        str(app_port), "--workers",
+        str(args.app_workers)
+    ],
+                           cwd=BACKEND_DIR,
+                           env=env)
+
+    try:
+        for port in (supabase_port, telnyx_port, google_port, app_port):
+            _wait_for_port(port)
+        workloads = Workloads(args.clients, google_base)
+        base_url = f"http://127.0.0.1:{app_port}"
+        results = {
+            "config": {
+                "latency_ms": args.latency_ms,
+                "jitter_ms": args.jitter_ms,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "clients": args.clients,
+                "events": args.events,
+                "app_workers": args.app_workers,
+                "cpu_count": os.cpu_count(),
+            },
+            "workloads": {}
+        }
+        for name in args.workloads:
+            results["workloads"][name] = asyncio.run(
+                run_workload(base_url, workloads.get(name), args.requests,
+                             args.concurrency))
+    finally:
+        _stop(app)
+        _stop(fakes)
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.out:
+        with open(args.out, "w") as handle:
+            handle.write(report + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            failures = compare(results, json.load(handle),
+                               args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
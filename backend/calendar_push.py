@@ -0,0 +1,434 @@
+"""Google Calendar push notifications, in place of polling on every view.
+
+POST /api/calendar/watch opens an events.watch channel on a calendar, and
+Google then POSTs to CALENDAR_WEBHOOK_URL (/api/calendar/webhook) whenever
+that calendar changes. Notifications carry no event data, so the worker
+that receives one runs an incremental sync with the channel's stored
+credentials: the cached copy of the calendar (event_cache) and the client
+event index (event_index) take in only the changed events, and the change
+is recorded on the channel's row in calendar_channels (migrations/007).
+
+Every worker runs a PushHub task that reads the live channels every
+CALENDAR_PUSH_POLL_INTERVAL seconds. A bumped change_seq invalidates the
+worker's own copy of that calendar and is pushed to the browsers streaming
+from it (GET /api/calendar/watch/{id}/stream). While a channel is live,
+views are answered from the copy without asking Google, so Google is
+called once per change instead of once per view.
+
+Channels expire after CALENDAR_CHANNEL_TTL seconds (or earlier, if Google
+says so). The hub replaces a channel CALENDAR_CHANNEL_RENEW_BEFORE seconds
+ahead of its expiration; a conditional status update makes sure only one
+worker does.
+
+The account's OAuth grant is stored encrypted with CALENDAR_CREDENTIALS_KEY
+(a Fernet key, see `Fernet.generate_key()`); push stays off without one.
+calendar_channels is only readable with the service role key.
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from cryptography.fernet import Fernet
+
+import event_cache
+import event_index
+from database import supabase
+from responses import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_WEBHOOK_URL = os.getenv("CALENDAR_WEBHOOK_URL", "")
+CALENDAR_CREDENTIALS_KEY = os.getenv("CALENDAR_CREDENTIALS_KEY", "")
+CALENDAR_CHANNEL_TTL = int(
+    os.getenv("CALENDAR_CHANNEL_TTL", str(7 * 24 * 3600)))
+CALENDAR_CHANNEL_RENEW_BEFORE = int(
+    os.getenv("CALENDAR_CHANNEL_RENEW_BEFORE", str(6 * 3600)))
+CALENDAR_PUSH_POLL_INTERVAL = float(
+    os.getenv("CALENDAR_PUSH_POLL_INTERVAL", "5"))
+# A renewal that hasn't finished after this long is taken over
+RENEWAL_TIMEOUT = 300
+# Changed event ids listed per change message
+MAX_CHANGED_IDS = 200
+# Messages held for a slow stream client before newer ones are dropped
+STREAM_QUEUE_SIZE = 100
+
+TABLE = "calendar_channels"
+LIVE_COLUMNS = ("id, cache_key, channel_id, status, expiration, change_seq, "
+                "last_changes, updated_at")
+
+
+def enabled() -> bool:
+    return bool(CALENDAR_WEBHOOK_URL and CALENDAR_CREDENTIALS_KEY)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _seal(credentials_dict: dict) -> str:
+    """Encrypt a grant for storage"""
+    return Fernet(CALENDAR_CREDENTIALS_KEY).encrypt(
+        json.dumps(credentials_dict).encode()).decode()
+
+
+def _credentials(row: dict) -> dict:
+    """The grant stored on a channel row"""
+    return json.loads(
+        Fernet(CALENDAR_CREDENTIALS_KEY).decrypt(
+            row["sealed_credentials"].encode()))
+
+
+def _google(credentials_dict: dict):
+    """Credentials and Calendar service for a stored grant"""
+    # Imported here: the calendar router imports this module
+    from google.oauth2.credentials import Credentials
+    from routers.calendar import SCOPES, _build_service
+    credentials = Credentials.from_authorized_user_info(
+        credentials_dict, SCOPES)
+    return credentials, _build_service(credentials)
+
+
+def _refreshed(credentials_dict: dict, credentials) -> Optional[dict]:
+    """The stored grant with a refreshed access token, if it was refreshed"""
+    if credentials.token == credentials_dict.get("token"):
+        return None
+    return {
+        **credentials_dict, "token":
+        credentials.token,
+        "expiry":
+        credentials.expiry.strftime("%Y-%m-%dT%H:%M:%S")
+        if credentials.expiry else None
+    }
+
+
+def _watch(service, calendar_id: str, channel_id: str, token: str) -> dict:
+    return service.events().watch(calendarId=calendar_id,
+                                  body={
+                                      "id": channel_id,
+                                      "type": "web_hook",
+                                      "address": CALENDAR_WEBHOOK_URL,
+                                      "token": token,
+                                      "params": {
+                                          "ttl": str(CALENDAR_CHANNEL_TTL)
+                                      }
+                                  }).execute()
+
+
+def _expiration(response: dict) -> datetime:
+    if response.get("expiration"):
+        return datetime.fromtimestamp(
+            int(response["expiration"]) / 1000, timezone.utc)
+    return _now() + timedelta(seconds=CALENDAR_CHANNEL_TTL)
+
+
+def _stop(service, channel_id: str, resource_id: Optional[str]) -> None:
+    try:
+        service.channels().stop(body={
+            "id": channel_id,
+            "resourceId": resource_id
+        }).execute()
+    except Exception as e:
+        # Expired or already stopped; Google sends nothing more either way
+        logger.warning("Failed to stop calendar channel %s: %s", channel_id,
+                       e)
+
+
+class ChannelStore:
+    """calendar_channels rows through the Supabase client"""
+
+    def get(self, watch_id: str) -> Optional[dict]:
+        rows = supabase.table(TABLE).select("*").eq("id",
+                                                    watch_id).execute().data
+        return rows[0] if rows else None
+
+    def by_channel(self, channel_id: str) -> Optional[dict]:
+        rows = supabase.table(TABLE).select("*").eq(
+            "channel_id", channel_id).execute().data
+        return rows[0] if rows else None
+
+    def live_for(self, cache_key: str) -> Optional[dict]:
+        rows = supabase.table(TABLE).select("*").eq(
+            "cache_key", cache_key).neq("status", "stopped").execute().data
+        return rows[0] if rows else None
+
+    def live(self) -> List[dict]:
+        return supabase.table(TABLE).select(LIVE_COLUMNS).neq(
+            "status", "stopped").execute().data
+
+    def create(self, row: dict) -> dict:
+        return supabase.table(TABLE).insert(row).execute().data[0]
+
+    def update(self, watch_id: str, changes: dict) -> None:
+        supabase.table(TABLE).update({
+            **changes, "updated_at": _now().isoformat()
+        }, returning="minimal").eq("id", watch_id).execute()
+
+    def claim_renewal(self, watch_id: str,
+                      channel_id: str) -> Optional[dict]:
+        """Mark the channel as being renewed by us; None if someone else is"""
+        cutoff = (_now() - timedelta(seconds=RENEWAL_TIMEOUT)).isoformat()
+        rows = supabase.table(TABLE).update({
+            "status": "renewing",
+            "updated_at": _now().isoformat()
+        }).eq("id", watch_id).eq("channel_id", channel_id).or_(
+            f"status.eq.active,and(status.eq.renewing,updated_at.lt.{cutoff})"
+        ).execute().data
+        return rows[0] if rows else None
+
+    def touch(self, watch_id: str, changes: dict) -> int:
+        """Record a change; returns the channel's new change_seq"""
+        return supabase.rpc("calendar_channel_touch", {
+            "p_id": watch_id,
+            "p_changes": changes
+        }).execute().data
+
+
+class PushHub:
+
+    def __init__(self, store: Optional[ChannelStore] = None):
+        self.store = store or ChannelStore()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # change_seq of each channel this worker has already acted on
+        self._seen: Dict[str, int] = {}
+        self._syncing: Dict[str, asyncio.Task] = {}
+        self._pending: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "notifications": 0,
+            "syncs": 0,
+            "renewals": 0,
+            "failures": 0
+        }
+
+    def start(self) -> None:
+        if self._task is None and enabled():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        tasks = list(self._syncing.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Channels (blocking; run in a thread)
+
+    def open_channel(self, credentials_dict: dict, calendar_id: str) -> dict:
+        """Watch a calendar, or return the live channel already on it"""
+        key = event_cache.cache_key(credentials_dict, calendar_id)
+        existing = self.store.live_for(key)
+        if existing is not None:
+            return existing
+
+        credentials, service = _google(credentials_dict)
+        resolved_id = event_index.resolve_calendar_id(service, calendar_id)
+        channel_id, token = str(uuid.uuid4()), secrets.token_urlsafe(32)
+        response = _watch(service, calendar_id, channel_id, token)
+        try:
+            row = self.store.create({
+                "calendar_id": calendar_id,
+                "resolved_calendar_id": resolved_id,
+                "cache_key": key,
+                "sealed_credentials":
+                _seal(_refreshed(credentials_dict, credentials)
+                      or credentials_dict),
+                "channel_id": channel_id,
+                "resource_id": response.get("resourceId"),
+                "token": token,
+                "stream_token": secrets.token_urlsafe(32),
+                "expiration": _expiration(response).isoformat(),
+            })
+        except Exception:
+            # Lost a race with another request watching the same calendar
+            _stop(service, channel_id, response.get("resourceId"))
+            existing = self.store.live_for(key)
+            if existing is None:
+                raise
+            return existing
+        logger.info("Opened calendar channel %s on %s", row["id"],
+                    resolved_id)
+        return row
+
+    def close_channel(self, row: dict) -> None:
+        _, service = _google(_credentials(row))
+        _stop(service, row["channel_id"], row.get("resource_id"))
+        self.store.update(row["id"], {"status": "stopped"})
+        logger.info("Closed calendar channel %s", row["id"])
+
+    def _renew(self, row: dict) -> None:
+        """Replace the channel's Google channel with a fresh one"""
+        try:
+            credentials_dict = _credentials(row)
+            credentials, service = _google(credentials_dict)
+            channel_id = str(uuid.uuid4())
+            response = _watch(service, row["calendar_id"], channel_id,
+                              row["token"])
+        except Exception:
+            self.store.update(row["id"], {"status": "active"})
+            raise
+        changes = {
+            "channel_id": channel_id,
+            "resource_id": response.get("resourceId"),
+            "expiration": _expiration(response).isoformat(),
+            "status": "active"
+        }
+        refreshed = _refreshed(credentials_dict, credentials)
+        if refreshed:
+            changes["sealed_credentials"] = _seal(refreshed)
+        self.store.update(row["id"], changes)
+        # Notifications still in flight on the old channel are ignored by
+        # the webhook; the new one reports the same changes
+        _stop(service, row["channel_id"], row.get("resource_id"))
+        self.stats["renewals"] += 1
+        logger.info("Renewed calendar channel %s", row["id"])
+
+    def _sync(self, row: dict) -> dict:
+        """Take the calendar's changes into the cache and client index"""
+        credentials_dict = _credentials(row)
+        credentials, service = _google(credentials_dict)
+        cache = event_cache.for_credentials(credentials_dict,
+                                            row["calendar_id"])
+        items, incremental = cache.refresh(service,
+                                           row["calendar_id"],
+                                           force=True)
+        if incremental:
+            event_index.apply(items, row["resolved_calendar_id"])
+        else:
+            # First sync on this worker: the index keeps its own token
+            event_index.sync(service, row["calendar_id"])
+        refreshed = _refreshed(credentials_dict, credentials)
+        if refreshed:
+            row["sealed_credentials"] = _seal(refreshed)
+            self.store.update(row["id"], {
+                "sealed_credentials": row["sealed_credentials"]
+            })
+
+        if not incremental:
+            return {"full": True, "changed": [], "removed": []}
+        removed = [i["id"] for i in items if i.get("status") == "cancelled"]
+        changed = [i["id"] for i in items if i.get("status") != "cancelled"]
+        return {
+            "full": len(items) > MAX_CHANGED_IDS,
+            "changed": changed[:MAX_CHANGED_IDS],
+            "removed": removed[:MAX_CHANGED_IDS]
+        }
+
+    # Notifications and stream clients
+
+    def subscribe(self, watch_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._subscribers.setdefault(str(watch_id), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, watch_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(str(watch_id))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[str(watch_id)]
+
+    def _publish(self, watch_id: str, message: dict) -> None:
+        for queue in self._subscribers.get(watch_id, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                pass
+
+    def notify(self, row: dict) -> None:
+        """Sync a channel's calendar after a change notification.
+
+        Notifications that arrive while a sync of the same channel runs
+        are folded into one more sync after it.
+        """
+        watch_id = str(row["id"])
+        self.stats["notifications"] += 1
+        if watch_id in self._syncing:
+            self._pending.add(watch_id)
+            return
+        self._syncing[watch_id] = asyncio.create_task(
+            self._sync_changes(row))
+
+    async def _sync_changes(self, row: dict) -> None:
+        watch_id = str(row["id"])
+        try:
+            while True:
+                self._pending.discard(watch_id)
+                try:
+                    changes = await asyncio.to_thread(self._sync, row)
+                    seq = await asyncio.to_thread(self.store.touch, watch_id,
+                                                  changes)
+                    self._seen[watch_id] = seq
+                    self.stats["syncs"] += 1
+                    self._publish(watch_id, {"seq": seq, **changes})
+                except Exception as e:
+                    self.stats["failures"] += 1
+                    logger.error("Failed to sync calendar channel %s: %s",
+                                 watch_id, e)
+                if watch_id not in self._pending:
+                    return
+        finally:
+            self._syncing.pop(watch_id, None)
+
+    async def _poll(self) -> None:
+        rows = await asyncio.to_thread(self.store.live)
+        now = time.time()
+        for row in rows:
+            watch_id = str(row["id"])
+            expiration = parse_timestamp(row["expiration"]).timestamp()
+            cache = event_cache.peek(row["cache_key"])
+            if cache is not None:
+                cache.mark_pushed(expiration)
+            seen = self._seen.get(watch_id)
+            if seen is None:
+                self._seen[watch_id] = row["change_seq"]
+            elif row["change_seq"] > seen:
+                # Synced by another worker: our copy is behind
+                self._seen[watch_id] = row["change_seq"]
+                if cache is not None:
+                    cache.invalidate()
+                self._publish(watch_id, {
+                    "seq": row["change_seq"],
+                    **(row.get("last_changes") or {})
+                })
+            if expiration - now < CALENDAR_CHANNEL_RENEW_BEFORE:
+                claimed = await asyncio.to_thread(self.store.claim_renewal,
+                                                  watch_id, row["channel_id"])
+                if claimed is not None:
+                    try:
+                        await asyncio.to_thread(self._renew, claimed)
+                    except Exception as e:
+                        self.stats["failures"] += 1
+                        logger.error("Failed to renew calendar channel %s: %s",
+                                     watch_id, e)
+        live = {str(row["id"]) for row in rows}
+        for watch_id in list(self._seen):
+            if watch_id not in live:
+                del self._seen[watch_id]
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._poll()
+            except Exception as e:
+                logger.error("Calendar channel poll failed: %s", e)
+            await asyncio.sleep(CALENDAR_PUSH_POLL_INTERVAL)
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": enabled(),
+            "running": self._task is not None,
+            "channels": len(self._seen),
+            "stream_clients": sum(map(len, self._subscribers.values())),
+            **self.stats
+        }
+
+
+hub = PushHub()
@@ -0,0 +1,120 @@
+"""In-process inverted index over clients' user_defined_fields.
+
+Maps (field, value) to the set of client ids carrying it, so a custom-field
+filter resolves to ids without scanning rows. Used when
+CLIENT_UDF_INDEX=local (single-process or offline deployments); otherwise
+filters are pushed down to PostgREST as JSONB containment. The index is
+loaded on first use, kept current by the clients router's writes, and
+fully reloaded after CLIENT_UDF_INDEX_TTL seconds to pick up changes made
+by other processes.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from database import supabase
+
+logger = logging.getLogger(__name__)
+
+UDF_INDEX_MODE = os.getenv("CLIENT_UDF_INDEX", "postgrest").lower()
+UDF_INDEX_TTL = float(os.getenv("CLIENT_UDF_INDEX_TTL", "300"))
+LOAD_PAGE_SIZE = 1000
+
+
+class UDFIndex:
+
+    def __init__(self):
+        self._postings: Dict[Tuple[str, str], Set[str]] = {}
+        self._fields: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def _add(self, client_id: str, fields: Dict[str, str]) -> None:
+        self._fields[client_id] = fields
+        for key, value in fields.items():
+            self._postings.setdefault((key, str(value)), set()).add(client_id)
+
+    def _discard(self, client_id: str) -> None:
+        for key, value in self._fields.pop(client_id, {}).items():
+            posting = self._postings.get((key, str(value)))
+            if posting is not None:
+                posting.discard(client_id)
+                if not posting:
+                    del self._postings[(key, str(value))]
+
+    def load(self, rows: Iterable[dict]) -> None:
+        with self._lock:
+            self._postings, self._fields = {}, {}
+            for row in rows:
+                self._add(str(row["id"]), row.get("user_defined_fields")
+                          or {})
+            self.loaded_at = time.monotonic()
+
+    def upsert(self, client_id, fields: Optional[Dict[str, str]]) -> None:
+        if not self.loaded:
+            return
+        with self._lock:
+            self._discard(str(client_id))
+            self._add(str(client_id), fields or {})
+
+    def remove(self, client_id) -> None:
+        if not self.loaded:
+            return
+        with self._lock:
+            self._discard(str(client_id))
+
+    def invalidate(self) -> None:
+        """Drop the index so the next lookup reloads it"""
+        with self._lock:
+            self.loaded_at = None
+            self._postings, self._fields = {}, {}
+
+    def lookup(self, filters: Dict[str, str]) -> Set[str]:
+        """Ids of clients matching every (field, value) pair"""
+        # Intersected under the lock: writers change the sets in place
+        with self._lock:
+            postings = [
+                self._postings.get((key, str(value)), set())
+                for key, value in filters.items()
+            ]
+            if not postings:
+                return set()
+            postings.sort(key=len)
+            result = set(postings[0])
+            for posting in postings[1:]:
+                result &= posting
+                if not result:
+                    break
+            return result
+
+
+udf_index = UDFIndex()
+
+
+def _fetch_all_fields():
+    offset = 0
+    while True:
+        page = supabase.table("clients").select(
+            "id, user_defined_fields").order("id").range(
+                offset, offset + LOAD_PAGE_SIZE - 1).execute().data
+        yield from page
+        if len(page) < LOAD_PAGE_SIZE:
+            return
+        offset += LOAD_PAGE_SIZE
+
+
+def ensure_loaded() -> UDFIndex:
+    """Load the index on first use, or reload it once it is past its TTL"""
+    if (not udf_index.loaded
+            or time.monotonic() - udf_index.loaded_at > UDF_INDEX_TTL):
+        started = time.perf_counter()
+        udf_index.load(_fetch_all_fields())
+        logger.info("Loaded user-defined field index in %.1f ms",
+                    (time.perf_counter() - started) * 1000)
+    return udf_index
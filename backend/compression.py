@@ -0,0 +1,202 @@
+"""Negotiated gzip/brotli compression for response bodies.
+
+Responses of a compressible type whose body reaches COMPRESSION_MIN_SIZE
+bytes are encoded with brotli when the client accepts it and the `brotli`
+package is installed, otherwise with gzip. Small bodies, responses that are
+already encoded and binary types (document redirects, images) pass through
+untouched, as are server-sent event streams. Streaming bodies are
+compressed chunk by chunk.
+"""
+import gzip
+import os
+import zlib
+from typing import List, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+# Brotli's higher qualities are meant for static assets; 4 compresses JSON
+# better than gzip -6 at a similar CPU cost
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript",
+                      "application/xml", "application/problem+json")
+# Server-sent events must reach the browser as they are written; an encoder
+# would hold them back until its buffer fills
+EXCLUDED_TYPES = ("text/event-stream", )
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header, or None"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    if content_type.startswith(EXCLUDED_TYPES):
+        return False
+    return (content_type.startswith(COMPRESSIBLE_TYPES)
+            or content_type.split(";")[0].endswith(("+json", "+xml")))
+
+
+class _Encoder:
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                                16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """ASGI middleware applying negotiated response compression"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message: Optional[dict] = None
+        self.encoder: Optional[_Encoder] = None
+        self.passthrough = False
+
+    def _headers(self) -> List:
+        return list(self.start_message.get("headers", []))
+
+    def _eligible(self) -> bool:
+        status = self.start_message["status"]
+        if status < 200 or status in (204, 304):
+            return False
+        content_type = ""
+        for key, value in self.start_message.get("headers", []):
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type":
+                content_type = value.decode("latin-1")
+        return _is_compressible(content_type)
+
+    def _encoded_headers(self, length: Optional[int]) -> List:
+        headers = [(key, value) for key, value in self._headers()
+                   if key != b"content-length"]
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", b"Accept-Encoding"))
+        return headers
+
+    async def __call__(self, message: dict) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is not None:
+            data = self.encoder.compress(body)
+            if not more_body:
+                data += self.encoder.finish()
+            await self.send({
+                "type": "http.response.body",
+                "body": data,
+                "more_body": more_body
+            })
+            return
+
+        # First body message: decide whether this response gets compressed
+        if not self._eligible() or (not more_body
+                                    and len(body) < self.minimum_size):
+            self.passthrough = True
+            if self._eligible():
+                self.start_message["headers"] = self._headers() + [
+                    (b"vary", b"Accept-Encoding")
+                ]
+            await self.send(self.start_message)
+            await self.send(message)
+            return
+
+        if not more_body:
+            data = compress_body(body, self.encoding)
+            self.start_message["headers"] = self._encoded_headers(len(data))
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": data})
+            return
+
+        self.encoder = _Encoder(self.encoding)
+        self.start_message["headers"] = self._encoded_headers(None)
+        await self.send(self.start_message)
+        await self.send({
+            "type": "http.response.body",
+            "body": self.encoder.compress(body),
+            "more_body": True
+        })
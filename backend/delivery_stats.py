@@ -0,0 +1,148 @@
+"""Hourly message counts by operator phone, direction and status.
+
+GET /api/messages/stats used to group the messages table on every call.
+Instead, `message_stats_hourly` (migrations/009) keeps one row per operator
+phone, hour the message was created in, direction and status, and the SQL
+report functions read those rows.
+
+The send path and the Telnyx webhook report each message they store, and
+each status change, to this worker's StatsAggregator as +1/-1 deltas on
+those buckets. Every DELIVERY_STATS_FLUSH_INTERVAL seconds the deltas are
+added to the table in one message_stats_hourly_add() call. It adds rather
+than overwrites, so any number of workers can flush into the same buckets.
+If a flush fails, its deltas are put back and retried on the next one.
+Stopping the worker flushes whatever is left.
+"""
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+from database import supabase
+from responses import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_STATS_FLUSH_INTERVAL = float(
+    os.getenv("DELIVERY_STATS_FLUSH_INTERVAL", "10"))
+
+TABLE = "message_stats_hourly"
+
+# (operator phone, hour, direction, status)
+Bucket = Tuple[str, str, str, str]
+
+
+def operator_phone(message: dict) -> str:
+    """The operator's side of a message; "" if it has none"""
+    if message.get("direction") == "outbound":
+        return message.get("from_number") or ""
+    return message.get("to_number") or ""
+
+
+def _hour(created_at: Union[str, datetime, None]) -> Optional[str]:
+    value = parse_timestamp(created_at)
+    if value is None:
+        return None
+    return value.replace(minute=0, second=0, microsecond=0).isoformat()
+
+
+class StatsAggregator:
+
+    def __init__(self):
+        self._pending: Dict[Bucket, int] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "flushes": 0, "failures": 0}
+
+    def record(self,
+               message: dict,
+               status: Optional[str] = None,
+               delta: int = 1) -> None:
+        """Count `message` under `status` (default: its own) in its hour"""
+        hour = _hour(message.get("created_at"))
+        status = status or message.get("status")
+        if hour is None or not status:
+            logger.warning("Not counting message %s without created_at or "
+                           "status", message.get("id"))
+            return
+        bucket = (operator_phone(message), hour, message.get("direction")
+                  or "", status)
+        with self._lock:
+            self._pending[bucket] = self._pending.get(bucket, 0) + delta
+            self.stats["recorded"] += 1
+
+    def transition(self, message: dict, old_status: Optional[str],
+                   new_status: str) -> None:
+        """Move a stored message from one status bucket to another"""
+        if old_status == new_status:
+            return
+        if old_status:
+            self.record(message, old_status, -1)
+        self.record(message, new_status, 1)
+
+    def _restore(self, pending: Dict[Bucket, int]) -> None:
+        with self._lock:
+            for bucket, delta in pending.items():
+                self._pending[bucket] = self._pending.get(bucket, 0) + delta
+
+    def flush(self) -> int:
+        """Add the pending deltas to the table; returns the buckets written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        rows: List[dict] = [{
+            "operator_phone": phone,
+            "hour": hour,
+            "direction": direction,
+            "status": status,
+            "messages": delta
+        } for (phone, hour, direction, status), delta in pending.items()
+                            if delta]
+        if not rows:
+            return 0
+        try:
+            supabase.rpc("message_stats_hourly_add", {
+                "p_rows": rows
+            }).execute()
+        except Exception:
+            self.stats["failures"] += 1
+            self._restore(pending)
+            raise
+        self.stats["flushes"] += 1
+        logger.debug("Flushed %s message stats buckets", len(rows))
+        return len(rows)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception as e:
+            logger.error("Final message stats flush failed: %s", e)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(DELIVERY_STATS_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error("Message stats flush failed: %s", e)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pending = sum(1 for delta in self._pending.values() if delta)
+        return {
+            "running": self._task is not None,
+            "pending_buckets": pending,
+            **self.stats
+        }
+
+
+aggregator = StatsAggregator()
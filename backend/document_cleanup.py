@@ -0,0 +1,379 @@
+"""Background removal of a client's documents from storage.
+
+Deleting a client used to call `remove(["client_<id>"])` inline. Storage
+removes objects by exact path, so that folder name matched nothing and the
+nested files were left behind, while the request waited on the call. Jobs
+here walk the client's prefix page by page and remove the files in
+concurrent, retried batches; `delete_client` returns as soon as the row is
+gone and the job reports its progress through `get_job`.
+
+Jobs are rows in `document_cleanup_jobs` (migrations/012), written when
+the client row is deleted. The worker that deleted the client starts the
+job right away. A worker runs a job under a lease and renews it along with
+the job's progress every CLEANUP_HEARTBEAT seconds. Every
+DOCUMENT_CLEANUP_POLL_INTERVAL seconds each worker's CleanupRunner picks
+up pending jobs and jobs whose lease ran out, so a restart or a crashed
+worker doesn't leave a prefix behind. Removing files is idempotent, so a
+job that runs again just lists what is left. After MAX_JOB_ATTEMPTS runs
+a job is left as failed.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from database import supabase
+from storage import DOCUMENTS_BUCKET, list_objects, remove_objects
+
+logger = logging.getLogger(__name__)
+
+LIST_PAGE_SIZE = 100
+REMOVE_BATCH_SIZE = int(os.getenv("DOCUMENT_CLEANUP_BATCH", "100"))
+REMOVE_CONCURRENCY = int(os.getenv("DOCUMENT_CLEANUP_CONCURRENCY", "4"))
+# Jobs walking storage at the same time in one worker; the rest wait
+MAX_RUNNING_JOBS = int(os.getenv("DOCUMENT_CLEANUP_MAX_JOBS", "4"))
+DOCUMENT_CLEANUP_POLL_INTERVAL = float(
+    os.getenv("DOCUMENT_CLEANUP_POLL_INTERVAL", "60"))
+# Finished jobs are kept this many days for status queries
+DOCUMENT_CLEANUP_RETENTION_DAYS = int(
+    os.getenv("DOCUMENT_CLEANUP_RETENTION_DAYS", "7"))
+MAX_ATTEMPTS = 3
+MAX_JOB_ATTEMPTS = 5
+CLEANUP_LEASE = 120
+CLEANUP_HEARTBEAT = 15
+
+TABLE = "document_cleanup_jobs"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobStore:
+    """document_cleanup_jobs rows through the Supabase client"""
+
+    def enqueue(self, prefixes: List[str], bucket: str) -> None:
+        if not prefixes:
+            return
+        now = _now().isoformat()
+        supabase.table(TABLE).upsert([{
+            "prefix": prefix,
+            "bucket": bucket,
+            "status": "pending",
+            "listed": 0,
+            "deleted": 0,
+            "failed": 0,
+            "errors": [],
+            "attempts": 0,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "started_at": None,
+            "finished_at": None,
+            "updated_at": now
+        } for prefix in prefixes],
+                                     on_conflict="prefix",
+                                     returning="minimal").execute()
+
+    def get(self, prefix: str) -> Optional[dict]:
+        rows = supabase.table(TABLE).select("*").eq("prefix",
+                                                    prefix).execute().data
+        return rows[0] if rows else None
+
+    def claimable(self, limit: int) -> List[dict]:
+        """Pending jobs and running jobs whose lease has run out"""
+        now = _now().isoformat()
+        return supabase.table(TABLE).select("prefix, bucket").or_(
+            f'status.eq.pending,and(status.eq.running,'
+            f'lease_expires_at.lt."{now}")').order("created_at").limit(
+                limit).execute().data
+
+    def claim(self, prefix: str, owner: str) -> Optional[dict]:
+        """Take the job's lease; None if another worker holds it"""
+        now = _now()
+        rows = supabase.table(TABLE).select("attempts, status").eq(
+            "prefix", prefix).execute().data
+        if not rows:
+            return None
+        attempts = (rows[0].get("attempts") or 0) + 1
+        # Conditional on the attempts read above: of two workers claiming
+        # the same job, only one update matches
+        claimed = supabase.table(TABLE).update({
+            "status": "running",
+            "attempts": attempts,
+            "lease_owner": owner,
+            "lease_expires_at":
+            (now + timedelta(seconds=CLEANUP_LEASE)).isoformat(),
+            "started_at": now.isoformat(),
+            "updated_at": now.isoformat()
+        }).eq("prefix", prefix).eq("attempts", attempts - 1).or_(
+            f'status.eq.pending,and(status.eq.running,'
+            f'lease_expires_at.lt."{now.isoformat()}")').execute().data
+        return claimed[0] if claimed else None
+
+    def update(self, prefix: str, owner: str, changes: dict) -> None:
+        supabase.table(TABLE).update({
+            **changes, "updated_at": _now().isoformat()
+        }, returning="minimal").eq("prefix", prefix).eq(
+            "lease_owner", owner).execute()
+
+    def prune(self) -> None:
+        cutoff = _now() - timedelta(days=DOCUMENT_CLEANUP_RETENTION_DAYS)
+        supabase.table(TABLE).delete(returning="minimal").in_(
+            "status", ["completed", "failed"]).lt("finished_at",
+                                                  cutoff.isoformat()).execute()
+
+
+class CleanupJob:
+
+    def __init__(self,
+                 prefix: str,
+                 bucket: str = DOCUMENTS_BUCKET,
+                 attempts: int = 1):
+        self.prefix = prefix
+        self.bucket = bucket
+        self.attempts = attempts
+        self.status = "running"
+        self.listed = 0
+        self.deleted = 0
+        self.failed = 0
+        self.errors: List[str] = []
+        self._semaphore = asyncio.Semaphore(REMOVE_CONCURRENCY)
+
+    def progress(self) -> dict:
+        return {
+            "status": self.status,
+            "listed": self.listed,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "errors": self.errors[-5:],
+        }
+
+    async def _remove_batch(self, paths: List[str]) -> None:
+        async with self._semaphore:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                try:
+                    await remove_objects(self.bucket, paths)
+                    self.deleted += len(paths)
+                    return
+                except Exception as e:
+                    if attempt == MAX_ATTEMPTS:
+                        self.failed += len(paths)
+                        self.errors.append(str(e)[:200])
+                        logger.warning(
+                            "Giving up on %s objects under %s: %s",
+                            len(paths), self.prefix, e)
+                        return
+                    await asyncio.sleep(0.5 * 2**(attempt - 1))
+
+    async def _list_folder(self, folder: str) -> List[dict]:
+        entries, offset = [], 0
+        while True:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                try:
+                    page = await list_objects(self.bucket, folder,
+                                              LIST_PAGE_SIZE, offset)
+                    break
+                except Exception:
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(0.5 * 2**(attempt - 1))
+            entries.extend(page)
+            if len(page) < LIST_PAGE_SIZE:
+                return entries
+            offset += LIST_PAGE_SIZE
+
+    async def _walk(self, folder: str, batches: List[asyncio.Task]) -> None:
+        # A folder is listed completely before any of its files are removed,
+        # so offset-based pages don't shift underneath the listing
+        entries = await self._list_folder(folder)
+        files = [
+            f"{folder}/{entry['name']}" for entry in entries
+            if entry.get("id") is not None
+        ]
+        folders = [
+            f"{folder}/{entry['name']}" for entry in entries
+            if entry.get("id") is None
+        ]
+        self.listed += len(files)
+        for start in range(0, len(files), REMOVE_BATCH_SIZE):
+            batches.append(
+                asyncio.create_task(
+                    self._remove_batch(files[start:start +
+                                             REMOVE_BATCH_SIZE])))
+        for child in folders:
+            await self._walk(child, batches)
+
+    async def run(self) -> None:
+        batches: List[asyncio.Task] = []
+        try:
+            await self._walk(self.prefix, batches)
+            await asyncio.gather(*batches)
+            self.status = "completed" if not self.failed else "failed"
+        except Exception as e:
+            await asyncio.gather(*batches, return_exceptions=True)
+            self.status = "failed"
+            self.errors.append(str(e)[:200])
+            logger.error("Document cleanup for %s failed: %s", self.prefix,
+                         e)
+        logger.info("Document cleanup for %s %s: %s deleted, %s failed",
+                    self.prefix, self.status, self.deleted, self.failed)
+
+
+class CleanupRunner:
+
+    def __init__(self, store: Optional[JobStore] = None):
+        self.store = store or JobStore()
+        self.owner = ""
+        self._slots: Optional[asyncio.Semaphore] = None
+        # Prefixes this worker is running or about to run
+        self._local: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"completed": 0, "failed": 0, "resumed": 0}
+
+    def _ensure_owner(self) -> None:
+        # Set on first use rather than at import: server.py forks after
+        # importing
+        if not self.owner:
+            self.owner = (f"{socket.gethostname()}:{os.getpid()}:"
+                          f"{secrets.token_hex(3)}")
+            self._slots = asyncio.Semaphore(MAX_RUNNING_JOBS)
+
+    def start(self) -> None:
+        self._ensure_owner()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        tasks = list(self._local.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        # Interrupted jobs keep their lease until it runs out, then another
+        # worker resumes them
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def spawn(self, prefix: str) -> None:
+        """Run a job in this worker once a slot is free, unless it already is"""
+        self._ensure_owner()
+        if prefix in self._local:
+            return
+        task = asyncio.create_task(self._execute(prefix))
+        self._local[prefix] = task
+        task.add_done_callback(lambda _: self._local.pop(prefix, None))
+
+    async def _execute(self, prefix: str) -> None:
+        async with self._slots:
+            try:
+                row = await asyncio.to_thread(self.store.claim, prefix,
+                                              self.owner)
+            except Exception as e:
+                logger.error("Failed to claim document cleanup for %s: %s",
+                             prefix, e)
+                return
+            if row is None:
+                return
+            if row["attempts"] > MAX_JOB_ATTEMPTS:
+                await asyncio.to_thread(
+                    self.store.update, prefix, self.owner, {
+                        "status": "failed",
+                        "errors": ["Gave up after repeated attempts"],
+                        "lease_owner": None,
+                        "finished_at": _now().isoformat()
+                    })
+                return
+            job = CleanupJob(prefix, row.get("bucket") or DOCUMENTS_BUCKET,
+                             row["attempts"])
+            heartbeat = asyncio.create_task(self._heartbeat(job))
+            try:
+                await job.run()
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+            self.stats[job.status] += 1
+            try:
+                await asyncio.to_thread(
+                    self.store.update, prefix, self.owner, {
+                        **job.progress(), "lease_owner": None,
+                        "lease_expires_at": None,
+                        "finished_at": _now().isoformat()
+                    })
+            except Exception as e:
+                logger.error("Failed to record document cleanup for %s: %s",
+                             prefix, e)
+
+    async def _heartbeat(self, job: CleanupJob) -> None:
+        while True:
+            await asyncio.sleep(CLEANUP_HEARTBEAT)
+            try:
+                await asyncio.to_thread(
+                    self.store.update, job.prefix, self.owner, {
+                        **job.progress(), "lease_expires_at":
+                        (_now() +
+                         timedelta(seconds=CLEANUP_LEASE)).isoformat()
+                    })
+            except Exception as e:
+                logger.warning("Failed to renew document cleanup for %s: %s",
+                               job.prefix, e)
+
+    async def _poll(self) -> None:
+        free = MAX_RUNNING_JOBS - len(self._local)
+        if free > 0:
+            rows = await asyncio.to_thread(self.store.claimable, free)
+            for row in rows:
+                if row["prefix"] not in self._local:
+                    self.stats["resumed"] += 1
+                    self.spawn(row["prefix"])
+        await asyncio.to_thread(self.store.prune)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._poll()
+            except Exception as e:
+                logger.error("Document cleanup poll failed: %s", e)
+            await asyncio.sleep(DOCUMENT_CLEANUP_POLL_INTERVAL)
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "local_jobs": len(self._local),
+            **self.stats
+        }
+
+
+runner = CleanupRunner()
+
+
+def schedule_many(prefixes: List[str]) -> List[str]:
+    """Record cleanups for deleted clients' prefixes and start them here.
+
+    At most MAX_RUNNING_JOBS run at once in this worker; the rows stay
+    pending for any worker until one of them gets to them.
+    """
+    prefixes = list(dict.fromkeys(prefixes))
+    runner.store.enqueue(prefixes, DOCUMENTS_BUCKET)
+    for prefix in prefixes:
+        runner.spawn(prefix)
+    return prefixes
+
+
+def schedule_cleanup(prefix: str) -> str:
+    return schedule_many([prefix])[0]
+
+
+def get_job(prefix: str) -> Optional[dict]:
+    """The job's persisted state, as any worker last recorded it"""
+    row = runner.store.get(prefix)
+    if row is None:
+        return None
+    return {
+        key: row.get(key)
+        for key in ("prefix", "bucket", "status", "listed", "deleted",
+                    "failed", "errors", "attempts", "started_at",
+                    "finished_at")
+    }
@@ -0,0 +1,199 @@
+"""In-process copy of each account's calendars, for local views.
+
+POST /api/calendar/events used to ask Google for every occurrence of every
+recurring event in the window (singleEvents=True), so month and year views
+paged through large result sets. Instead each calendar an account views is
+kept here as Google stores it: single events, recurring masters and the
+modified or cancelled occurrences of those masters. A view is answered by
+expanding the masters locally (see recurrence.py).
+
+The first view of a calendar lists it once. Later views, at most every
+CALENDAR_CACHE_TTL seconds, fetch only what changed since, through a sync
+token; writes made through the calendar routes invalidate the copy so the
+next view picks them up. A calendar with a push channel (calendar_push.py)
+is invalidated by its change notifications instead, and otherwise only
+refreshed every CALENDAR_PUSHED_CACHE_TTL seconds. Up to
+CALENDAR_CACHE_SIZE calendars are kept, least recently used first out.
+Copies are keyed by the calendar id and a hash of the account's OAuth
+credentials, so a copy is only ever served to holders of the same grant.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import recurrence
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_CACHE_SIZE = int(os.getenv("CALENDAR_CACHE_SIZE", "64"))
+CALENDAR_CACHE_TTL = float(os.getenv("CALENDAR_CACHE_TTL", "30"))
+CALENDAR_PUSHED_CACHE_TTL = float(
+    os.getenv("CALENDAR_PUSHED_CACHE_TTL", "900"))
+SYNC_PAGE_SIZE = 2500
+
+
+def _is_gone(error: Exception) -> bool:
+    return getattr(getattr(error, "resp", None), "status", None) == 410
+
+
+class CalendarCache:
+
+    def __init__(self):
+        # Single events and recurring masters by id
+        self.events: Dict[str, dict] = {}
+        # Modified or cancelled occurrences by master id, then occurrence key
+        self.exceptions: Dict[str, Dict[str, dict]] = {}
+        self.sync_token: Optional[str] = None
+        self.refreshed_at: Optional[float] = None
+        # Epoch time until which a push channel reports changes
+        self.pushed_until = 0.0
+        self._lock = threading.Lock()
+
+    def _apply(self, event: dict) -> None:
+        master_id = event.get("recurringEventId")
+        if master_id:
+            key = recurrence.occurrence_key(
+                event.get("originalStartTime") or {})
+            self.exceptions.setdefault(master_id, {})[key] = event
+        elif event.get("status") == "cancelled":
+            self.events.pop(event["id"], None)
+            self.exceptions.pop(event["id"], None)
+        else:
+            self.events[event["id"]] = event
+
+    def _list(self, service, calendar_id: str,
+              token: Optional[str]) -> tuple:
+        items, page_token = [], None
+        while True:
+            params = {
+                "calendarId": calendar_id,
+                "maxResults": SYNC_PAGE_SIZE,
+                "singleEvents": False,
+            }
+            if token:
+                # Deletions only come back as cancelled entries if asked for
+                params["syncToken"] = token
+                params["showDeleted"] = True
+            if page_token:
+                params["pageToken"] = page_token
+            page = service.events().list(**params).execute()
+            items.extend(page.get("items", []))
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return items, page.get("nextSyncToken")
+
+    @property
+    def ttl(self) -> float:
+        return (CALENDAR_PUSHED_CACHE_TTL
+                if time.time() < self.pushed_until else CALENDAR_CACHE_TTL)
+
+    def refresh(self,
+                service,
+                calendar_id: str = "primary",
+                force: bool = False) -> Optional[Tuple[List[dict], bool]]:
+        """Catch up with Google unless the copy is under its TTL.
+
+        Returns the changes listed and whether the listing was incremental,
+        or None if the copy was fresh enough.
+        """
+        with self._lock:
+            if (not force and self.refreshed_at is not None
+                    and time.monotonic() - self.refreshed_at < self.ttl):
+                return None
+            token = self.sync_token
+            try:
+                items, next_token = self._list(service, calendar_id, token)
+            except Exception as e:
+                if not (token and _is_gone(e)):
+                    raise
+                logger.info("Calendar sync token expired; relisting")
+                token = None
+                items, next_token = self._list(service, calendar_id, None)
+            if not token:
+                self.events, self.exceptions = {}, {}
+            for item in items:
+                self._apply(item)
+            self.sync_token = next_token
+            self.refreshed_at = time.monotonic()
+            logger.debug("%s calendar refresh: %s changes",
+                         "Incremental" if token else "Full", len(items))
+            return items, bool(token)
+
+    def invalidate(self) -> None:
+        """Make the next view catch up with Google first"""
+        with self._lock:
+            self.refreshed_at = None
+
+    def mark_pushed(self, until: float) -> None:
+        self.pushed_until = until
+
+    def window(self,
+               time_min: Optional[datetime],
+               time_max: Optional[datetime],
+               limit: int = 250) -> List[dict]:
+        """Events and occurrences overlapping the window, by start time"""
+        with self._lock:
+            events = list(self.events.values())
+            exceptions = {
+                master_id: list(by_key.values())
+                for master_id, by_key in self.exceptions.items()
+            }
+
+        singles, series = [], []
+        for event in events:
+            if event.get("recurrence"):
+                series.append(
+                    recurrence.expand(event, exceptions.pop(event["id"], ()),
+                                      time_min, time_max, limit))
+            elif recurrence.overlaps(event, time_min, time_max):
+                singles.append(event)
+        # Occurrences whose master isn't on this calendar
+        for orphans in exceptions.values():
+            singles.extend(
+                event for event in orphans
+                if event.get("status") != "cancelled"
+                and recurrence.overlaps(event, time_min, time_max))
+        singles.sort(key=recurrence.sort_key)
+        return recurrence.merge([singles, *series], limit)
+
+
+_caches: "OrderedDict[str, CalendarCache]" = OrderedDict()
+_caches_lock = threading.Lock()
+
+
+def cache_key(credentials: dict, calendar_id: str = "primary") -> str:
+    secret = credentials.get("refresh_token") or credentials.get("token")
+    return hashlib.sha256(
+        f"{credentials.get('client_id')}:{secret}:{calendar_id}".encode(
+        )).hexdigest()
+
+
+def for_credentials(credentials: dict,
+                    calendar_id: str = "primary") -> CalendarCache:
+    key = cache_key(credentials, calendar_id)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = CalendarCache()
+            while len(_caches) > CALENDAR_CACHE_SIZE:
+                _caches.popitem(last=False)
+        else:
+            _caches.move_to_end(key)
+        return cache
+
+
+def peek(key: str) -> Optional[CalendarCache]:
+    """The cached copy under `key`, if this process holds one"""
+    with _caches_lock:
+        return _caches.get(key)
+
+
+def invalidate(credentials: dict, calendar_id: str = "primary") -> None:
+    cache = peek(cache_key(credentials, calendar_id))
+    if cache is not None:
+        cache.invalidate()
@@ -0,0 +1,213 @@
+"""Index from clients to their Google Calendar events.
+
+An event is linked to a client through the private extended property
+`crm_client_id`. Linked events are mirrored into the `client_events` table
+(migrations/006), keyed by event id, so listing a client's events reads
+that index instead of the whole calendar.
+
+The calendar routes update the index as they create, change or delete
+events. `sync()` catches changes made elsewhere, in Google Calendar itself
+or by other clients. The first sync lists the whole calendar; later syncs
+pass the stored sync token, so they only receive the events changed since
+then, deletions included. When Google expires the token (410 Gone), the
+next sync falls back to a full listing.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import supabase
+from responses import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+CLIENT_ID_PROPERTY = "crm_client_id"
+TABLE = "client_events"
+SYNC_STATE_TABLE = "calendar_sync_state"
+SYNC_PAGE_SIZE = 250
+DELETE_CHUNK_SIZE = 200
+
+
+def client_id_of(event: dict) -> Optional[str]:
+    return ((event.get("extendedProperties") or {}).get("private")
+            or {}).get(CLIENT_ID_PROPERTY) or None
+
+
+def link_properties(event_body: dict, client_id: Optional[str]) -> None:
+    """Set or clear the client link on an event body before it is sent"""
+    private = event_body.setdefault("extendedProperties",
+                                    {}).setdefault("private", {})
+    if client_id:
+        private[CLIENT_ID_PROPERTY] = client_id
+    else:
+        private.pop(CLIENT_ID_PROPERTY, None)
+
+
+def _event_time(value: Optional[dict]) -> Tuple[Optional[str], bool]:
+    """UTC timestamp of a Google start/end, and whether it is all-day"""
+    if not value:
+        return None, False
+    if value.get("dateTime"):
+        parsed = parse_timestamp(value["dateTime"])
+        return (parsed.isoformat() if parsed else None), False
+    if value.get("date"):
+        return datetime.fromisoformat(value["date"]).replace(
+            tzinfo=timezone.utc).isoformat(), True
+    return None, False
+
+
+def index_row(event: dict, calendar_id: str) -> Optional[dict]:
+    """The client_events row for `event`; None if it shouldn't be indexed"""
+    client_id = client_id_of(event)
+    if not client_id or event.get("status") == "cancelled":
+        return None
+    start, all_day = _event_time(event.get("start"))
+    end, _ = _event_time(event.get("end"))
+    original_start, _ = _event_time(event.get("originalStartTime"))
+    updated = parse_timestamp(event.get("updated"))
+    return {
+        "event_id": event["id"],
+        "calendar_id": calendar_id,
+        "client_id": client_id,
+        "summary": event.get("summary"),
+        "description": event.get("description"),
+        "location": event.get("location"),
+        "start_time": start,
+        "end_time": end,
+        "all_day": all_day,
+        "status": event.get("status", "confirmed"),
+        "recurrence": event.get("recurrence"),
+        "recurring_event_id": event.get("recurringEventId"),
+        "original_start_time": original_start,
+        "html_link": event.get("htmlLink"),
+        "event_updated": updated.isoformat() if updated else None,
+        "synced_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def remove(event_ids: Iterable[str]) -> None:
+    event_ids = list(event_ids)
+    for start in range(0, len(event_ids), DELETE_CHUNK_SIZE):
+        supabase.table(TABLE).delete(returning="minimal").in_(
+            "event_id", event_ids[start:start + DELETE_CHUNK_SIZE]).execute()
+
+
+def apply(events: Iterable[dict],
+          calendar_id: str,
+          remove_unlinked: bool = True) -> Dict[str, int]:
+    """Upsert linked events and drop unlinked or cancelled ones.
+
+    A full sync passes remove_unlinked=False: it sweeps stale rows at the
+    end instead of deleting by id for every unlinked event it lists.
+    """
+    rows, removed = [], []
+    for event in events:
+        row = index_row(event, calendar_id)
+        if row is not None:
+            rows.append(row)
+        elif remove_unlinked:
+            removed.append(event["id"])
+    if rows:
+        supabase.table(TABLE).upsert(rows,
+                                     on_conflict="event_id",
+                                     returning="minimal").execute()
+    if removed:
+        remove(removed)
+    return {"indexed": len(rows), "removed": len(removed)}
+
+
+def events_for_client(client_id: str,
+                      time_min: Optional[str] = None,
+                      time_max: Optional[str] = None,
+                      limit: int = 250) -> List[dict]:
+    """Indexed events of a client, ordered by start time"""
+    query = supabase.table(TABLE).select("*").eq("client_id", client_id)
+    if time_min:
+        # A recurring event's start is its first occurrence; keep the
+        # series while later occurrences may still fall in the range
+        query = query.or_(
+            f"start_time.gte.{time_min},recurrence.not.is.null")
+    if time_max:
+        query = query.lt("start_time", time_max)
+    return query.order("start_time").limit(limit).execute().data
+
+
+def _load_sync_token(calendar_id: str) -> Optional[str]:
+    rows = supabase.table(SYNC_STATE_TABLE).select("sync_token").eq(
+        "calendar_id", calendar_id).execute().data
+    return rows[0]["sync_token"] if rows else None
+
+
+def _store_sync_token(calendar_id: str, token: Optional[str]) -> None:
+    supabase.table(SYNC_STATE_TABLE).upsert(
+        {
+            "calendar_id": calendar_id,
+            "sync_token": token,
+            "synced_at": datetime.now(timezone.utc).isoformat()
+        },
+        on_conflict="calendar_id",
+        returning="minimal").execute()
+
+
+def _is_gone(error: Exception) -> bool:
+    return getattr(getattr(error, "resp", None), "status", None) == 410
+
+
+def resolve_calendar_id(service, calendar_id: str = "primary") -> str:
+    """The calendar's real id ("primary" is the account's address)"""
+    return service.calendars().get(calendarId=calendar_id).execute()["id"]
+
+
+def sync(service, calendar_id: str = "primary") -> dict:
+    """Bring the index up to date with one calendar; see module docstring"""
+    # Sync state is keyed by the calendar's real id
+    resolved_id = resolve_calendar_id(service, calendar_id)
+    token = _load_sync_token(resolved_id)
+    started = datetime.now(timezone.utc).isoformat()
+    totals = {"indexed": 0, "removed": 0, "changes": 0}
+
+    page_token = None
+    while True:
+        params = {
+            "calendarId": calendar_id,
+            "maxResults": SYNC_PAGE_SIZE,
+            "showDeleted": True,
+            # One row per recurring series (plus modified occurrences),
+            # not one per occurrence
+            "singleEvents": False,
+        }
+        if token:
+            params["syncToken"] = token
+        if page_token:
+            params["pageToken"] = page_token
+        try:
+            page = service.events().list(**params).execute()
+        except Exception as e:
+            if token and _is_gone(e):
+                logger.info("Sync token for %s expired; running a full sync",
+                            resolved_id)
+                _store_sync_token(resolved_id, None)
+                return sync(service, calendar_id)
+            raise
+        items = page.get("items", [])
+        counts = apply(items, resolved_id, remove_unlinked=bool(token))
+        totals["indexed"] += counts["indexed"]
+        totals["removed"] += counts["removed"]
+        totals["changes"] += len(items)
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            break
+
+    if not token:
+        # A full listing saw every live event; rows it didn't refresh
+        # belong to events deleted or unlinked while nobody was syncing
+        supabase.table(TABLE).delete(returning="minimal").eq(
+            "calendar_id", resolved_id).lt("synced_at", started).execute()
+    _store_sync_token(resolved_id, page.get("nextSyncToken"))
+    logger.info("%s sync of calendar %s: %s changes", "Incremental"
+                if token else "Full", resolved_id, totals["changes"])
+    return {
+        "calendar_id": resolved_id,
+        "mode": "incremental" if token else "full",
+        **totals
+    }
@@ -0,0 +1,229 @@
+"""Background dependency prober behind the liveness and readiness checks.
+
+A task started with the app probes Supabase, Telnyx and Google every
+HEALTH_PROBE_INTERVAL seconds and caches each result together with a
+window of recent probe latencies. `/api/health/ready` only reads that
+cache, so load balancer probes never call a downstream service inline.
+
+A replica is ready when every critical dependency (HEALTH_CRITICAL,
+default "supabase,telnyx") answered its last probe, and that probe is
+recent. Google Calendar is per-user OAuth, so an outage there degrades
+the calendar pages without taking the replica out of rotation.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from database import supabase_key, supabase_url
+
+logger = logging.getLogger(__name__)
+
+PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "10"))
+PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "3"))
+CRITICAL = {
+    name.strip()
+    for name in os.getenv("HEALTH_CRITICAL", "supabase,telnyx").split(",")
+    if name.strip()
+}
+# A result older than this many intervals no longer counts as up
+STALE_AFTER_INTERVALS = 3
+LATENCY_SAMPLES = 60
+
+
+class ProbeResult:
+
+    def __init__(self, name: str, critical: bool):
+        self.name = name
+        self.critical = critical
+        self.ok: Optional[bool] = None
+        self.detail: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.checked_at_iso: Optional[str] = None
+        self.consecutive_failures = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    @property
+    def up(self) -> bool:
+        return bool(self.ok) and self.checked_at is not None and (
+            time.monotonic() - self.checked_at <
+            PROBE_INTERVAL * STALE_AFTER_INTERVALS)
+
+    def record(self, ok: bool, detail: Optional[str], seconds: float) -> None:
+        self.ok = ok
+        self.detail = detail
+        self.checked_at = time.monotonic()
+        self.checked_at_iso = datetime.now(timezone.utc).isoformat()
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        self.latencies.append(seconds)
+
+    def _percentile(self, samples: List[float],
+                    fraction: float) -> Optional[float]:
+        if not samples:
+            return None
+        value = samples[min(len(samples) - 1, int(fraction * len(samples)))]
+        return round(value * 1000, 1)
+
+    def to_dict(self) -> dict:
+        samples = sorted(self.latencies)
+        return {
+            "status": "up" if self.up else
+            ("unknown" if self.ok is None else "down"),
+            "critical": self.critical,
+            "detail": self.detail,
+            "checked_at": self.checked_at_iso,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_ms": {
+                "p50": self._percentile(samples, 0.5),
+                "p95": self._percentile(samples, 0.95),
+                "p99": self._percentile(samples, 0.99),
+            },
+        }
+
+
+class HealthProber:
+
+    def __init__(self):
+        self.checks: Dict[str, Callable[[httpx.AsyncClient],
+                                        Awaitable[Optional[str]]]] = {}
+        self.results: Dict[str, ProbeResult] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def register(self, name: str,
+                 check: Callable[[httpx.AsyncClient],
+                                 Awaitable[Optional[str]]]) -> None:
+        """Add a check: an async callable raising on failure"""
+        self.checks[name] = check
+        self.results[name] = ProbeResult(name, name in CRITICAL)
+
+    async def _probe(self, name: str) -> None:
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(self.checks[name](self._http),
+                                            PROBE_TIMEOUT)
+            ok = True
+        except Exception as e:
+            detail = (f"timed out after {PROBE_TIMEOUT:.0f}s"
+                      if isinstance(e, asyncio.TimeoutError) else
+                      str(e)[:200])
+            ok = False
+        result = self.results[name]
+        if not ok and result.ok is not False:
+            logger.warning("Health probe for %s failed: %s", name, detail)
+        elif ok and result.ok is False:
+            logger.info("Health probe for %s recovered", name)
+        result.record(ok, detail, time.perf_counter() - started)
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self._probe(name) for name in self.checks))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error("Health prober iteration failed: %s", e)
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    def start(self) -> None:
+        if self._task is None:
+            # Probes bypass the resilience layer: they should notice
+            # recovery on their own and never feed the circuit breakers
+            self._http = httpx.AsyncClient(timeout=PROBE_TIMEOUT)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def status(self, name: str) -> dict:
+        return self.results[name].to_dict()
+
+    def readiness(self) -> dict:
+        down = [
+            name for name, result in self.results.items()
+            if result.critical and not result.up
+        ]
+        degraded = [
+            name for name, result in self.results.items()
+            if not result.critical and not result.up
+        ]
+        return {
+            "status": "ready" if not down else "not_ready",
+            "down": down,
+            "degraded": degraded,
+            "dependencies": {
+                name: result.to_dict()
+                for name, result in self.results.items()
+            },
+        }
+
+
+def _raise_for_server_error(response: httpx.Response) -> None:
+    # Any answer below 500 proves the service is reachable and serving
+    if response.status_code >= 500:
+        raise RuntimeError(f"HTTP {response.status_code}")
+
+
+async def check_supabase(http: httpx.AsyncClient) -> Optional[str]:
+    response = await http.get(f"{supabase_url}/rest/v1/clients",
+                              params={
+                                  "select": "id",
+                                  "limit": "1"
+                              },
+                              headers={
+                                  "apikey": supabase_key,
+                                  "Authorization": f"Bearer {supabase_key}"
+                              })
+    _raise_for_server_error(response)
+    if response.status_code >= 400:
+        raise RuntimeError(f"PostgREST answered {response.status_code}")
+    return None
+
+
+async def check_telnyx(http: httpx.AsyncClient) -> Optional[str]:
+    # Replaces the old /api/messages/test configuration check
+    from routers.messages import (TELNYX_API_BASE, TELNYX_API_KEY,
+                                  TELNYX_MESSAGING_PROFILE_ID,
+                                  TELNYX_PHONE_NUMBER)
+    if not (TELNYX_API_KEY and TELNYX_MESSAGING_PROFILE_ID
+            and TELNYX_PHONE_NUMBER):
+        raise RuntimeError("Telnyx is not configured")
+    base = (TELNYX_API_BASE or "https://api.telnyx.com").rstrip("/")
+    response = await http.get(
+        f"{base}/v2/messaging_profiles/{TELNYX_MESSAGING_PROFILE_ID}",
+        headers={"Authorization": f"Bearer {TELNYX_API_KEY}"})
+    _raise_for_server_error(response)
+    if response.status_code in (401, 403):
+        raise RuntimeError("Telnyx rejected the API key")
+    return None
+
+
+async def check_google(http: httpx.AsyncClient) -> Optional[str]:
+    from routers.calendar import GOOGLE_CALENDAR_API_ENDPOINT
+    base = GOOGLE_CALENDAR_API_ENDPOINT or (
+        "https://www.googleapis.com/calendar/v3/")
+    # Unauthenticated: a 401 still shows the API is reachable
+    response = await http.get(f"{base.rstrip('/')}/colors")
+    _raise_for_server_error(response)
+    return None
+
+
+prober = HealthProber()
+prober.register("supabase", check_supabase)
+prober.register("telnyx", check_telnyx)
+prober.register("google", check_google)
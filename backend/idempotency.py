@@ -0,0 +1,333 @@
+"""Idempotency-Key support for POST endpoints with side effects.
+
+A client that retries `POST /api/messages/send` or `POST /api/clients` with
+the same `Idempotency-Key` header gets the stored response of the first
+attempt instead of a second SMS or a duplicate row. While the first attempt
+is still running, duplicates wait for it and replay its result, so exactly
+one execution happens per key.
+
+Keys are scoped to the caller's Authorization header and the route, and
+bound to a hash of the request body: reusing a key with a different payload
+is rejected with 422. Only responses below 500 are stored; after a server
+error the key is released so the client can retry.
+
+The default store is per process. With several server.py workers set
+IDEMPOTENCY_STORE=supabase to share keys through the `idempotency_keys`
+table (migrations/003).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from database import supabase
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# How long a duplicate waits for the original attempt before giving up
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory").lower()
+MAX_KEY_LENGTH = 255
+MAX_MEMORY_RECORDS = 10000
+POLL_INTERVAL = 0.1
+
+
+@dataclass
+class IdempotencyRecord:
+    fingerprint: str
+    status: str = "in_flight"
+    status_code: Optional[int] = None
+    content_type: Optional[str] = None
+    body: bytes = b""
+    expires_at: float = 0.0
+    done: Optional[asyncio.Event] = field(default=None, repr=False)
+
+
+class MemoryIdempotencyStore:
+    """Per-process store; in-flight duplicates wait on an asyncio.Event"""
+
+    def __init__(self, max_records: int = MAX_MEMORY_RECORDS):
+        self.max_records = max_records
+        self._records: "OrderedDict[str, IdempotencyRecord]" = OrderedDict()
+
+    def _prune(self) -> None:
+        if len(self._records) <= self.max_records:
+            return
+        now = time.time()
+        for key in [k for k, r in self._records.items()
+                    if r.status == "completed" and r.expires_at < now]:
+            del self._records[key]
+        # Still full: drop the oldest completed results first
+        completed = [k for k, r in self._records.items()
+                     if r.status == "completed"]
+        for key in completed[:max(0, len(self._records) - self.max_records)]:
+            del self._records[key]
+
+    async def claim(self, key: str,
+                    fingerprint: str) -> Optional[IdempotencyRecord]:
+        """Claim `key`; None if the caller should execute the request"""
+        record = self._records.get(key)
+        if record is not None and (record.status == "in_flight"
+                                   or record.expires_at >= time.time()):
+            return record
+        self._records[key] = IdempotencyRecord(fingerprint=fingerprint,
+                                               done=asyncio.Event())
+        self._records.move_to_end(key)
+        self._prune()
+        return None
+
+    async def complete(self, key: str, status_code: int,
+                       content_type: Optional[str], body: bytes) -> None:
+        record = self._records[key]
+        record.status = "completed"
+        record.status_code = status_code
+        record.content_type = content_type
+        record.body = body
+        record.expires_at = time.time() + IDEMPOTENCY_TTL
+        record.done.set()
+
+    async def release(self, key: str) -> None:
+        record = self._records.pop(key, None)
+        if record is not None:
+            record.done.set()
+
+    async def wait(self, key: str, record: IdempotencyRecord,
+                   timeout: float) -> Optional[IdempotencyRecord]:
+        try:
+            await asyncio.wait_for(record.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        current = self._records.get(key)
+        return current if current is not None and current.status == (
+            "completed") else None
+
+
+class SupabaseIdempotencyStore:
+    """Store shared by all workers through the idempotency_keys table.
+
+    Claims rely on the primary key: the insert of an in-flight row either
+    succeeds (this worker executes) or conflicts (someone else owns the key).
+    Waiting duplicates poll the row until it completes or disappears.
+    """
+
+    table = "idempotency_keys"
+
+    @staticmethod
+    def _to_record(row: dict) -> IdempotencyRecord:
+        expires = datetime.fromisoformat(row["expires_at"])
+        if expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        return IdempotencyRecord(fingerprint=row["fingerprint"],
+                                 status=row["status"],
+                                 status_code=row.get("status_code"),
+                                 content_type=row.get("content_type"),
+                                 body=(row.get("body") or "").encode("utf-8"),
+                                 expires_at=expires.timestamp())
+
+    def _get(self, key: str) -> Optional[IdempotencyRecord]:
+        rows = supabase.table(self.table).select("*").eq("key",
+                                                         key).execute().data
+        return self._to_record(rows[0]) if rows else None
+
+    def _claim(self, key: str,
+               fingerprint: str) -> Optional[IdempotencyRecord]:
+        now = datetime.now(timezone.utc)
+        for _ in range(2):
+            try:
+                supabase.table(self.table).insert({
+                    "key": key,
+                    "fingerprint": fingerprint,
+                    "status": "in_flight",
+                    # Bounds how long a crashed worker can hold the key
+                    "expires_at": (now + timedelta(
+                        seconds=IDEMPOTENCY_WAIT_TIMEOUT * 2)).isoformat()
+                }, returning="minimal").execute()
+                return None
+            except Exception as e:
+                if "23505" not in str(e) and "duplicate" not in str(e):
+                    raise
+            record = self._get(key)
+            if record is None:
+                continue
+            if record.expires_at >= now.timestamp():
+                return record
+            # Expired completed result or abandoned claim: take it over
+            supabase.table(self.table).delete().eq("key", key).lt(
+                "expires_at", now.isoformat()).execute()
+        return self._get(key)
+
+    def _complete(self, key: str, status_code: int,
+                  content_type: Optional[str], body: bytes) -> None:
+        supabase.table(self.table).update({
+            "status": "completed",
+            "status_code": status_code,
+            "content_type": content_type,
+            "body": body.decode("utf-8", "replace"),
+            "expires_at": (datetime.now(timezone.utc) +
+                           timedelta(seconds=IDEMPOTENCY_TTL)).isoformat()
+        }, returning="minimal").eq("key", key).execute()
+
+    def _release(self, key: str) -> None:
+        supabase.table(self.table).delete(returning="minimal").eq(
+            "key", key).eq("status", "in_flight").execute()
+
+    # The Supabase client blocks, so every query runs in a thread
+
+    async def claim(self, key: str,
+                    fingerprint: str) -> Optional[IdempotencyRecord]:
+        return await asyncio.to_thread(self._claim, key, fingerprint)
+
+    async def complete(self, key: str, status_code: int,
+                       content_type: Optional[str], body: bytes) -> None:
+        await asyncio.to_thread(self._complete, key, status_code,
+                                content_type, body)
+
+    async def release(self, key: str) -> None:
+        await asyncio.to_thread(self._release, key)
+
+    async def wait(self, key: str, record: IdempotencyRecord,
+                   timeout: float) -> Optional[IdempotencyRecord]:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            current = await asyncio.to_thread(self._get, key)
+            if current is None:
+                return None
+            if current.status == "completed":
+                return current
+        return None
+
+
+def _error(status_code: int, detail: str) -> Tuple[int, bytes]:
+    return status_code, json.dumps({"detail": detail}).encode("utf-8")
+
+
+class IdempotencyMiddleware:
+    """Replay stored responses for requests carrying an Idempotency-Key.
+
+    Only the (method, path) pairs in `routes` are handled; everything else,
+    and requests without the header, pass straight through.
+    """
+
+    def __init__(self, app, routes: Iterable[Tuple[str, str]], store=None):
+        self.app = app
+        self.routes = {(method.upper(), path) for method, path in routes}
+        if store is None:
+            store = (SupabaseIdempotencyStore()
+                     if IDEMPOTENCY_STORE == "supabase" else
+                     MemoryIdempotencyStore())
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"],
+                                       scope["path"]) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        raw_key = headers.get(IDEMPOTENCY_HEADER)
+        if raw_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+            await self._send(send, *_error(
+                400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"))
+            return
+
+        body = await self._read_body(receive)
+        key = hashlib.sha256(b"\0".join([
+            headers.get(b"authorization", b""),
+            scope["method"].encode(),
+            scope["path"].encode(), raw_key
+        ])).hexdigest()
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        record = await self.store.claim(key, fingerprint)
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                await self._send(send, *_error(
+                    422, "Idempotency-Key was already used with a different "
+                    "request body"))
+                return
+            if record.status == "in_flight":
+                logger.info("Waiting for in-flight request with the same "
+                            "idempotency key on %s", scope["path"])
+                record = await self.store.wait(key, record,
+                                               IDEMPOTENCY_WAIT_TIMEOUT)
+                if record is None:
+                    await self._send(send, *_error(
+                        409, "A request with this Idempotency-Key is still "
+                        "in progress or failed; retry later"))
+                    return
+            logger.info("Replaying stored response for %s", scope["path"])
+            await self._send(send, record.status_code, record.body,
+                             record.content_type, replayed=True)
+            return
+
+        captured = {"status": 500, "content_type": None, "body": []}
+        body_sent = False
+
+        async def replay_receive():
+            # The body was read above; anything after it is a disconnect
+            nonlocal body_sent
+            if body_sent:
+                return {"type": "http.disconnect"}
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                for name, value in message.get("headers", []):
+                    if name == b"content-type":
+                        captured["content_type"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                captured["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await self.store.release(key)
+            raise
+        if captured["status"] >= 500:
+            await self.store.release(key)
+        else:
+            await self.store.complete(key, captured["status"],
+                                      captured["content_type"],
+                                      b"".join(captured["body"]))
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    async def _send(send,
+                    status_code: int,
+                    body: bytes,
+                    content_type: Optional[str] = "application/json",
+                    replayed: bool = False) -> None:
+        headers = [(b"content-length", str(len(body)).encode())]
+        if content_type:
+            headers.append((b"content-type", content_type.encode()))
+        if replayed:
+            headers.append((b"idempotent-replayed", b"true"))
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": headers
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,172 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from tracing import TraceContextFilter
+
+# Attributes every LogRecord carries; anything else was passed through `extra=`
+_RESERVED_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__.keys()) | {
+        "message", "asctime", "color_message"
+    }
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Render a record as a single JSON line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts":
+            datetime.fromtimestamp(record.created,
+                                   tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of low-severity records for selected loggers.
+
+    Rates are matched on the longest logger-name prefix, so a rate for
+    "routers" applies to "routers.messages" unless that has its own entry.
+    Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def _rate_for(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers message formatting to the listener thread.
+
+    The stock handler calls `format()` before enqueueing, which puts the
+    string interpolation back on the caller's thread. Records here stay in
+    process, so they can be passed through untouched.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[str, float]:
+    """Parse "routers.messages=0.1,routers.clients=0.5" into a rate map"""
+    rates: Dict[str, float] = {}
+    if not spec:
+        return rates
+    for item in spec.split(","):
+        name, sep, value = item.strip().partition("=")
+        if not sep:
+            continue
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+
+def configure_logging(level: Optional[str] = None,
+                      fmt: Optional[str] = None,
+                      sample_rates: Optional[Dict[str, float]] = None) -> None:
+    """Configure the root logger once for the whole application.
+
+    Records are pushed onto an in-memory queue and written to stdout by a
+    background QueueListener, so request handlers never block on I/O.
+    Settings default to the LOG_LEVEL, LOG_FORMAT ("json" or "text") and
+    LOG_SAMPLE_RATES environment variables.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == "text":
+        stream_handler.setFormatter(
+            logging.Formatter('%(asctime)s - %(levelname)s - %(message)s',
+                              datefmt='%Y-%m-%d %H:%M:%S'))
+    else:
+        stream_handler.setFormatter(JSONFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    # Filters run on the caller's thread, where the span is still current
+    queue_handler.addFilter(TraceContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue,
+                                               stream_handler,
+                                               respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    if hasattr(os, "register_at_fork"):
+        # The listener thread does not survive fork(); drain it beforehand
+        # and start a fresh one on each side
+        os.register_at_fork(before=_pause_listener,
+                            after_in_parent=_resume_listener,
+                            after_in_child=_resume_listener)
+
+
+def _pause_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+
+def _resume_listener() -> None:
+    if _listener is not None:
+        _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,4 +1,6 @@
 from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
@@ -6,22 +8,74 @@ import os
 from datetime import datetime
 import logging
 from dotenv import load_dotenv
+from logging_config import configure_logging
+from compression import CompressionMiddleware
+from idempotency import IdempotencyMiddleware
+from ratelimit import RateLimitMiddleware
+from profiling import ProfilingMiddleware
+import calendar_push
+import delivery_stats
+import document_cleanup
+import resilience
+import scheduler
+import tracing
+from responses import FastJSONResponse
 
 # Load environment variables
 load_dotenv()
 
-# Configure root logger
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S')
+# Configure logging once for the whole application, before any router
+# module creates its logger
+configure_logging()
 
 # Create logger for this module
 logger = logging.getLogger(__name__)
 
-# Import routers
-from routers import clients, calendar, messages, notes
+# Import routers. Their SDK dependencies (supabase, telnyx, Google) are
+# imported lazily on first use or by warmup()
+import database
+from health import prober
+from routers import admin, clients, calendar, documents, messages, notes
 
-app = FastAPI(title="Law Firm CRM API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in every worker process, after server.py has forked it
+    prober.start()
+    if scheduler.SCHEDULER_ENABLED:
+        scheduler.scheduler.start()
+    calendar_push.hub.start()
+    delivery_stats.aggregator.start()
+    document_cleanup.runner.start()
+    try:
+        yield
+    finally:
+        await document_cleanup.runner.stop()
+        await delivery_stats.aggregator.stop()
+        await calendar_push.hub.stop()
+        await scheduler.scheduler.stop()
+        await prober.stop()
+        tracing.shutdown()
+
+
+app = FastAPI(title="Law Firm CRM API",
+              default_response_class=FastJSONResponse,
+              lifespan=lifespan)
+
+# Replay retried POSTs that carry an Idempotency-Key. Added before CORS so
+# that replayed responses still get CORS headers.
+app.add_middleware(IdempotencyMiddleware,
+                   routes=[("POST", "/api/messages/send"),
+                           ("POST", "/api/messages/schedule"),
+                           ("POST", "/api/clients")])
+
+# Token-bucket limits on SMS sends and calendar event calls; inside CORS so
+# the browser can read the 429
+app.add_middleware(RateLimitMiddleware)
+
+# Stack-sampling profiles for requests sent with X-Profile and an admin
+# token, or for PROFILE_SAMPLE_RATE of traffic
+app.add_middleware(ProfilingMiddleware)
 
 # Configure CORS
 app.add_middleware(
@@ -33,30 +87,79 @@ app.add_middleware(
     expose_headers=["*"],  # Expose all headers
 )
 
+# Compress large JSON bodies (gzip, or brotli when installed)
+app.add_middleware(CompressionMiddleware)
+
+# Outermost, so the server span covers every other middleware; a no-op
+# unless TRACING_EXPORTER is set
+app.add_middleware(tracing.TracingMiddleware)
+
 # Include routers
 app.include_router(clients.router, prefix="/api/clients", tags=["clients"])
+app.include_router(documents.router,
+                   prefix="/api/clients",
+                   tags=["documents"])
 app.include_router(calendar.router, prefix="/api/calendar", tags=["calendar"])
 app.include_router(messages.router, prefix="/api/messages", tags=["messages"])
 app.include_router(notes.router, prefix="/api/notes", tags=["notes"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
+
+
+def warmup():
+    """Load SDKs and build shared clients ahead of the first request"""
+    database.warmup()
+    messages.warmup()
+    calendar.warmup()
 
 
 @app.get("/")
 async def root():
-    logger.info("Root endpoint accessed")
+    logger.debug("Root endpoint accessed")
     return {"message": "Welcome to the Law Firm CRM API"}
 
 
 @app.get("/api/health")
 async def health_check():
-    logger.info("Health check endpoint accessed")
+    logger.debug("Health check endpoint accessed")
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        # Circuit breaker state and adaptive timeouts per dependency
+        "dependencies": resilience.snapshot(),
+        "scheduler": scheduler.scheduler.snapshot(),
+        "calendar_push": calendar_push.hub.snapshot(),
+        "delivery_stats": delivery_stats.aggregator.snapshot(),
+        "document_cleanup": document_cleanup.runner.snapshot()
+    }
+
+
+@app.get("/api/health/live")
+async def liveness():
+    """Liveness: the process is serving requests; no dependency checks"""
+    return {"status": "alive"}
+
+
+@app.get("/api/health/ready")
+async def readiness():
+    """Readiness from the background prober's cached results.
+
+    503 while a critical dependency is down, its last probe is stale, or
+    the first probe hasn't finished yet.
+    """
+    report = prober.readiness()
+    report["breakers"] = {
+        name: dependency["breakers"]
+        for name, dependency in resilience.snapshot().items()
     }
+    return JSONResponse(report,
+                        status_code=200
+                        if report["status"] == "ready" else 503)
 
 
 if __name__ == "__main__":
+    # Development server; use `python server.py` for the multi-worker
+    # production launcher
     import uvicorn
     logger.info("Starting FastAPI application")
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
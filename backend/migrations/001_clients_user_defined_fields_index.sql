@@ -0,0 +1,11 @@
+-- Serve `user_defined_fields @> '{...}'` containment filters
+-- (PostgREST `cs.` operator, used by GET /api/clients?udf.<field>=<value>)
+-- from an index instead of a sequential scan.
+--
+-- user_defined_fields must be jsonb; jsonb_path_ops keeps the index small
+-- and supports exactly the @> operator.
+--
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists clients_user_defined_fields_gin
+    on public.clients using gin (user_defined_fields jsonb_path_ops);
@@ -0,0 +1,9 @@
+-- POST /api/clients/query computes group-by counts and min/max with
+-- PostgREST aggregate functions (`select=case_status,count()`), which
+-- PostgREST 12+ only serves when db-aggregates-enabled is set.
+alter role authenticator set pgrst.db_aggregates_enabled = 'true';
+notify pgrst, 'reload config';
+
+-- The indexes behind the dashboard groupings and the case_date range
+-- filters follow in 002a-002d, one per migration since they are built
+-- concurrently
@@ -0,0 +1,5 @@
+-- Dashboard groupings by case_status (POST /api/clients/query)
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists clients_case_status_idx
+    on public.clients (case_status);
@@ -0,0 +1,5 @@
+-- Dashboard groupings by case_type (POST /api/clients/query)
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists clients_case_type_idx
+    on public.clients (case_type);
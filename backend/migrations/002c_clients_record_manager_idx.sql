@@ -0,0 +1,5 @@
+-- Dashboard groupings by record_manager (POST /api/clients/query)
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists clients_record_manager_idx
+    on public.clients (record_manager);
@@ -0,0 +1,5 @@
+-- case_date range filters and min/max (POST /api/clients/query)
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists clients_case_date_idx
+    on public.clients (case_date);
@@ -0,0 +1,23 @@
+-- Shared Idempotency-Key store for POST /api/messages/send and
+-- POST /api/clients when several server.py workers run
+-- (IDEMPOTENCY_STORE=supabase). `key` hashes the caller, route and header
+-- value; the primary key is what makes a claim atomic across workers.
+create table if not exists public.idempotency_keys (
+    key text primary key,
+    fingerprint text not null,
+    status text not null default 'in_flight'
+        check (status in ('in_flight', 'completed')),
+    status_code integer,
+    content_type text,
+    body text,
+    created_at timestamptz not null default now(),
+    expires_at timestamptz not null
+);
+
+create index if not exists idempotency_keys_expires_at_idx
+    on public.idempotency_keys (expires_at);
+
+-- Expired rows are replaced on the next claim of the same key; purge the
+-- rest periodically, e.g. with pg_cron:
+--   select cron.schedule('purge-idempotency-keys', '*/15 * * * *',
+--     $$delete from public.idempotency_keys where expires_at < now()$$);
@@ -0,0 +1,49 @@
+-- Shared token buckets for RateLimitMiddleware (RATE_LIMIT_BACKEND=supabase).
+-- rate_limit_take() refills and debits a bucket under its row lock. It
+-- returns 0 when the request may proceed, otherwise the number of seconds
+-- until enough tokens are available.
+create table if not exists public.rate_limit_buckets (
+    key text primary key,
+    tokens double precision not null,
+    updated_at timestamptz not null default clock_timestamp()
+);
+
+create or replace function public.rate_limit_take(p_key text,
+                                                  p_rate double precision,
+                                                  p_burst integer,
+                                                  p_cost integer default 1)
+returns double precision
+language plpgsql
+as $$
+declare
+    v_now timestamptz := clock_timestamp();
+    v_tokens double precision;
+begin
+    insert into public.rate_limit_buckets (key, tokens, updated_at)
+    values (p_key, p_burst, v_now)
+    on conflict (key) do nothing;
+
+    select least(p_burst,
+                 tokens + extract(epoch from v_now - updated_at) * p_rate)
+      into v_tokens
+      from public.rate_limit_buckets
+     where key = p_key
+       for update;
+
+    if v_tokens >= p_cost then
+        update public.rate_limit_buckets
+           set tokens = v_tokens - p_cost, updated_at = v_now
+         where key = p_key;
+        return 0;
+    end if;
+
+    update public.rate_limit_buckets
+       set tokens = v_tokens, updated_at = v_now
+     where key = p_key;
+    return (p_cost - v_tokens) / p_rate;
+end;
+$$;
+
+-- Full buckets carry no state; purge idle rows periodically, e.g.
+--   delete from public.rate_limit_buckets
+--    where updated_at < now() - interval '1 hour';
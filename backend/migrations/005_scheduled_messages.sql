@@ -0,0 +1,69 @@
+-- SMS to be sent at `send_at`: appointment reminders for calendar events
+-- and follow-up texts. Workers lease rows that fall due within their
+-- look-ahead window through scheduled_messages_lease(), keep them in an
+-- in-process heap and send them through the regular Telnyx path.
+create table if not exists public.scheduled_messages (
+    id uuid primary key default gen_random_uuid(),
+    client_id text not null,
+    user_id text,
+    to_number text,
+    from_number text,
+    content text not null,
+    kind text not null default 'follow_up'
+        check (kind in ('follow_up', 'reminder')),
+    -- Calendar event a reminder belongs to, so it moves with the event
+    event_id text,
+    send_at timestamptz not null,
+    status text not null default 'pending'
+        check (status in ('pending', 'sending', 'sent', 'failed',
+                          'cancelled')),
+    attempts integer not null default 0,
+    last_error text,
+    message_id text,
+    lease_owner text,
+    lease_expires_at timestamptz,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+-- Only pending rows are ever scanned by send_at; sent and cancelled rows
+-- stay out of the index however many accumulate
+create index if not exists scheduled_messages_pending_send_at_idx
+    on public.scheduled_messages (send_at)
+    where status = 'pending';
+
+create index if not exists scheduled_messages_client_idx
+    on public.scheduled_messages (client_id, send_at);
+
+create index if not exists scheduled_messages_event_idx
+    on public.scheduled_messages (event_id)
+    where event_id is not null;
+
+-- Lease up to p_limit pending rows due before p_until to p_owner. A lease
+-- lasts until p_grace seconds after the row's send_at, so rows held by a
+-- worker that died are picked up by another one shortly after they fall
+-- due. skip locked lets concurrent workers lease disjoint rows.
+create or replace function public.scheduled_messages_lease(
+    p_owner text,
+    p_until timestamptz,
+    p_limit integer,
+    p_grace integer default 60)
+returns setof public.scheduled_messages
+language sql
+as $$
+    update public.scheduled_messages s
+       set lease_owner = p_owner,
+           lease_expires_at = greatest(s.send_at, now())
+                              + make_interval(secs => p_grace),
+           updated_at = now()
+     where s.id in (
+           select id
+             from public.scheduled_messages
+            where status = 'pending'
+              and send_at <= p_until
+              and (lease_expires_at is null or lease_expires_at < now())
+            order by send_at
+            limit p_limit
+              for update skip locked)
+    returning s.*;
+$$;
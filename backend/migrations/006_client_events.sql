@@ -0,0 +1,38 @@
+-- Index of Google Calendar events linked to a client, so
+-- GET /api/clients/{id}/events is a range scan instead of a calendar scan.
+-- Events carry the link as the private extended property crm_client_id;
+-- rows are written by the calendar routes and by POST /api/calendar/sync.
+create table if not exists public.client_events (
+    event_id text primary key,
+    calendar_id text not null,
+    client_id text not null,
+    summary text,
+    description text,
+    location text,
+    start_time timestamptz,
+    end_time timestamptz,
+    all_day boolean not null default false,
+    status text not null default 'confirmed',
+    -- RRULE/EXDATE lines of a recurring event's master
+    recurrence jsonb,
+    -- Set on a modified occurrence of a recurring event
+    recurring_event_id text,
+    original_start_time timestamptz,
+    html_link text,
+    event_updated timestamptz,
+    synced_at timestamptz not null default now()
+);
+
+create index if not exists client_events_client_start_idx
+    on public.client_events (client_id, start_time);
+
+create index if not exists client_events_calendar_synced_idx
+    on public.client_events (calendar_id, synced_at);
+
+-- Google sync token per calendar: the next sync asks only for the events
+-- changed since the previous one
+create table if not exists public.calendar_sync_state (
+    calendar_id text primary key,
+    sync_token text,
+    synced_at timestamptz not null default now()
+);
@@ -0,0 +1,61 @@
+-- Google Calendar push channels (events.watch). Each row is one watched
+-- calendar of one account; the Google channel behind it is replaced before
+-- it expires, so channel_id changes while id stays the same. Notifications
+-- to /api/calendar/webhook bump change_seq, which every worker polls to
+-- refresh its cached copy of the calendar and notify its stream clients.
+create table if not exists public.calendar_channels (
+    id uuid primary key default gen_random_uuid(),
+    calendar_id text not null,
+    -- Real id of calendar_id ("primary" is the account's address)
+    resolved_calendar_id text not null,
+    -- event_cache key: hash of the account's credentials and calendar_id
+    cache_key text not null,
+    -- OAuth credentials the webhook syncs with, encrypted with
+    -- CALENDAR_CREDENTIALS_KEY (calendar_push.py); refreshed tokens are saved
+    sealed_credentials text not null,
+    channel_id text not null,
+    resource_id text,
+    -- Sent back by Google as X-Goog-Channel-Token on every notification
+    token text not null,
+    -- Secret of the change stream handed to the browser
+    stream_token text not null,
+    status text not null default 'active'
+        check (status in ('active', 'renewing', 'stopped')),
+    expiration timestamptz not null,
+    change_seq bigint not null default 0,
+    last_changes jsonb,
+    changed_at timestamptz,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+-- Only the API, with the service role key, reads or writes channels: row
+-- level security without policies shuts out the anon and authenticated
+-- roles, and they get no table privileges either
+alter table public.calendar_channels enable row level security;
+revoke all on table public.calendar_channels from anon, authenticated;
+
+create unique index if not exists calendar_channels_channel_idx
+    on public.calendar_channels (channel_id);
+
+-- One live channel per account and calendar
+create unique index if not exists calendar_channels_active_idx
+    on public.calendar_channels (cache_key)
+    where status <> 'stopped';
+
+-- Record a change and return the new sequence number; an increment in SQL
+-- so concurrent notifications on different workers are all counted
+create or replace function public.calendar_channel_touch(
+    p_id uuid,
+    p_changes jsonb)
+returns bigint
+language sql
+as $$
+    update public.calendar_channels
+       set change_seq = change_seq + 1,
+           last_changes = p_changes,
+           changed_at = now(),
+           updated_at = now()
+     where id = p_id
+    returning change_seq;
+$$;
@@ -0,0 +1,109 @@
+-- Search and reports over SMS history: GET /api/messages/search and
+-- GET /api/messages/stats. Both run as set-based queries in Postgres; no
+-- endpoint reads the messages of a period into Python.
+
+-- The indexes the search and the reports use follow in 008a-008d, one per
+-- migration since they are built concurrently
+
+-- Message counts per UTC day, operator phone, direction and status.
+-- p_operator restricts the report to one operator's number.
+create or replace function public.message_stats(
+    p_from timestamptz,
+    p_to timestamptz,
+    p_operator text default null)
+returns table (
+    day date,
+    operator_phone text,
+    direction text,
+    status text,
+    messages bigint)
+language sql
+stable
+as $$
+    select (m.created_at at time zone 'utc')::date,
+           case when m.direction = 'outbound' then m.from_number
+                else m.to_number end,
+           m.direction,
+           m.status,
+           count(*)
+      from public.messages m
+     where m.created_at >= p_from
+       and m.created_at < p_to
+       and (p_operator is null
+            or (m.direction = 'outbound' and m.from_number = p_operator)
+            or (m.direction = 'inbound' and m.to_number = p_operator))
+     group by 1, 2, 3, 4
+     order by 1, 2, 3, 4;
+$$;
+
+-- Time operators take to answer clients. A thread (client, operator phone)
+-- is cut into runs of same-direction messages; a reply is an outbound run
+-- following an inbound one, and its response time is from the first
+-- message of the inbound run to the first of the reply. Rows with a null
+-- day are the operator's totals over the whole period.
+create or replace function public.message_response_times(
+    p_from timestamptz,
+    p_to timestamptz,
+    p_operator text default null)
+returns table (
+    day date,
+    operator_phone text,
+    replies bigint,
+    avg_seconds double precision,
+    p50_seconds double precision,
+    p90_seconds double precision)
+language sql
+stable
+as $$
+    with thread as (
+        select m.client_id,
+               case when m.direction = 'outbound' then m.from_number
+                    else m.to_number end as operator_phone,
+               m.direction,
+               m.created_at
+          from public.messages m
+         where m.client_id is not null
+           -- Replies early in the period may answer messages before it
+           and m.created_at >= p_from - interval '7 days'
+           and m.created_at < p_to
+    ), marked as (
+        select t.*,
+               case when t.direction is distinct from lag(t.direction) over (
+                        partition by t.client_id, t.operator_phone
+                        order by t.created_at)
+                    then 1 else 0 end as run_start
+          from thread t
+         where p_operator is null or t.operator_phone = p_operator
+    ), runs as (
+        select client_id, operator_phone, direction, created_at,
+               sum(run_start) over (
+                   partition by client_id, operator_phone
+                   order by created_at) as run
+          from marked
+    ), run_starts as (
+        select client_id, operator_phone, run,
+               min(direction) as direction,
+               min(created_at) as started_at
+          from runs
+         group by client_id, operator_phone, run
+    ), replies as (
+        select operator_phone, direction, started_at,
+               lag(direction) over w as previous_direction,
+               extract(epoch from started_at - lag(started_at) over w)
+                   as seconds
+          from run_starts
+        window w as (partition by client_id, operator_phone order by run)
+    )
+    select (started_at at time zone 'utc')::date,
+           operator_phone,
+           count(*),
+           avg(seconds),
+           percentile_cont(0.5) within group (order by seconds),
+           percentile_cont(0.9) within group (order by seconds)
+      from replies
+     where direction = 'outbound'
+       and previous_direction = 'inbound'
+       and started_at >= p_from
+     group by grouping sets ((1, 2), (2))
+     order by 2, 1 nulls last;
+$$;
@@ -0,0 +1,6 @@
+-- Full-text search. PostgREST's `content=wfts(english).<query>` filter on a
+-- text column compiles to exactly this expression, so it uses the index.
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists messages_content_fts_idx
+    on public.messages using gin (to_tsvector('english', content));
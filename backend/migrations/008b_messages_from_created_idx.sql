@@ -0,0 +1,6 @@
+-- The operator's side of a thread, outbound messages: by from_number,
+-- newest first (008c covers inbound ones)
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists messages_from_created_idx
+    on public.messages (from_number, created_at);
@@ -0,0 +1,6 @@
+-- The operator's side of a thread, inbound messages: by to_number,
+-- newest first
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists messages_to_created_idx
+    on public.messages (to_number, created_at);
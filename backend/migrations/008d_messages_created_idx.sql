@@ -0,0 +1,5 @@
+-- Messages of a period, for the reports over every operator
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists messages_created_idx
+    on public.messages (created_at);
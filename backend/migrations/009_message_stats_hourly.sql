@@ -0,0 +1,158 @@
+-- Message counts per operator phone, UTC hour of created_at, direction and
+-- status, kept up to date by the API workers (delivery_stats.py) instead of
+-- grouping the messages table for every report.
+--
+-- Rollout: apply this, deploy the workers that flush into the table, then
+-- recount what happened in between. The backfill below counts the messages
+-- stored so far, but old workers keep storing messages until the deploy
+-- finishes and never count them, and the hour the backfill ran in is left
+-- partial. Once the hour the deploy finished in is over (and a flush
+-- interval more), run
+--
+--     select public.message_stats_hourly_rebuild(
+--         '<when this migration was applied>',
+--         date_trunc('hour', now()));
+--
+-- which recounts every hour in between from the messages table.
+create table if not exists public.message_stats_hourly (
+    -- from_number of outbound messages, to_number of inbound ones; ''
+    -- when the message has none
+    operator_phone text not null,
+    hour timestamptz not null,
+    direction text not null,
+    status text not null,
+    messages bigint not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (operator_phone, hour, direction, status)
+);
+
+create index if not exists message_stats_hourly_hour_idx
+    on public.message_stats_hourly (hour);
+
+insert into public.message_stats_hourly
+       (operator_phone, hour, direction, status, messages)
+select coalesce(case when direction = 'outbound' then from_number
+                     else to_number end, ''),
+       date_trunc('hour', created_at at time zone 'utc') at time zone 'utc',
+       direction,
+       status,
+       count(*)
+  from public.messages
+ group by 1, 2, 3, 4
+on conflict do nothing;
+
+-- Add a batch of count deltas, [{operator_phone, hour, direction, status,
+-- messages}], to the buckets; one row per bucket within a batch
+create or replace function public.message_stats_hourly_add(p_rows jsonb)
+returns void
+language sql
+as $$
+    insert into public.message_stats_hourly as s
+           (operator_phone, hour, direction, status, messages)
+    select r.operator_phone, r.hour, r.direction, r.status, r.messages
+      from jsonb_to_recordset(p_rows) as r(
+               operator_phone text,
+               hour timestamptz,
+               direction text,
+               status text,
+               messages bigint)
+    on conflict (operator_phone, hour, direction, status)
+    do update set messages = s.messages + excluded.messages,
+                  updated_at = now();
+$$;
+
+-- Set the status of the messages with a Telnyx id and return the ones that
+-- changed, with the status they had, so the caller can move them between
+-- buckets. Locking the rows first makes concurrent deliveries of the same
+-- webhook change (and count) a message once. The lookup by Telnyx id is
+-- indexed in 009a.
+create or replace function public.message_set_status(
+    p_telnyx_message_id text,
+    p_status text)
+returns table (
+    from_number text,
+    to_number text,
+    direction text,
+    created_at timestamptz,
+    old_status text)
+language sql
+as $$
+    update public.messages m
+       set status = p_status
+      from (select id, status
+              from public.messages
+             where telnyx_message_id = p_telnyx_message_id
+               and status is distinct from p_status
+               for update) old
+     where m.id = old.id
+    returning m.from_number, m.to_number, m.direction,
+              m.created_at::timestamptz, old.status;
+$$;
+
+-- Same report as in migrations/008, read from the hourly buckets; bounds
+-- are taken to whole hours
+create or replace function public.message_stats(
+    p_from timestamptz,
+    p_to timestamptz,
+    p_operator text default null)
+returns table (
+    day date,
+    operator_phone text,
+    direction text,
+    status text,
+    messages bigint)
+language sql
+stable
+as $$
+    select (s.hour at time zone 'utc')::date,
+           nullif(s.operator_phone, ''),
+           s.direction,
+           s.status,
+           sum(s.messages)::bigint
+      from public.message_stats_hourly s
+     where s.hour >= date_trunc('hour', p_from at time zone 'utc')
+                     at time zone 'utc'
+       and s.hour < p_to
+       and (p_operator is null or s.operator_phone = p_operator)
+     group by 1, 2, 3, 4
+    having sum(s.messages) <> 0
+     order by 1, 2, 3, 4;
+$$;
+
+-- Replace the buckets of the hours from p_from's hour up to p_to (an hour
+-- boundary) with counts taken from the messages table; returns the number
+-- of buckets written. Flushes wait for the recount; status changes a
+-- worker still holds for those hours are added on top when it flushes.
+create or replace function public.message_stats_hourly_rebuild(
+    p_from timestamptz,
+    p_to timestamptz)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_from timestamptz := date_trunc('hour', p_from at time zone 'utc')
+                          at time zone 'utc';
+    v_buckets bigint;
+begin
+    lock table public.message_stats_hourly in share row exclusive mode;
+    delete from public.message_stats_hourly
+     where hour >= v_from
+       and hour < p_to;
+    insert into public.message_stats_hourly
+           (operator_phone, hour, direction, status, messages)
+    select operator_phone, hour, direction, status, count(*)
+      from (select coalesce(case when direction = 'outbound'
+                                 then from_number
+                                 else to_number end, '') as operator_phone,
+                   date_trunc('hour', created_at at time zone 'utc')
+                       at time zone 'utc' as hour,
+                   direction,
+                   status
+              from public.messages) m
+     where hour >= v_from
+       and hour < p_to
+     group by 1, 2, 3, 4;
+    get diagnostics v_buckets = row_count;
+    return v_buckets;
+end;
+$$;
@@ -0,0 +1,6 @@
+-- Webhook status updates (message_set_status in 009) look messages up by
+-- Telnyx id
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists messages_telnyx_message_id_idx
+    on public.messages (telnyx_message_id);
@@ -0,0 +1,132 @@
+-- One row per conversation (operator phone, client) for GET
+-- /api/messages/inbox: latest activity, a preview of the last message and
+-- the number of client messages since the operator last read or replied.
+-- The API updates a row through message_thread_touch() whenever it stores a
+-- message, so the inbox reads a page of this table and never the messages.
+-- Apply before deploying the API that maintains it: the backfill below only
+-- fills threads that don't exist yet.
+create table if not exists public.message_threads (
+    -- from_number of outbound messages, to_number of inbound ones
+    operator_phone text not null,
+    client_id text not null,
+    client_phone text,
+    last_message_at timestamptz not null,
+    last_direction text not null,
+    last_preview text,
+    unread_count integer not null default 0,
+    message_count integer not null default 0,
+    -- Latest operator reply; client messages before it are not unread
+    last_reply_at timestamptz,
+    last_read_at timestamptz,
+    updated_at timestamptz not null default now(),
+    primary key (operator_phone, client_id)
+);
+
+-- The inbox: an operator's threads, latest activity first
+create index if not exists message_threads_inbox_idx
+    on public.message_threads (operator_phone, last_message_at desc,
+                               client_id desc);
+
+with thread_messages as (
+    select case when direction = 'outbound' then from_number
+                else to_number end as operator_phone,
+           client_id::text as client_id,
+           case when direction = 'outbound' then to_number
+                else from_number end as client_phone,
+           direction,
+           content,
+           created_at
+      from public.messages
+     where client_id is not null
+), threads as (
+    select operator_phone,
+           client_id,
+           count(*) as message_count,
+           max(created_at) filter (where direction = 'outbound')
+               as last_reply_at
+      from thread_messages
+     where operator_phone is not null
+     group by 1, 2
+), latest as (
+    select distinct on (operator_phone, client_id) *
+      from thread_messages
+     where operator_phone is not null
+     order by operator_phone, client_id, created_at desc
+), unread as (
+    -- Client messages since the operator's last reply
+    select m.operator_phone, m.client_id, count(*) as unread_count
+      from thread_messages m
+      join threads t using (operator_phone, client_id)
+     where m.direction = 'inbound'
+       and m.created_at > coalesce(t.last_reply_at, '-infinity')
+     group by 1, 2
+)
+insert into public.message_threads
+       (operator_phone, client_id, client_phone, last_message_at,
+        last_direction, last_preview, unread_count, message_count,
+        last_reply_at)
+select l.operator_phone,
+       l.client_id,
+       l.client_phone,
+       l.created_at,
+       l.direction,
+       left(l.content, 160),
+       coalesce(u.unread_count, 0),
+       t.message_count,
+       t.last_reply_at
+  from latest l
+  join threads t using (operator_phone, client_id)
+  left join unread u using (operator_phone, client_id)
+on conflict do nothing;
+
+-- Fold one stored message into its thread. Messages may arrive out of
+-- order: only a message at least as recent as the thread's last one
+-- replaces the preview, and only such an outbound message (the operator
+-- replying) clears the unread count. A client message counts as unread
+-- only if it is newer than the operator's last reply and last read, as in
+-- the backfill above.
+create or replace function public.message_thread_touch(
+    p_operator_phone text,
+    p_client_id text,
+    p_client_phone text,
+    p_direction text,
+    p_preview text,
+    p_at timestamptz)
+returns setof public.message_threads
+language sql
+as $$
+    insert into public.message_threads as t
+           (operator_phone, client_id, client_phone, last_message_at,
+            last_direction, last_preview, unread_count, message_count,
+            last_reply_at)
+    values (p_operator_phone, p_client_id, p_client_phone, p_at,
+            p_direction, p_preview,
+            case when p_direction = 'inbound' then 1 else 0 end, 1,
+            case when p_direction = 'outbound' then p_at end)
+    on conflict (operator_phone, client_id) do update set
+        client_phone = case when p_at >= t.last_message_at
+                            then coalesce(excluded.client_phone,
+                                          t.client_phone)
+                            else t.client_phone end,
+        last_direction = case when p_at >= t.last_message_at
+                              then excluded.last_direction
+                              else t.last_direction end,
+        last_preview = case when p_at >= t.last_message_at
+                            then excluded.last_preview
+                            else t.last_preview end,
+        last_message_at = greatest(t.last_message_at, p_at),
+        unread_count = case
+            when p_direction = 'outbound' and p_at >= t.last_message_at
+                then 0
+            when p_direction = 'inbound'
+                 and p_at > coalesce(t.last_reply_at, '-infinity')
+                 and p_at > coalesce(t.last_read_at, '-infinity')
+                then t.unread_count + 1
+            else t.unread_count end,
+        message_count = t.message_count + 1,
+        last_reply_at = case when p_direction = 'outbound'
+                             then greatest(t.last_reply_at, p_at)
+                             else t.last_reply_at end,
+        updated_at = now()
+    returning *;
+$$;
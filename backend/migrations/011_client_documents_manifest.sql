@@ -0,0 +1,41 @@
+-- Atomic changes to the client_documents manifest on a client row. Uploads
+-- and deletes run on any API worker; reading the manifest, changing it and
+-- writing it back would lose entries when two of them meet on one client.
+
+-- Add or replace one entry; returns false if the client doesn't exist
+create or replace function public.client_document_put(
+    p_client_id public.clients.id%type,
+    p_document_id text,
+    p_entry jsonb)
+returns boolean
+language sql
+as $$
+    with updated as (
+        update public.clients
+           set client_documents = coalesce(client_documents, '{}'::jsonb)
+                   || jsonb_build_object(p_document_id, p_entry),
+               updated_at = now()
+         where id = p_client_id
+        returning 1
+    )
+    select exists (select 1 from updated);
+$$;
+
+-- Remove one entry and return it; null if the client or entry is missing
+create or replace function public.client_document_remove(
+    p_client_id public.clients.id%type,
+    p_document_id text)
+returns jsonb
+language sql
+as $$
+    update public.clients c
+       set client_documents = c.client_documents - p_document_id,
+           updated_at = now()
+      from (select id, client_documents -> p_document_id as entry
+              from public.clients
+             where id = p_client_id
+               and client_documents ? p_document_id
+               for update) old
+     where c.id = old.id
+    returning old.entry;
+$$;
@@ -0,0 +1,29 @@
+-- Removal of a deleted client's files from storage (document_cleanup.py).
+-- One row per storage prefix, written as soon as the client row is gone,
+-- so a job outlives the worker that started it: a worker runs a job under
+-- a lease it renews while working, and any worker picks up pending jobs
+-- and jobs whose lease ran out. Status queries read the row, whichever
+-- worker asks.
+create table if not exists public.document_cleanup_jobs (
+    prefix text primary key,
+    bucket text not null,
+    status text not null default 'pending'
+        check (status in ('pending', 'running', 'completed', 'failed')),
+    listed integer not null default 0,
+    deleted integer not null default 0,
+    failed integer not null default 0,
+    -- Last few error messages
+    errors jsonb not null default '[]'::jsonb,
+    attempts integer not null default 0,
+    lease_owner text,
+    lease_expires_at timestamptz,
+    started_at timestamptz,
+    finished_at timestamptz,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+-- Pending and abandoned jobs, found by the workers' poll
+create index if not exists document_cleanup_jobs_open_idx
+    on public.document_cleanup_jobs (status, lease_expires_at)
+    where status in ('pending', 'running');
@@ -0,0 +1,7 @@
+-- Rows in sending, found by the scheduler's sweep for sends a dead worker
+-- abandoned (scheduler.py); there are only ever a few.
+-- Built concurrently, which can't run in a transaction block: keep this
+-- the file's only statement.
+create index concurrently if not exists scheduled_messages_sending_idx
+    on public.scheduled_messages (updated_at)
+    where status = 'sending';
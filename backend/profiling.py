@@ -0,0 +1,344 @@
+"""Opt-in per-request profiling with a stack sampler.
+
+A request is profiled when it carries `X-Profile: 1` together with a valid
+`X-Admin-Token`, or when it falls in the PROFILE_SAMPLE_RATE fraction of
+traffic. While at least one profiled request is in flight, a sampler thread
+reads the event loop thread's stack every PROFILE_INTERVAL_MS:
+
+- when the profiled request's task is the one running, the sample is its
+  Python stack;
+- when the task is suspended, the sample is "<suspended>" under the
+  downstream call it is waiting on (tagged through `tag()` by the
+  resilience hooks), so time spent in Supabase, Telnyx or Google shows up
+  as its own bar.
+
+Sampling rather than cProfile keeps concurrent requests on the same loop
+from bleeding into each other's profiles and keeps the overhead bounded by
+the interval. The last PROFILE_BUFFER_SIZE profiles stay in a ring buffer;
+routers/admin.py serves them as collapsed stacks or speedscope JSON.
+
+The ring buffer is per process, and server.py runs several workers, so a
+download usually reaches a worker that doesn't hold the profile. Set
+PROFILE_DIR to a directory the workers share and each finished profile is
+also written there as JSON (the newest PROFILE_BUFFER_SIZE are kept), so
+any worker serves any profile. Without it, profile from a single worker
+(--workers 1); a miss on another worker says so.
+"""
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "50"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+MAX_STACK_DEPTH = 128
+
+_current: contextvars.ContextVar[Optional["ProfileSession"]] = (
+    contextvars.ContextVar("profile_session", default=None))
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(
+        token.encode(), ADMIN_TOKEN.encode())
+
+
+class ProfileSession:
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status_code: Optional[int] = None
+        self.samples: Counter = Counter()
+        self.tags: List[str] = []
+        self.task = asyncio.current_task()
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.path}"
+
+    def to_dict(self) -> dict:
+        return {
+            **self.summary(),
+            "stacks": [[list(stack), count]
+                       for stack, count in self.samples.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ProfileSession":
+        """A finished session read back from PROFILE_DIR"""
+        session = cls.__new__(cls)
+        session.__dict__.update(
+            {key: data.get(key)
+             for key in ("id", "method", "path", "reason", "status_code",
+                         "started_at", "duration_ms")})
+        session.samples = Counter(
+            {tuple(stack): count for stack, count in data["stacks"]})
+        session.tags = []
+        return session
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "samples": sum(self.samples.values()),
+        }
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed format, for flamegraph.pl/speedscope"""
+        return "".join(f"{';'.join(stack)} {count}\n"
+                       for stack, count in self.samples.most_common())
+
+    def speedscope(self) -> dict:
+        frames: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            samples.append(
+                [frames.setdefault(name, len(frames)) for name in stack])
+            weights.append(round(count * PROFILE_INTERVAL * 1000, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "law-firm-crm-api",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [{
+                    "name": name
+                } for name in frames]
+            },
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+def _frame_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_qualname} "
+                     f"({os.path.basename(code.co_filename)}:"
+                     f"{frame.f_lineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class Sampler:
+    """Background thread sampling the stacks of active profile sessions"""
+
+    def __init__(self):
+        self.active: Dict[str, ProfileSession] = {}
+        self.finished: Deque[ProfileSession] = deque(
+            maxlen=PROFILE_BUFFER_SIZE)
+        # Finished sessions the sampler thread still has to write out
+        self._unsaved: List[ProfileSession] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run,
+                                            name="profile-sampler",
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._save()
+            if not self.active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            self._sample()
+            time.sleep(PROFILE_INTERVAL)
+
+    def _save(self) -> None:
+        """Write finished sessions to PROFILE_DIR and prune old files"""
+        with self._lock:
+            sessions, self._unsaved = self._unsaved, []
+        if not sessions:
+            return
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            for session in sessions:
+                path = os.path.join(PROFILE_DIR, f"{session.id}.json")
+                with open(path + ".tmp", "w") as f:
+                    json.dump(session.to_dict(), f)
+                os.replace(path + ".tmp", path)
+            for path in self._files()[PROFILE_BUFFER_SIZE:]:
+                os.remove(path)
+        except OSError as e:
+            logger.error("Failed to save profiles to %s: %s", PROFILE_DIR,
+                         e)
+
+    @staticmethod
+    def _files() -> List[str]:
+        """Saved profiles, newest first"""
+        paths = [
+            os.path.join(PROFILE_DIR, name)
+            for name in os.listdir(PROFILE_DIR) if name.endswith(".json")
+        ]
+        return sorted(paths, key=os.path.getmtime, reverse=True)
+
+    @staticmethod
+    def _load(path: str) -> Optional[ProfileSession]:
+        try:
+            with open(path) as f:
+                return ProfileSession.from_dict(json.load(f))
+        except (OSError, ValueError) as e:
+            # Pruned by another worker in the meantime, or half written
+            logger.debug("Skipping profile %s: %s", path, e)
+            return None
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            sessions = list(self.active.values())
+        for session in sessions:
+            running = asyncio.current_task(session.loop)
+            if running is session.task:
+                stack = _frame_stack(frames.get(session.thread_id))
+            else:
+                stack = ["<suspended>"]
+            tags = [f"[{label}]" for label in tuple(session.tags)]
+            session.samples[tuple([session.name] + tags + stack)] += 1
+
+    def start(self, session: ProfileSession) -> None:
+        with self._lock:
+            self.active[session.id] = session
+            self._ensure_thread()
+        self._wake.set()
+
+    def stop(self, session: ProfileSession) -> None:
+        session.duration_ms = round(
+            (time.perf_counter() - session.started) * 1000, 2)
+        with self._lock:
+            self.active.pop(session.id, None)
+            self.finished.append(session)
+            if PROFILE_DIR:
+                self._unsaved.append(session)
+                self._ensure_thread()
+        if PROFILE_DIR:
+            self._wake.set()
+
+    # Reads (blocking with PROFILE_DIR; run in a thread)
+
+    def list(self) -> List[dict]:
+        if PROFILE_DIR and os.path.isdir(PROFILE_DIR):
+            sessions = map(self._load, self._files())
+            return [session.summary() for session in sessions if session]
+        with self._lock:
+            return [session.summary() for session in reversed(self.finished)]
+
+    def get(self, profile_id: str) -> Optional[ProfileSession]:
+        with self._lock:
+            for session in self.finished:
+                if session.id == profile_id:
+                    return session
+        if PROFILE_DIR and profile_id.isalnum():
+            path = os.path.join(PROFILE_DIR, f"{profile_id}.json")
+            if os.path.exists(path):
+                return self._load(path)
+        return None
+
+
+sampler = Sampler()
+
+
+@contextmanager
+def tag(label: str):
+    """Label samples taken while a downstream call is in progress"""
+    session = _current.get()
+    if session is None:
+        yield
+        return
+    session.tags.append(label)
+    try:
+        yield
+    finally:
+        if session.tags and session.tags[-1] == label:
+            session.tags.pop()
+        elif label in session.tags:
+            session.tags.remove(label)
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, app, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    def _reason(self, scope) -> Optional[str]:
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") in (b"1", b"true"):
+            token = headers.get(b"x-admin-token", b"").decode("latin-1")
+            if is_admin(token):
+                return "requested"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        reason = self._reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        session = ProfileSession(scope["method"], scope["path"], reason)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                session.status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", session.id.encode())
+                ]
+            await send(message)
+
+        token = _current.set(session)
+        sampler.start(session)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop(session)
+            _current.reset(token)
+            logger.info("Captured profile %s for %s (%s samples)",
+                        session.id, session.name,
+                        sum(session.samples.values()))
@@ -0,0 +1,255 @@
+"""Token-bucket rate limiting for routes that spend third-party quota.
+
+Each RateLimit applies to a method/path prefix and either to every
+operator separately (keyed by the user `get_current_user` verifies the
+bearer token as, or by client address when there is no valid one) or
+globally across operators.
+A request consumes one token from every matching bucket; when one is empty
+the middleware answers 429 with Retry-After and the endpoint never runs.
+
+Limits are written "<requests per minute>/<burst>" and can be overridden per
+limit with RATE_LIMIT_<NAME>, e.g. RATE_LIMIT_SMS_SEND=20/5; "off" disables
+one. Buckets live in process memory by default, so every server.py worker
+enforces its own share. RATE_LIMIT_BACKEND=supabase keeps them in Postgres
+through the rate_limit_take() function from migrations/004 instead.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import supabase
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED",
+                               "true").lower() not in ("0", "false", "no")
+MAX_MEMORY_BUCKETS = 50000
+# How long a verified bearer token is trusted without asking again
+VERIFIED_USER_TTL = 60
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    name: str
+    path_prefix: str
+    per_minute: float
+    burst: int
+    methods: Tuple[str, ...] = ()
+    per_operator: bool = True
+
+    def __post_init__(self):
+        if not self.per_minute > 0 or self.burst < 1:
+            raise ValueError(
+                f"Rate limit {self.name} needs a positive rate and burst, "
+                f"got {self.per_minute:g}/{self.burst}; use \"off\" to "
+                "disable it")
+
+    @property
+    def rate(self) -> float:
+        """Tokens added per second"""
+        return self.per_minute / 60.0
+
+    def matches(self, method: str, path: str) -> bool:
+        return path.startswith(self.path_prefix) and (not self.methods or
+                                                      method in self.methods)
+
+
+def _limit(name: str, path_prefix: str, default: str,
+           **kwargs) -> Optional[RateLimit]:
+    spec = os.getenv(f"RATE_LIMIT_{name.upper().replace('-', '_')}", default)
+    if spec.strip().lower() == "off":
+        return None
+    per_minute, _, burst = spec.partition("/")
+    return RateLimit(name, path_prefix, float(per_minute),
+                     int(burst or per_minute), **kwargs)
+
+
+def default_limits() -> List[RateLimit]:
+    limits = [
+        # Telnyx bills per message and throttles per messaging profile
+        _limit("sms-send", "/api/messages/send", "30/10", methods=("POST", )),
+        _limit("sms-send-global",
+               "/api/messages/send",
+               "600/60",
+               methods=("POST", ),
+               per_operator=False),
+        # Covers /events, /events/create, /events/{id} and /event/{id}
+        _limit("calendar-events", "/api/calendar/event", "120/30"),
+        _limit("calendar-events-global",
+               "/api/calendar/event",
+               "1200/100",
+               per_operator=False),
+    ]
+    return [limit for limit in limits if limit is not None]
+
+
+class MemoryBucketBackend:
+    """Token buckets in a dict; the event loop serializes access"""
+
+    def __init__(self, max_buckets: int = MAX_MEMORY_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._limits: Dict[str, RateLimit] = {}
+
+    def configure(self, limits: Iterable[RateLimit]) -> None:
+        self._limits = {limit.name: limit for limit in limits}
+
+    def _prune(self, now: float) -> None:
+        # Buckets that have refilled completely carry no state worth keeping
+        for key, (tokens, updated) in list(self._buckets.items()):
+            limit = self._limits.get(key.split(":", 1)[0])
+            if limit is None or tokens + (now - updated) * limit.rate >= (
+                    limit.burst):
+                del self._buckets[key]
+
+    async def take(self, key: str, limit: RateLimit,
+                   cost: int = 1) -> float:
+        """Consume `cost` tokens; 0 if allowed, else seconds until allowed"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(limit.burst), now))
+        tokens = min(float(limit.burst), tokens + (now - updated) * limit.rate)
+        if tokens >= cost:
+            self._buckets[key] = (tokens - cost, now)
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (cost - tokens) / limit.rate
+
+
+class SupabaseBucketBackend:
+    """Buckets shared by all workers, updated atomically in Postgres"""
+
+    def configure(self, limits: Iterable[RateLimit]) -> None:
+        pass
+
+    def _take(self, key: str, limit: RateLimit, cost: int) -> float:
+        response = supabase.rpc(
+            "rate_limit_take", {
+                "p_key": key,
+                "p_rate": limit.rate,
+                "p_burst": limit.burst,
+                "p_cost": cost
+            }).execute()
+        return float(response.data or 0)
+
+    async def take(self, key: str, limit: RateLimit,
+                   cost: int = 1) -> float:
+        return await asyncio.to_thread(self._take, key, limit, cost)
+
+
+class OwnerResolver:
+    """Bucket owner of a request: the verified user, else the address.
+
+    A bearer token only counts once `get_current_user` accepts it, so
+    inventing a new token per request doesn't get a fresh bucket. Accepted
+    tokens are remembered for VERIFIED_USER_TTL seconds.
+    """
+
+    def __init__(self, max_entries: int = MAX_MEMORY_BUCKETS):
+        self.max_entries = max_entries
+        self._verified: Dict[str, Tuple[str, float]] = {}
+
+    @staticmethod
+    def _verify(authorization: str) -> Optional[str]:
+        # Imported here so the middleware loads without the routers
+        from fastapi import HTTPException
+        from routers.messages import get_current_user
+        try:
+            return str(get_current_user(authorization)["id"])
+        except HTTPException:
+            return None
+
+    async def owner(self, headers: Dict[bytes, bytes], scope) -> str:
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if authorization:
+            now = time.monotonic()
+            cached = self._verified.get(authorization)
+            if cached is not None and cached[1] > now:
+                return f"user={cached[0]}"
+            user_id = await asyncio.to_thread(self._verify, authorization)
+            if user_id is not None:
+                if len(self._verified) >= self.max_entries:
+                    self._verified.clear()
+                self._verified[authorization] = (user_id,
+                                                  now + VERIFIED_USER_TTL)
+                return f"user={user_id}"
+        client = scope.get("client")
+        return f"addr={client[0] if client else 'unknown'}"
+
+
+class RateLimitMiddleware:
+    """ASGI middleware enforcing RateLimit buckets before the endpoint runs"""
+
+    def __init__(self,
+                 app,
+                 limits: Optional[List[RateLimit]] = None,
+                 backend=None):
+        self.app = app
+        self.limits = default_limits() if limits is None else limits
+        if backend is None:
+            backend = (SupabaseBucketBackend()
+                       if RATE_LIMIT_BACKEND == "supabase" else
+                       MemoryBucketBackend())
+        backend.configure(self.limits)
+        self.backend = backend
+        self.owners = OwnerResolver()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        matching = [
+            limit for limit in self.limits if limit.matches(method, path)
+        ]
+        if not matching or method == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        owner = await self.owners.owner(dict(scope["headers"]), scope)
+        # Per-operator buckets first, so one operator hitting their own
+        # limit doesn't also drain the shared one
+        matching.sort(key=lambda limit: not limit.per_operator)
+        for limit in matching:
+            key = f"{limit.name}:{owner}" if limit.per_operator else (
+                f"{limit.name}:global")
+            try:
+                retry_after = await self.backend.take(key, limit)
+            except Exception as e:
+                # Fail open: a broken limiter must not take sending down
+                logger.warning("Rate limit backend failed for %s: %s",
+                               limit.name, e)
+                continue
+            if retry_after > 0:
+                logger.info("Rate limited %s %s (%s)", method, path,
+                            limit.name)
+                await self._reject(send, limit, retry_after)
+                return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, limit: RateLimit, retry_after: float) -> None:
+        seconds = max(1, math.ceil(retry_after))
+        body = json.dumps({
+            "detail":
+            f"Rate limit exceeded ({limit.name}); retry in {seconds}s"
+        }).encode("utf-8")
+        await send({
+            "type":
+            "http.response.start",
+            "status":
+            429,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(seconds).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
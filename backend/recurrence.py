@@ -0,0 +1,291 @@
+"""Local expansion of recurring Google Calendar events.
+
+Given a recurring event's master (its RRULE/EXRULE/RDATE/EXDATE lines) and
+its exceptions (modified or cancelled occurrences, as Google lists them with
+singleEvents=False), `expand()` yields the occurrences in a time window,
+shaped like the instances Google returns with singleEvents=True.
+
+Rules are evaluated in the event's own time zone, so a weekly 9:00 meeting
+stays at 9:00 across DST changes. Only the requested window is expanded:
+DAILY and WEEKLY rules without COUNT start from the last period boundary
+before the window instead of from the first occurrence. The occurrence
+starts of a (rule, window) pair are memoized, RECURRENCE_CACHE_SIZE entries
+at most; a changed rule or start is a different key, so edits never see a
+stale expansion.
+"""
+import heapq
+import itertools
+import os
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from dateutil.rrule import DAILY, WEEKLY, rrulestr, rruleset
+
+RECURRENCE_CACHE_SIZE = int(os.getenv("RECURRENCE_CACHE_SIZE", "4096"))
+
+# Length of a DATE value (YYYYMMDD), as opposed to a DATE-TIME
+_DATE_LENGTH = 8
+
+
+def _zone(start: dict) -> tzinfo:
+    if start.get("timeZone"):
+        return ZoneInfo(start["timeZone"])
+    value = datetime.fromisoformat(start["dateTime"])
+    return value.tzinfo or timezone.utc
+
+
+def _local(value: datetime, zone: tzinfo) -> datetime:
+    """Wall-clock time of an aware datetime in `zone`, as a naive datetime"""
+    return value.astimezone(zone).replace(tzinfo=None)
+
+
+def _bounds(start: dict, end: dict) -> Tuple[datetime, timedelta, tzinfo,
+                                             bool]:
+    """Naive local start, duration, zone and all-day flag of an event"""
+    if start.get("date"):
+        first = datetime.fromisoformat(start["date"])
+        last = datetime.fromisoformat(end.get("date") or start["date"])
+        return first, max(last - first, timedelta(days=1)), timezone.utc, True
+    zone = _zone(start)
+    first = datetime.fromisoformat(start["dateTime"])
+    last = datetime.fromisoformat(end.get("dateTime") or start["dateTime"])
+    if first.tzinfo is None:
+        first = first.replace(tzinfo=zone)
+    if last.tzinfo is None:
+        last = last.replace(tzinfo=zone)
+    return _local(first, zone), last - first, zone, False
+
+
+def _parse_value(value: str, params: Dict[str, str], zone: tzinfo,
+                 dtstart: datetime) -> datetime:
+    """An RDATE/EXDATE value as naive wall-clock time in the event's zone"""
+    if len(value) == _DATE_LENGTH:
+        # A date excludes (or adds) the occurrence at the usual time
+        day = datetime.strptime(value, "%Y%m%d")
+        return day.replace(hour=dtstart.hour,
+                           minute=dtstart.minute,
+                           second=dtstart.second)
+    if value.endswith("Z"):
+        parsed = datetime.strptime(value, "%Y%m%dT%H%M%SZ")
+        return _local(parsed.replace(tzinfo=timezone.utc), zone)
+    parsed = datetime.strptime(value, "%Y%m%dT%H%M%S")
+    if params.get("TZID"):
+        return _local(parsed.replace(tzinfo=ZoneInfo(params["TZID"])), zone)
+    return parsed
+
+
+def _normalize_rule(rule: str, zone: tzinfo, all_day: bool) -> str:
+    """Rewrite UNTIL as naive local time, the form rrulestr expects here.
+
+    Rules are expanded on naive wall-clock times; a UTC UNTIL is moved into
+    the event's zone and a date UNTIL covers the whole day.
+    """
+    parts = []
+    for part in rule.split(";"):
+        name, _, value = part.partition("=")
+        if name.upper() == "UNTIL":
+            if value.endswith("Z"):
+                until = _local(
+                    datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(
+                        tzinfo=timezone.utc), zone)
+            elif len(value) == _DATE_LENGTH:
+                until = datetime.strptime(value, "%Y%m%d")
+                if not all_day:
+                    until = until.replace(hour=23, minute=59, second=59)
+            else:
+                until = datetime.strptime(value, "%Y%m%dT%H%M%S")
+            value = until.strftime("%Y%m%dT%H%M%S")
+        parts.append(f"{name}={value}")
+    return ";".join(parts)
+
+
+def _split_line(line: str) -> Tuple[str, Dict[str, str], str]:
+    head, _, value = line.partition(":")
+    name, *raw_params = head.split(";")
+    params = dict(p.split("=", 1) for p in raw_params if "=" in p)
+    return name.upper(), params, value
+
+
+def _fast_forward(rule, after: datetime):
+    """The rule restarted at its last full period before `after`.
+
+    Only for DAILY and WEEKLY rules without COUNT: shifting the start by a
+    whole number of intervals keeps the phase of every occurrence.
+    """
+    if rule._freq not in (DAILY, WEEKLY) or rule._count or after is None:
+        return rule
+    period = timedelta(days=rule._interval *
+                       (7 if rule._freq == WEEKLY else 1))
+    periods = (after - rule._dtstart) // period - 1
+    if periods <= 0:
+        return rule
+    return rule.replace(dtstart=rule._dtstart + periods * period)
+
+
+@lru_cache(maxsize=RECURRENCE_CACHE_SIZE)
+def _occurrence_starts(recurrence: Tuple[str, ...], dtstart: datetime,
+                       zone: tzinfo, all_day: bool, duration: timedelta,
+                       window_start: Optional[datetime],
+                       window_end: Optional[datetime],
+                       limit: int) -> Tuple[datetime, ...]:
+    """Aware starts of the occurrences overlapping the window, in order"""
+    after = None
+    if window_start is not None:
+        # An occurrence overlaps the window if it ends after its start; pad
+        # the naive bound by an hour for DST and filter exactly below
+        after = _local(window_start, zone) - duration - timedelta(hours=1)
+    before = None
+    if window_end is not None:
+        before = _local(window_end, zone) + timedelta(hours=1)
+
+    rules = rruleset()
+    rules.rdate(dtstart)
+    for line in recurrence:
+        name, params, value = _split_line(line)
+        if name in ("RRULE", "EXRULE"):
+            rule = rrulestr(_normalize_rule(value, zone, all_day),
+                            dtstart=dtstart)
+            if name == "RRULE":
+                rules.rrule(_fast_forward(rule, after))
+            else:
+                rules.exrule(rule)
+        elif name in ("RDATE", "EXDATE"):
+            for item in value.split(","):
+                parsed = _parse_value(item, params, zone, dtstart)
+                if name == "RDATE":
+                    rules.rdate(parsed)
+                else:
+                    rules.exdate(parsed)
+
+    starts = []
+    candidates = rules.xafter(after, inc=False) if after else iter(rules)
+    for candidate in candidates:
+        if before is not None and candidate >= before:
+            break
+        start = candidate.replace(tzinfo=zone)
+        if window_end is not None and start >= window_end:
+            break
+        if window_start is not None and start + duration <= window_start:
+            continue
+        starts.append(start)
+        if len(starts) >= limit:
+            break
+    return tuple(starts)
+
+
+def occurrence_key(start: dict) -> Optional[str]:
+    """Id suffix Google gives the occurrence that starts at `start`"""
+    if start.get("date"):
+        return start["date"].replace("-", "")
+    if start.get("dateTime"):
+        value = datetime.fromisoformat(start["dateTime"])
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=_zone(start))
+        return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return None
+
+
+def _time_value(value: datetime, zone: tzinfo, all_day: bool,
+                time_zone: Optional[str]) -> dict:
+    if all_day:
+        return {"date": value.date().isoformat()}
+    result = {"dateTime": value.astimezone(zone).isoformat()}
+    if time_zone:
+        result["timeZone"] = time_zone
+    return result
+
+
+def sort_key(event: dict) -> datetime:
+    """UTC start of an event or occurrence; all-day events at midnight UTC"""
+    start = event.get("start") or {}
+    if start.get("dateTime"):
+        value = datetime.fromisoformat(start["dateTime"])
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=_zone(start))
+        return value.astimezone(timezone.utc)
+    if start.get("date"):
+        return datetime.fromisoformat(
+            start["date"]).replace(tzinfo=timezone.utc)
+    return datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _end_key(event: dict) -> datetime:
+    end = event.get("end") or {}
+    if end.get("dateTime") or end.get("date"):
+        return sort_key({"start": end})
+    return sort_key(event)
+
+
+def overlaps(event: dict, window_start: Optional[datetime],
+             window_end: Optional[datetime]) -> bool:
+    """Whether an event overlaps the window, as timeMin/timeMax filter it"""
+    if window_end is not None and sort_key(event) >= window_end:
+        return False
+    if window_start is not None and _end_key(event) <= window_start:
+        return False
+    return True
+
+
+def expand(master: dict,
+           exceptions: Iterable[dict] = (),
+           window_start: Optional[datetime] = None,
+           window_end: Optional[datetime] = None,
+           limit: int = 2500) -> List[dict]:
+    """Occurrences of a recurring event overlapping the window, by start.
+
+    `exceptions` are the event's modified or cancelled occurrences, matched
+    to the rule's occurrences by originalStartTime. A moved occurrence is
+    included where it now falls, even if it was scheduled outside the
+    window.
+    """
+    start, end = master.get("start") or {}, master.get("end") or {}
+    dtstart, duration, zone, all_day = _bounds(start, end)
+    overridden = {}
+    for exception in exceptions:
+        key = occurrence_key(exception.get("originalStartTime") or {})
+        if key:
+            overridden[key] = exception
+
+    starts = _occurrence_starts(tuple(master.get("recurrence") or ()),
+                                dtstart, zone, all_day, duration,
+                                window_start, window_end, limit)
+    template = {
+        k: v
+        for k, v in master.items() if k not in ("recurrence", "start", "end")
+    }
+    occurrences = []
+    for occurrence_start in starts:
+        original = _time_value(occurrence_start, zone, all_day,
+                               start.get("timeZone"))
+        key = occurrence_key(original)
+        if key in overridden:
+            continue
+        occurrences.append({
+            **template,
+            "id": f"{master['id']}_{key}",
+            "recurringEventId": master["id"],
+            "originalStartTime": original,
+            "start": original,
+            "end": _time_value(occurrence_start + duration, zone, all_day,
+                               end.get("timeZone")),
+        })
+    moved = [
+        exception for exception in overridden.values()
+        if exception.get("status") != "cancelled"
+        and overlaps(exception, window_start, window_end)
+    ]
+    return list(
+        itertools.islice(
+            heapq.merge(occurrences, sorted(moved, key=sort_key),
+                        key=sort_key), limit))
+
+
+def merge(series: Iterable[List[dict]], limit: int) -> List[dict]:
+    """Merge lists of events sorted by start into the first `limit`"""
+    return list(itertools.islice(heapq.merge(*series, key=sort_key), limit))
+
+
+def cache_info():
+    return _occurrence_starts.cache_info()
@@ -0,0 +1,497 @@
+"""Timeouts, circuit breakers and bounded retries for downstream services.
+
+Every dependency (Supabase, Telnyx, Google) gets a `Dependency`: a latency
+window that drives an adaptive timeout (a multiple of the recent p99,
+clamped between a floor and the configured ceiling) and one or more
+circuit breakers. A breaker opens after `failure_threshold` consecutive
+failures and rejects calls immediately with CircuitOpenError until
+`recovery_timeout` has passed; then a single trial call decides whether it
+closes again.
+
+Hooks:
+- BreakerTransport / AsyncBreakerTransport wrap the httpx transports of
+  the Supabase (PostgREST) and Storage clients. Idempotent requests (GET,
+  HEAD) are retried a bounded number of times on connection errors and
+  502/503/504. The adaptive timeout never shortens a timeout the client
+  was configured with, and streamed uploads stay out of the latency
+  window: they take as long as the browser takes to send them.
+- `google_http()` builds the httplib2 connection used by the Google API
+  client.
+- `call()` runs blocking SDK calls (Telnyx) in a worker thread under the
+  adaptive timeout, with a breaker per sender so send_sms can skip a
+  tripped sender and go straight to its fallback.
+
+Client errors (4xx other than 408/429) never count against a breaker: they
+say nothing about the dependency's health.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+import tracing
+from profiling import tag
+
+logger = logging.getLogger(__name__)
+
+# Adaptive timeout = clamp(p99 * TIMEOUT_MULTIPLIER, floor, ceiling)
+TIMEOUT_MULTIPLIER = float(os.getenv("TIMEOUT_P99_MULTIPLIER", "4"))
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 200
+RETRY_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(
+            f"{name} is unavailable (circuit open); retry in "
+            f"{max(1, round(retry_after))}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.total_failures = 0
+        self.total_rejected = 0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            self.total_rejected += 1
+            raise CircuitOpenError(self.name, max(remaining, 0.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Circuit %s closed", self.name)
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == "half_open" or (
+                    self.consecutive_failures >= self.failure_threshold
+                    and self.state == "closed"):
+                logger.warning("Circuit %s opened after %s failures",
+                               self.name, self.consecutive_failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_neutral(self) -> None:
+        """The call completed without saying anything about health"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected,
+            }
+
+
+class Dependency:
+
+    def __init__(self, name: str, floor: float, ceiling: float,
+                 retries: int, failure_threshold: int,
+                 recovery_timeout: float):
+        self.name = name
+        self.floor = floor
+        self.ceiling = ceiling
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.breaker()
+
+    def breaker(self, part: Optional[str] = None) -> CircuitBreaker:
+        """Breaker for the whole dependency, or for one part of it"""
+        name = f"{self.name}.{part}" if part else self.name
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(
+                    name,
+                    CircuitBreaker(name, self.failure_threshold,
+                                   self.recovery_timeout))
+        return breaker
+
+    def record_latency(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def timeout(self) -> float:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return self.ceiling
+        return min(self.ceiling,
+                   max(self.floor,
+                       self.percentile(0.99) * TIMEOUT_MULTIPLIER))
+
+    def snapshot(self) -> dict:
+        p50, p99 = self.percentile(0.5), self.percentile(0.99)
+        return {
+            "timeout_s": round(self.timeout(), 3),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+            "breakers": {
+                name: breaker.snapshot()
+                for name, breaker in self.breakers.items()
+            },
+        }
+
+
+def _dependency(name: str, floor: float, ceiling: float,
+                retries: int) -> Dependency:
+    prefix = name.upper()
+    return Dependency(
+        name,
+        floor=float(os.getenv(f"{prefix}_TIMEOUT_FLOOR", str(floor))),
+        ceiling=float(os.getenv(f"{prefix}_TIMEOUT", str(ceiling))),
+        retries=int(os.getenv(f"{prefix}_RETRIES", str(retries))),
+        failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+        recovery_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET", "30")))
+
+
+supabase_dependency = _dependency("supabase", floor=3.0, ceiling=15.0,
+                                  retries=2)
+# Same host as supabase, but a failing or slow bucket mustn't trip the
+# database's breaker or stretch its timeouts
+storage_dependency = _dependency("storage", floor=3.0, ceiling=30.0,
+                                 retries=2)
+telnyx_dependency = _dependency("telnyx", floor=2.0, ceiling=10.0, retries=0)
+google_dependency = _dependency("google", floor=3.0, ceiling=15.0, retries=2)
+
+DEPENDENCIES = {
+    dependency.name: dependency
+    for dependency in (supabase_dependency, storage_dependency,
+                       telnyx_dependency, google_dependency)
+}
+
+
+def snapshot() -> Dict[str, dict]:
+    return {name: dep.snapshot() for name, dep in DEPENDENCIES.items()}
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter, so retrying replicas don't synchronize
+    return random.uniform(0, 0.2 * 2**attempt)
+
+
+def is_client_error(exc: BaseException) -> bool:
+    status = getattr(exc, "http_status", None) or getattr(
+        exc, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (
+        408, 429)
+
+
+@contextmanager
+def _instrument(dependency: Dependency, operation: str,
+                attributes: Optional[Dict[str, Any]] = None):
+    """Profiler tag and client span around one downstream call"""
+    label = f"{dependency.name} {operation}"
+    with tag(label), tracing.span(label,
+                                  kind="client",
+                                  attributes={
+                                      "peer.service": dependency.name,
+                                      **(attributes or {})
+                                  }) as span:
+        yield span
+
+
+async def call(dependency: Dependency,
+               func: Callable,
+               *args,
+               part: Optional[str] = None,
+               **kwargs):
+    """Run a blocking SDK call in a thread under breaker and timeout.
+
+    The call is not retried: SDK calls like sending a message are not
+    idempotent. On timeout the worker thread is abandoned and the call may
+    still complete, so callers must not treat TimeoutError as a rejection;
+    the SDK's own timeout is set to the dependency's ceiling (see
+    routers.messages.get_telnyx) so the thread doesn't linger past it.
+    """
+    breaker = dependency.breaker(part)
+    breaker.before_call()
+    started = time.perf_counter()
+    try:
+        with _instrument(dependency,
+                         getattr(func, "__qualname__", str(func)),
+                         {"resilience.breaker": breaker.name}):
+            result = await asyncio.wait_for(
+                asyncio.to_thread(func, *args, **kwargs),
+                dependency.timeout())
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        raise TimeoutError(
+            f"{breaker.name} did not answer within "
+            f"{dependency.timeout():.1f}s")
+    except Exception as e:
+        if is_client_error(e):
+            breaker.record_neutral()
+        else:
+            breaker.record_failure()
+        raise
+    except BaseException:
+        # Cancelled: says nothing about health, but must end a trial call
+        breaker.record_neutral()
+        raise
+    dependency.record_latency(time.perf_counter() - started)
+    breaker.record_success()
+    return result
+
+
+def _http_attributes(request: httpx.Request, attempt: int) -> dict:
+    return {
+        "http.method": request.method,
+        "http.url": str(request.url.copy_with(query=None)),
+        "retry.attempt": attempt,
+    }
+
+
+def _record_status(span, status_code: int) -> None:
+    span.set_attribute("http.status_code", status_code)
+    if status_code >= 500:
+        span.set_error(f"HTTP {status_code}")
+
+
+def _request_timeout(dependency: Dependency, request: httpx.Request) -> dict:
+    """The adaptive timeout, never shorter than the client's own setting.
+
+    A client built with a long read timeout (storage uploads) or none at
+    all keeps it; the adaptive value only lengthens short ones.
+    """
+    timeout = dependency.timeout()
+    adaptive = httpx.Timeout(timeout, connect=min(timeout, 5.0)).as_dict()
+    configured = request.extensions.get("timeout") or {}
+    merged = {}
+    for key, value in adaptive.items():
+        if key in configured and configured[key] is None:
+            merged[key] = None
+        else:
+            merged[key] = max(value, configured.get(key) or 0)
+    return merged
+
+
+def _is_streamed(request: httpx.Request) -> bool:
+    """Whether the body is sent from an iterator, as uploads are"""
+    return not isinstance(request.stream, httpx.ByteStream)
+
+
+class BreakerTransport(httpx.BaseTransport):
+    """httpx transport adding breaker, adaptive timeout and GET retries"""
+
+    def __init__(self, dependency: Dependency,
+                 transport: Optional[httpx.BaseTransport] = None):
+        self.dependency = dependency
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        breaker = self.dependency.breaker()
+        retries = (self.dependency.retries
+                   if request.method in IDEMPOTENT_METHODS else 0)
+        timeout = _request_timeout(self.dependency, request)
+        for attempt in range(retries + 1):
+            breaker.before_call()
+            request.extensions["timeout"] = timeout
+            started = time.perf_counter()
+            try:
+                with _instrument(self.dependency,
+                                 f"{request.method} {request.url.path}",
+                                 _http_attributes(request, attempt)) as span:
+                    tracing.inject(request.headers)
+                    response = self.transport.handle_request(request)
+                    _record_status(span, response.status_code)
+            except httpx.TransportError:
+                breaker.record_failure()
+                if attempt == retries:
+                    raise
+                time.sleep(_backoff(attempt))
+                continue
+            except BaseException:
+                # Cancelled, or the body iterator raised: nothing learned
+                # about the dependency, but a trial call must end
+                breaker.record_neutral()
+                raise
+            if response.status_code >= 500:
+                breaker.record_failure()
+                if (response.status_code in RETRY_STATUSES
+                        and attempt < retries):
+                    response.close()
+                    time.sleep(_backoff(attempt))
+                    continue
+                return response
+            if not _is_streamed(request):
+                self.dependency.record_latency(time.perf_counter() - started)
+            breaker.record_success()
+            return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncBreakerTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of BreakerTransport, for the Storage client"""
+
+    def __init__(self, dependency: Dependency,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.dependency = dependency
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self,
+                                   request: httpx.Request) -> httpx.Response:
+        breaker = self.dependency.breaker()
+        retries = (self.dependency.retries
+                   if request.method in IDEMPOTENT_METHODS else 0)
+        timeout = _request_timeout(self.dependency, request)
+        for attempt in range(retries + 1):
+            breaker.before_call()
+            request.extensions["timeout"] = timeout
+            started = time.perf_counter()
+            try:
+                with _instrument(self.dependency,
+                                 f"{request.method} {request.url.path}",
+                                 _http_attributes(request, attempt)) as span:
+                    tracing.inject(request.headers)
+                    response = await self.transport.handle_async_request(
+                        request)
+                    _record_status(span, response.status_code)
+            except httpx.TransportError:
+                breaker.record_failure()
+                if attempt == retries:
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            except BaseException:
+                # Cancelled, or the body iterator raised: nothing learned
+                # about the dependency, but a trial call must end
+                breaker.record_neutral()
+                raise
+            if response.status_code >= 500:
+                breaker.record_failure()
+                if (response.status_code in RETRY_STATUSES
+                        and attempt < retries):
+                    await response.aclose()
+                    await asyncio.sleep(_backoff(attempt))
+                    continue
+                return response
+            if not _is_streamed(request):
+                self.dependency.record_latency(time.perf_counter() - started)
+            breaker.record_success()
+            return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+_breaker_http_class = None
+
+
+def google_http(dependency: Optional[Dependency] = None):
+    """httplib2 connection for the Google API client with the same policy.
+
+    httplib2 (and the pyparsing it pulls in) is imported on first use to
+    keep it out of the application's import time.
+    """
+    global _breaker_http_class
+    if _breaker_http_class is None:
+        from urllib.parse import urlsplit
+
+        import httplib2
+
+        class BreakerHttp(httplib2.Http):
+
+            def __init__(self, dependency: Dependency, **kwargs):
+                super().__init__(timeout=dependency.ceiling, **kwargs)
+                self.dependency = dependency
+
+            def request(self, uri, method="GET", *args, **kwargs):
+                breaker = self.dependency.breaker()
+                retries = (self.dependency.retries
+                           if method in IDEMPOTENT_METHODS else 0)
+                for attempt in range(retries + 1):
+                    breaker.before_call()
+                    self.timeout = self.dependency.timeout()
+                    started = time.perf_counter()
+                    try:
+                        with _instrument(
+                                self.dependency,
+                                f"{method} {urlsplit(uri).path}", {
+                                    "http.method": method,
+                                    "http.url": uri.split("?")[0],
+                                    "retry.attempt": attempt,
+                                }) as span:
+                            if len(args) < 2:
+                                headers = dict(kwargs.get("headers") or {})
+                                tracing.inject(headers)
+                                kwargs["headers"] = headers
+                            response, content = super().request(
+                                uri, method, *args, **kwargs)
+                            _record_status(span, response.status)
+                    except (OSError, httplib2.HttpLib2Error):
+                        breaker.record_failure()
+                        if attempt == retries:
+                            raise
+                        time.sleep(_backoff(attempt))
+                        continue
+                    except BaseException:
+                        breaker.record_neutral()
+                        raise
+                    if response.status >= 500:
+                        breaker.record_failure()
+                        if (response.status in RETRY_STATUSES
+                                and attempt < retries):
+                            time.sleep(_backoff(attempt))
+                            continue
+                        return response, content
+                    self.dependency.record_latency(time.perf_counter() -
+                                                   started)
+                    breaker.record_success()
+                    return response, content
+
+        _breaker_http_class = BreakerHttp
+    return _breaker_http_class(dependency or google_dependency)
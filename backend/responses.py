@@ -0,0 +1,125 @@
+"""JSON response class used as the application default, and conditional
+GET handling for read endpoints.
+
+Rows coming back from PostgREST and the Google API are already plain
+JSON types, so the large list endpoints return `FastJSONResponse(rows)`
+directly: FastAPI then skips both response-model validation and its
+`jsonable_encoder` walk, and the body is rendered by orjson in one pass.
+"""
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Optional, Union
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, falling back to the stdlib"""
+
+    def render(self, content: Any) -> bytes:
+        # jsonable_encoder only runs for values orjson can't encode natively
+        # (Decimal, pydantic models, sets)
+        if orjson is not None:
+            return orjson.dumps(content,
+                                default=jsonable_encoder,
+                                option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content,
+                          default=jsonable_encoder,
+                          ensure_ascii=False,
+                          allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+
+# Clients may reuse a stored copy but must revalidate it on every use
+DEFAULT_CACHE_CONTROL = "private, no-cache"
+
+
+def parse_timestamp(value: Union[str, datetime, None]) -> Optional[datetime]:
+    """Parse an `updated_at`-style value; naive timestamps are taken as UTC"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _make_etag(data: bytes) -> str:
+    # Weak: the compression middleware may re-encode the same representation
+    return f'W/"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:]
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since is None:
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have one-second resolution
+    return last_modified.replace(microsecond=0) <= since
+
+
+def conditional_response(request: Request,
+                         content: Any,
+                         last_modified: Union[str, datetime, None] = None,
+                         cache_control: str = DEFAULT_CACHE_CONTROL,
+                         vary: Optional[str] = None) -> Response:
+    """Answer a GET with 304 when the client's validators still match.
+
+    The ETag hashes the rendered JSON body, so it changes with any write,
+    including ones that don't touch `updated_at`; `last_modified` (usually
+    the row's, or the newest row's, `updated_at`) adds Last-Modified for
+    If-Modified-Since. If-None-Match takes precedence, as RFC 9110 requires.
+    The database read still happens; a 304 saves the body on the wire.
+    """
+    body = FastJSONResponse(content).body
+    etag = _make_etag(body)
+    last_modified = parse_timestamp(last_modified)
+
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if vary:
+        headers["Vary"] = vary
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    elif if_modified_since is not None and last_modified is not None:
+        not_modified = _not_modified_since(if_modified_since, last_modified)
+    else:
+        not_modified = False
+
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from typing import Literal, Optional
+import asyncio
+import logging
+import os
+import tracing
+from profiling import is_admin, sampler, ADMIN_TOKEN, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+def require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Admin endpoints are disabled")
+    if not is_admin(token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Invalid admin token")
+
+
+@router.get("/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Profiles in the ring buffer, newest first"""
+    require_admin(x_admin_token)
+    return {"profiles": await asyncio.to_thread(sampler.list)}
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str,
+                           format: Literal["speedscope",
+                                           "collapsed"] = "speedscope",
+                           x_admin_token: Optional[str] = Header(None)):
+    """Download a profile as speedscope JSON or collapsed stacks.
+
+    Open the JSON at https://www.speedscope.app; feed the collapsed text to
+    flamegraph.pl or any tool reading Brendan Gregg's folded format.
+    """
+    require_admin(x_admin_token)
+    session = await asyncio.to_thread(sampler.get, profile_id)
+    if session is None:
+        detail = f"Profile {profile_id} not found"
+        if not PROFILE_DIR:
+            # Each worker keeps only its own profiles
+            detail += (f" in worker {os.getpid()}; with several workers set "
+                       "PROFILE_DIR to a directory they share")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=detail)
+    filename = f"profile-{profile_id}"
+    if format == "collapsed":
+        return PlainTextResponse(
+            session.collapsed(),
+            headers={
+                "Content-Disposition":
+                f'attachment; filename="{filename}.folded"'
+            })
+    return {**session.speedscope()}
+
+
+def _memory_exporter() -> tracing.MemorySpanExporter:
+    exporter = tracing.exporter()
+    if not isinstance(exporter, tracing.MemorySpanExporter):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Traces are only kept with TRACING_EXPORTER=memory")
+    return exporter
+
+
+@router.get("/traces")
+async def list_traces(limit: int = Query(50, ge=1, le=500),
+                      x_admin_token: Optional[str] = Header(None)):
+    """Recent traces held by the in-memory exporter"""
+    require_admin(x_admin_token)
+    await asyncio.to_thread(tracing.flush)
+    return {"traces": _memory_exporter().traces(limit)}
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str,
+                    x_admin_token: Optional[str] = Header(None)):
+    """All spans of one trace, in start order"""
+    require_admin(x_admin_token)
+    await asyncio.to_thread(tracing.flush)
+    spans = _memory_exporter().spans(trace_id.lower())
+    if not spans:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Trace {trace_id} not found")
+    return {
+        "trace_id": trace_id.lower(),
+        "spans": sorted(spans, key=lambda span: span["start_time_unix_nano"])
+    }
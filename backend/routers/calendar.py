@@ -1,12 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Header, Query
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-from datetime import datetime, date
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+from datetime import datetime, date, timezone
+from zoneinfo import ZoneInfo
 from googleapiclient.errors import HttpError
+from responses import FastJSONResponse
+from health import prober
+import calendar_push
+import event_cache
+import event_index
+import recurrence
+import scheduler
+import asyncio
+import base64
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
 import os
 import logging
@@ -17,6 +28,22 @@ logger = logging.getLogger(__name__)
 # Google Calendar API settings
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+# Optional base URL override, e.g. to point at a local stand-in for load tests
+GOOGLE_CALENDAR_API_ENDPOINT = os.getenv("GOOGLE_CALENDAR_API_ENDPOINT")
+
+# "local" answers event lists from a cached copy of the calendar, expanding
+# recurring events in-process (see event_cache); "google" has Google expand
+# them on every request
+CALENDAR_EXPANSION = os.getenv("CALENDAR_EXPANSION", "local").lower()
+
+# Calendars fetched at once by the aggregated view, and how many it takes
+CALENDAR_FETCH_CONCURRENCY = int(os.getenv("CALENDAR_FETCH_CONCURRENCY",
+                                           "8"))
+MAX_AGGREGATED_CALENDARS = 50
+
+# Comment line sent on idle change streams so proxies keep them open
+STREAM_KEEPALIVE = 15
+
 # Get the redirect URI dynamically or use the provided one
 REDIRECT_URI = "https://zp1v56uxy8rdx5ypatb0ockcb9tr6a-oci3-ngejxxvp--5173--55edb8f4.local-credentialless.webcontainer-api.io/calendar/oauth2callback"
 
@@ -54,6 +81,11 @@ class EventBase(BaseModel):
     reminders: Optional[List[EventReminder]] = None
     recurrence: Optional[List[str]] = None
     timezone: Optional[str] = "UTC"
+    # SMS reminders to this client, in minutes before the start. For
+    # recurring events only the first occurrence is reminded.
+    client_id: Optional[str] = None
+    sms_reminders: Optional[List[int]] = None
+    sms_reminder_text: Optional[str] = None
 
 
 class EventCreate(EventBase):
@@ -64,6 +96,10 @@ class EventUpdate(EventBase):
     pass
 
 
+class EventClientLink(BaseModel):
+    client_id: Optional[str] = None  # None unlinks the event
+
+
 class CalendarCredentials(BaseModel):
     token: str
     refresh_token: Optional[str] = None
@@ -71,25 +107,226 @@ class CalendarCredentials(BaseModel):
     client_id: str
     client_secret: str
     scopes: List[str]
+    # As returned by oauth2callback; without it every call refreshes the token
+    expiry: Optional[str] = None
+
+
+class CalendarSource(BaseModel):
+    """One account and the calendars of it to include"""
+    credentials: CalendarCredentials
+    calendar_ids: List[str] = ["primary"]
+
+
+class AggregatedEventsRequest(BaseModel):
+    sources: List[CalendarSource]
+
+
+class CalendarWatch(BaseModel):
+    credentials: CalendarCredentials
+    calendar_id: str = "primary"
+
+
+def _new_flow():
+    """Create an OAuth flow; google_auth_oauthlib is imported on first use"""
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_config(CLIENT_CONFIG, SCOPES)
+
+
+def _build_service(credentials):
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+    from resilience import google_http
+    client_options = None
+    if GOOGLE_CALENDAR_API_ENDPOINT:
+        client_options = {"api_endpoint": GOOGLE_CALENDAR_API_ENDPOINT}
+    # Calls go through the Google breaker with adaptive timeouts
+    return build('calendar',
+                 'v3',
+                 http=AuthorizedHttp(credentials, http=google_http()),
+                 client_options=client_options)
+
+
+def warmup() -> None:
+    """Import the Google client libraries ahead of the first request"""
+    import google.oauth2.credentials
+    import google_auth_oauthlib.flow
+    import googleapiclient.discovery
+
+
+def _event_start(event: EventBase) -> datetime:
+    start = event.start_datetime
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=ZoneInfo(event.timezone or "UTC"))
+    return start
+
+
+def _google_start(google_event: dict) -> Optional[datetime]:
+    start = google_event.get("start", {})
+    if not start.get("dateTime"):
+        return None
+    value = datetime.fromisoformat(start["dateTime"])
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=ZoneInfo(start.get("timeZone") or "UTC"))
+    return value
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _index_event(service,
+                 google_event: dict,
+                 calendar_id: str = "primary") -> None:
+    """Mirror one event into the client index; failures are only logged"""
+    try:
+        # Indexed under the calendar it was written to, as its sync would:
+        # the organizer of an invitation is someone else's calendar
+        event_index.apply([google_event],
+                          event_index.resolve_calendar_id(
+                              service, calendar_id))
+    except Exception as e:
+        logger.error("Failed to index event %s: %s", google_event.get("id"),
+                     e)
+
+
+def _reminder_text(summary: Optional[str], start: datetime,
+                   location: Optional[str]) -> str:
+    return (f"Reminder: {summary} on "
+            f"{start.strftime('%a %b %d at %I:%M %p')}" +
+            (f", {location}" if location else "") + ".")
+
+
+def _schedule_sms_reminders(event_id: str, event: EventBase,
+                            authorization: Optional[str]) -> List[dict]:
+    """Schedule the event's SMS reminders; failures are logged, not raised"""
+    if not (event.client_id and event.sms_reminders):
+        return []
+    try:
+        from routers.messages import TELNYX_PHONE_NUMBER, get_current_user
+        user = get_current_user(authorization) if authorization else {}
+        start = _event_start(event)
+        text = event.sms_reminder_text or _reminder_text(
+            event.summary, start, event.location)
+        rows = scheduler.reminder_rows(
+            event_id, event.client_id, start.astimezone(timezone.utc),
+            event.sms_reminders, text, user.get("id"),
+            user.get("phone_number") or TELNYX_PHONE_NUMBER)
+        created = scheduler.schedule(rows)
+        logger.info("Scheduled %s SMS reminders for event %s", len(created),
+                    event_id)
+        return created
+    except Exception as e:
+        logger.error("Failed to schedule SMS reminders for event %s: %s",
+                     event_id, e)
+        return []
+
+
+def _processed_event(event: dict) -> dict:
+    """The fields of an event or occurrence the event lists return"""
+    return {
+        'id': event.get('id'),
+        'summary': event.get('summary', 'No Title'),
+        'description': event.get('description', ''),
+        'location': event.get('location', ''),
+        'start': event.get('start', {}),
+        'end': event.get('end', {}),
+        'attendees': event.get('attendees', []),
+        'colorId': event.get('colorId'),
+        'reminders': event.get('reminders', {}),
+        'recurrence': event.get('recurrence', []),
+        'created': event.get('created'),
+        'updated': event.get('updated'),
+        'creator': event.get('creator', {}),
+        'organizer': event.get('organizer', {}),
+        'status': event.get('status', 'confirmed'),
+        'client_id': event_index.client_id_of(event)
+    }
+
+
+def _fetch_events(credentials_dict: dict, calendar_id: str,
+                  time_min: Optional[datetime], time_max: Optional[datetime],
+                  limit: int) -> List[dict]:
+    """Events and occurrences of one calendar overlapping the window.
+
+    Blocking; each call builds its own service, since httplib2 connections
+    can't be shared between threads.
+    """
+    service = get_calendar_service(credentials_dict)
+    if CALENDAR_EXPANSION == "local":
+        cache = event_cache.for_credentials(credentials_dict, calendar_id)
+        cache.refresh(service, calendar_id)
+        return cache.window(time_min, time_max, limit)
+
+    events, page_token = [], None
+    while len(events) < limit:
+        events_result = service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min.isoformat() if time_min else None,
+            timeMax=time_max.isoformat() if time_max else None,
+            maxResults=min(limit - len(events), 2500),
+            singleEvents=True,
+            orderBy='startTime',
+            pageToken=page_token).execute()
+        events.extend(events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
+    return events
+
+
+def _view_fingerprint(calendars: List[tuple], time_min: Optional[str],
+                      time_max: Optional[str]) -> str:
+    """Ties a page token to the calendars and window it was issued for"""
+    view = json.dumps([calendars, time_min, time_max])
+    return hashlib.sha256(view.encode()).hexdigest()[:16]
+
+
+def _encode_page_token(position: tuple, fingerprint: str) -> str:
+    start, calendar, event_id = position
+    token = json.dumps({
+        "s": start.isoformat(),
+        "c": calendar,
+        "i": event_id,
+        "v": fingerprint
+    })
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip("=")
+
+
+def _decode_page_token(page_token: str, fingerprint: str) -> tuple:
+    try:
+        padded = page_token + "=" * (-len(page_token) % 4)
+        token = json.loads(base64.urlsafe_b64decode(padded))
+        if token["v"] != fingerprint:
+            raise ValueError("page token was issued for another view")
+        return (datetime.fromisoformat(token["s"]), int(token["c"]),
+                str(token["i"]))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid page_token")
 
 
 def get_calendar_service(credentials_dict: dict):
     """Create Google Calendar service from credentials"""
     try:
+        from google.oauth2.credentials import Credentials
         credentials = Credentials.from_authorized_user_info(
             credentials_dict, SCOPES)
-        return build('calendar', 'v3', credentials=credentials)
+        return _build_service(credentials)
     except Exception as e:
-        logger.error(f"Error creating calendar service: {str(e)}")
+        logger.error("Error creating calendar service: %s", e)
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
 
 @router.get("/test")
 async def test_endpoint():
-    """Test endpoint to verify API is working"""
+    """Test endpoint to verify API is working.
+
+    Kept for existing callers; Google reachability comes from the health
+    prober (see /api/health/ready).
+    """
     return {
         "status": "Calendar API is working",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "google": prober.status("google")
     }
 
 
@@ -97,7 +334,7 @@ async def test_endpoint():
 async def get_auth_url():
     """Get Google OAuth authorization URL"""
     try:
-        flow = Flow.from_client_config(CLIENT_CONFIG, SCOPES)
+        flow = _new_flow()
         flow.redirect_uri = REDIRECT_URI
 
         auth_url, state = flow.authorization_url(
@@ -106,11 +343,11 @@ async def get_auth_url():
             prompt='consent'  # Force consent screen to get refresh token
         )
 
-        logger.info(f"Generated auth URL with redirect URI: {REDIRECT_URI}")
-        logger.info(f"Auth URL: {auth_url}")
+        logger.info("Generated auth URL with redirect URI: %s", REDIRECT_URI)
+        logger.debug("Auth URL: %s", auth_url)
         return {"auth_url": auth_url, "state": state}
     except Exception as e:
-        logger.error(f"Error generating auth URL: {str(e)}")
+        logger.error("Error generating auth URL: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Failed to generate auth URL: {str(e)}")
 
@@ -119,11 +356,10 @@ async def get_auth_url():
 async def oauth2callback(code: str, state: Optional[str] = None):
     """Handle OAuth callback and return credentials"""
     try:
-        logger.info(f"OAuth callback - Code: {code[:20]}...")
-        logger.info(f"OAuth callback - State: {state}")
-        logger.info(f"Using redirect URI: {REDIRECT_URI}")
+        logger.info("OAuth callback - State: %s", state)
+        logger.info("Using redirect URI: %s", REDIRECT_URI)
 
-        flow = Flow.from_client_config(CLIENT_CONFIG, SCOPES)
+        flow = _new_flow()
         flow.redirect_uri = REDIRECT_URI
 
         # Exchange the authorization code for credentials
@@ -134,14 +370,13 @@ async def oauth2callback(code: str, state: Optional[str] = None):
 
         # Test the credentials by making a simple API call
         try:
-            service = build('calendar', 'v3', credentials=credentials)
+            service = _build_service(credentials)
             # Test with a simple calendar list call
             calendar_list = service.calendarList().list().execute()
-            logger.info(
-                f"Credentials test successful - found {len(calendar_list.get('items', []))} calendars"
-            )
+            logger.info("Credentials test successful - found %s calendars",
+                        len(calendar_list.get('items', [])))
         except Exception as test_error:
-            logger.warning(f"Credential test failed: {str(test_error)}")
+            logger.warning("Credential test failed: %s", test_error)
 
         return {
             "token":
@@ -161,7 +396,7 @@ async def oauth2callback(code: str, state: Optional[str] = None):
         }
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"OAuth callback error: {error_msg}")
+        logger.error("OAuth callback error: %s", error_msg)
 
         # Provide specific error messages for common issues
         if "invalid_grant" in error_msg:
@@ -188,10 +423,9 @@ async def oauth2callback_post(request: Request):
             raise HTTPException(status_code=400,
                                 detail="Authorization code is required")
 
-        logger.info(f"OAuth POST callback - Code: {code[:20]}...")
-        logger.info(f"OAuth POST callback - State: {state}")
+        logger.info("OAuth POST callback - State: %s", state)
 
-        flow = Flow.from_client_config(CLIENT_CONFIG, SCOPES)
+        flow = _new_flow()
         flow.redirect_uri = REDIRECT_URI
 
         flow.fetch_token(code=code)
@@ -217,7 +451,7 @@ async def oauth2callback_post(request: Request):
         }
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"OAuth POST callback error: {error_msg}")
+        logger.error("OAuth POST callback error: %s", error_msg)
 
         if "invalid_grant" in error_msg:
             detail = "The authorization code has expired or been used already. Please try authenticating again."
@@ -236,7 +470,7 @@ async def refresh_auth():
     """Get a fresh auth URL when the previous one fails"""
     try:
         # Clear any cached flow state and get a fresh auth URL
-        flow = Flow.from_client_config(CLIENT_CONFIG, SCOPES)
+        flow = _new_flow()
         flow.redirect_uri = REDIRECT_URI
 
         # Add timestamp to prevent caching issues
@@ -247,14 +481,15 @@ async def refresh_auth():
             prompt='consent',
             state=f"refresh_{int(time.time())}")
 
-        logger.info(f"Generated fresh auth URL: {auth_url}")
+        logger.info("Generated fresh auth URL")
+        logger.debug("Auth URL: %s", auth_url)
         return {
             "auth_url": auth_url,
             "state": state,
             "message": "Fresh authentication URL generated"
         }
     except Exception as e:
-        logger.error(f"Error generating fresh auth URL: {str(e)}")
+        logger.error("Error generating fresh auth URL: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to generate fresh auth URL: {str(e)}")
@@ -265,64 +500,161 @@ async def list_events(credentials: CalendarCredentials,
                       time_min: Optional[str] = None,
                       time_max: Optional[str] = None,
                       max_results: int = 100):
-    """List calendar events"""
+    """List calendar events, recurring ones expanded into occurrences"""
     try:
         credentials_dict = credentials.dict()
-        service = get_calendar_service(credentials_dict)
 
         # Format time parameters
         if time_min:
-            time_min = datetime.fromisoformat(time_min.replace(
-                'Z', '+00:00')).isoformat()
+            time_min = _aware(
+                datetime.fromisoformat(time_min.replace('Z', '+00:00')))
         if time_max:
-            time_max = datetime.fromisoformat(time_max.replace(
-                'Z', '+00:00')).isoformat()
+            time_max = _aware(
+                datetime.fromisoformat(time_max.replace('Z', '+00:00')))
 
-        events_result = service.events().list(calendarId='primary',
-                                              timeMin=time_min,
-                                              timeMax=time_max,
-                                              maxResults=max_results,
-                                              singleEvents=True,
-                                              orderBy='startTime').execute()
-
-        events = events_result.get('items', [])
+        events = _fetch_events(credentials_dict, 'primary', time_min,
+                               time_max, max_results)
 
         # Process events to ensure consistent format
-        processed_events = []
-        for event in events:
-            processed_event = {
-                'id': event.get('id'),
-                'summary': event.get('summary', 'No Title'),
-                'description': event.get('description', ''),
-                'location': event.get('location', ''),
-                'start': event.get('start', {}),
-                'end': event.get('end', {}),
-                'attendees': event.get('attendees', []),
-                'colorId': event.get('colorId'),
-                'reminders': event.get('reminders', {}),
-                'recurrence': event.get('recurrence', []),
-                'created': event.get('created'),
-                'updated': event.get('updated'),
-                'creator': event.get('creator', {}),
-                'organizer': event.get('organizer', {}),
-                'status': event.get('status', 'confirmed')
-            }
-            processed_events.append(processed_event)
+        processed_events = [_processed_event(event) for event in events]
 
-        return {"events": processed_events}
+        return FastJSONResponse({"events": processed_events})
     except HttpError as e:
-        logger.error(f"Google API error: {str(e)}")
+        logger.error("Google API error: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Google Calendar API error: {str(e)}")
     except Exception as e:
-        logger.error(f"Error listing events: {str(e)}")
+        logger.error("Error listing events: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Failed to fetch events: {str(e)}")
+
+
+@router.post("/events/aggregate")
+async def list_aggregated_events(request: AggregatedEventsRequest,
+                                 time_min: Optional[str] = None,
+                                 time_max: Optional[str] = None,
+                                 page_size: int = Query(100, ge=1, le=2500),
+                                 page_token: Optional[str] = None):
+    """Events of several calendars, across accounts, merged by start time.
+
+    The calendars are fetched concurrently, CALENDAR_FETCH_CONCURRENCY at a
+    time. Pages are cut from the merged order: pass `next_page_token` back,
+    with the same body and window, for the next one. A calendar that fails
+    is reported under `errors` instead of failing the whole view.
+    """
+    try:
+        calendars = [(source_index, source.credentials.dict(), calendar_id)
+                     for source_index, source in enumerate(request.sources)
+                     for calendar_id in dict.fromkeys(source.calendar_ids)]
+        if not calendars:
+            raise HTTPException(status_code=400,
+                                detail="At least one calendar is required")
+        if len(calendars) > MAX_AGGREGATED_CALENDARS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {MAX_AGGREGATED_CALENDARS} calendars can "
+                "be aggregated")
+
+        window_start = window_end = None
+        if time_min:
+            window_start = _aware(
+                datetime.fromisoformat(time_min.replace('Z', '+00:00')))
+        if time_max:
+            window_end = _aware(
+                datetime.fromisoformat(time_max.replace('Z', '+00:00')))
+
+        fingerprint = _view_fingerprint([(s, c) for s, _, c in calendars],
+                                        time_min, time_max)
+        position = (_decode_page_token(page_token, fingerprint)
+                    if page_token else None)
+        fetch_from = window_start
+        if position and (fetch_from is None or position[0] > fetch_from):
+            fetch_from = position[0]
+
+        slots = asyncio.Semaphore(CALENDAR_FETCH_CONCURRENCY)
+
+        async def fetch(index: int, credentials_dict: dict,
+                        calendar_id: str) -> List[tuple]:
+            """(merge key, event) pairs of one calendar after `position`"""
+            limit = page_size + 1
+            async with slots:
+                while True:
+                    events = await asyncio.to_thread(_fetch_events,
+                                                     credentials_dict,
+                                                     calendar_id, fetch_from,
+                                                     window_end, limit)
+                    keyed = sorted(
+                        (((recurrence.sort_key(event), index,
+                           event.get('id') or ''), event) for event in events),
+                        key=lambda pair: pair[0])
+                    if position:
+                        keyed = [pair for pair in keyed if pair[0] > position]
+                    # Events started before the position but still running
+                    # take up room; ask for more if they crowded the page out
+                    if len(keyed) > page_size or len(events) < limit:
+                        return keyed
+                    limit *= 4
+
+        results = await asyncio.gather(*(fetch(index, credentials_dict,
+                                               calendar_id)
+                                         for index, (_, credentials_dict,
+                                                     calendar_id)
+                                         in enumerate(calendars)),
+                                       return_exceptions=True)
+
+        streams, errors = [], []
+        for (source_index, _, calendar_id), result in zip(calendars, results):
+            if isinstance(result, Exception):
+                logger.error("Error fetching calendar %s of source %s: %s",
+                             calendar_id, source_index, result)
+                errors.append({
+                    "source": source_index,
+                    "calendar_id": calendar_id,
+                    "detail": getattr(result, "detail", None) or str(result)
+                })
+            else:
+                streams.append(result)
+        if not streams:
+            first_error = next(r for r in results if isinstance(r, Exception))
+            raise first_error
+
+        merged = list(
+            itertools.islice(heapq.merge(*streams, key=lambda pair: pair[0]),
+                             page_size + 1))
+        events = []
+        for (_, index, _), event in merged[:page_size]:
+            source_index, _, calendar_id = calendars[index]
+            events.append({
+                **_processed_event(event), 'calendar_id': calendar_id,
+                'source': source_index
+            })
+        next_page_token = None
+        if len(merged) > page_size:
+            next_page_token = _encode_page_token(merged[page_size - 1][0],
+                                                 fingerprint)
+
+        return FastJSONResponse({
+            "events": events,
+            "next_page_token": next_page_token,
+            "errors": errors
+        })
+    except HTTPException:
+        raise
+    except HttpError as e:
+        logger.error("Google API error: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Google Calendar API error: {str(e)}")
+    except Exception as e:
+        logger.error("Error listing aggregated events: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Failed to fetch events: {str(e)}")
 
 
 @router.post("/events/create")
-async def create_event(event: EventCreate, credentials: CalendarCredentials):
-    """Create a new calendar event"""
+async def create_event(event: EventCreate,
+                       credentials: CalendarCredentials,
+                       authorization: Optional[str] = Header(None)):
+    """Create a new calendar event, with optional SMS reminders"""
     try:
         credentials_dict = credentials.dict()
         service = get_calendar_service(credentials_dict)
@@ -374,25 +706,44 @@ async def create_event(event: EventCreate, credentials: CalendarCredentials):
         if event.recurrence:
             event_body['recurrence'] = event.recurrence
 
+        # Link to the client; the event is then listed under the client
+        if event.client_id:
+            event_index.link_properties(event_body, event.client_id)
+
         created_event = service.events().insert(calendarId='primary',
                                                 body=event_body,
                                                 sendUpdates='all').execute()
+        event_cache.invalidate(credentials_dict)
+
+        if event.client_id:
+            _index_event(service, created_event)
+
+        if event.client_id and event.sms_reminders:
+            created_event["scheduled_reminders"] = _schedule_sms_reminders(
+                created_event["id"], event, authorization)
 
         return created_event
     except HttpError as e:
-        logger.error(f"Google API error creating event: {str(e)}")
+        logger.error("Google API error creating event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Google Calendar API error: {str(e)}")
     except Exception as e:
-        logger.error(f"Error creating event: {str(e)}")
+        logger.error("Error creating event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Failed to create event: {str(e)}")
 
 
 @router.put("/events/{event_id}")
-async def update_event(event_id: str, event: EventUpdate,
-                       credentials: CalendarCredentials):
-    """Update an existing calendar event"""
+async def update_event(event_id: str,
+                       event: EventUpdate,
+                       credentials: CalendarCredentials,
+                       authorization: Optional[str] = Header(None)):
+    """Update an existing calendar event.
+
+    Sending `sms_reminders` replaces the event's pending SMS reminders;
+    otherwise they move along with the start time. The client link is kept
+    unless `client_id` is sent; an empty string unlinks the event.
+    """
     try:
         credentials_dict = credentials.dict()
         service = get_calendar_service(credentials_dict)
@@ -448,18 +799,54 @@ async def update_event(event_id: str, event: EventUpdate,
         if event.recurrence:
             event_body['recurrence'] = event.recurrence
 
+        # The update replaces the whole event, so carry the existing
+        # extended properties (and with them the client link) over
+        if existing_event.get('extendedProperties'):
+            event_body['extendedProperties'] = existing_event[
+                'extendedProperties']
+        if event.client_id is not None:
+            event_index.link_properties(event_body, event.client_id)
+        else:
+            # Reminders below go to the client the event is linked to
+            event.client_id = event_index.client_id_of(existing_event)
+
         updated_event = service.events().update(calendarId='primary',
                                                 eventId=event_id,
                                                 body=event_body,
                                                 sendUpdates='all').execute()
+        event_cache.invalidate(credentials_dict)
+
+        _index_event(service, updated_event)
+
+        try:
+            if event.sms_reminders is not None:
+                scheduler.cancel({"event_id": event_id})
+                updated_event["scheduled_reminders"] = (
+                    _schedule_sms_reminders(event_id, event, authorization))
+            else:
+                old_start = _google_start(existing_event)
+                new_start = _event_start(event)
+                if old_start and old_start != new_start:
+                    # Default texts mention the time, so they move too
+                    scheduler.move_event_reminders(
+                        event_id, new_start - old_start, {
+                            _reminder_text(existing_event.get("summary"),
+                                           old_start,
+                                           existing_event.get("location")):
+                            _reminder_text(event.summary, new_start,
+                                           event.location)
+                        })
+        except Exception as e:
+            logger.error("Failed to update SMS reminders for event %s: %s",
+                         event_id, e)
 
         return updated_event
     except HttpError as e:
-        logger.error(f"Google API error updating event: {str(e)}")
+        logger.error("Google API error updating event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Google Calendar API error: {str(e)}")
     except Exception as e:
-        logger.error(f"Error updating event: {str(e)}")
+        logger.error("Error updating event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Failed to update event: {str(e)}")
 
@@ -474,18 +861,213 @@ async def delete_event(event_id: str, credentials: CalendarCredentials):
         service.events().delete(calendarId='primary',
                                 eventId=event_id,
                                 sendUpdates='all').execute()
+        event_cache.invalidate(credentials_dict)
+
+        try:
+            scheduler.cancel({"event_id": event_id})
+            event_index.remove([event_id])
+        except Exception as e:
+            logger.error("Failed to clean up after deleting event %s: %s",
+                         event_id, e)
 
         return {"message": "Event deleted successfully"}
     except HttpError as e:
-        logger.error(f"Google API error deleting event: {str(e)}")
+        logger.error("Google API error deleting event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Google Calendar API error: {str(e)}")
     except Exception as e:
-        logger.error(f"Error deleting event: {str(e)}")
+        logger.error("Error deleting event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Failed to delete event: {str(e)}")
 
 
+@router.put("/events/{event_id}/client")
+async def link_event_to_client(event_id: str, link: EventClientLink,
+                               credentials: CalendarCredentials):
+    """Link an existing event to a client, or unlink it"""
+    try:
+        credentials_dict = credentials.dict()
+        service = get_calendar_service(credentials_dict)
+
+        existing_event = service.events().get(calendarId='primary',
+                                              eventId=event_id).execute()
+        event_index.link_properties(existing_event, link.client_id)
+        updated_event = service.events().update(calendarId='primary',
+                                                eventId=event_id,
+                                                body=existing_event).execute()
+        event_cache.invalidate(credentials_dict)
+
+        _index_event(service, updated_event)
+        return updated_event
+    except HttpError as e:
+        logger.error("Google API error linking event: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Google Calendar API error: {str(e)}")
+    except Exception as e:
+        logger.error("Error linking event: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Failed to link event: {str(e)}")
+
+
+@router.post("/sync")
+async def sync_calendar(credentials: CalendarCredentials):
+    """Bring the client event index up to date with the primary calendar.
+
+    Incremental after the first call: only events changed since the last
+    sync are fetched.
+    """
+    try:
+        service = get_calendar_service(credentials.dict())
+        return event_index.sync(service)
+    except HttpError as e:
+        logger.error("Google API error syncing calendar: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Google Calendar API error: {str(e)}")
+    except Exception as e:
+        logger.error("Error syncing calendar: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Failed to sync calendar: {str(e)}")
+
+
+def _watch_response(row: dict) -> dict:
+    return {
+        "id": row["id"],
+        "calendar_id": row["calendar_id"],
+        "expiration": row["expiration"],
+        "stream_url": (f"/api/calendar/watch/{row['id']}/stream"
+                       f"?token={row['stream_token']}")
+    }
+
+
+@router.post("/watch")
+async def watch_calendar(watch: CalendarWatch):
+    """Have Google push this calendar's changes instead of polling it.
+
+    Idempotent per account and calendar. Changes are streamed to
+    `stream_url` as server-sent events; the channel is renewed before it
+    expires until it is deleted.
+    """
+    if not calendar_push.enabled():
+        raise HTTPException(status_code=503,
+                            detail="Calendar push notifications are not "
+                            "configured (CALENDAR_WEBHOOK_URL, "
+                            "CALENDAR_CREDENTIALS_KEY)")
+    try:
+        row = await asyncio.to_thread(calendar_push.hub.open_channel,
+                                      watch.credentials.dict(),
+                                      watch.calendar_id)
+        return _watch_response(row)
+    except HTTPException:
+        raise
+    except HttpError as e:
+        logger.error("Google API error watching calendar: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Google Calendar API error: {str(e)}")
+    except Exception as e:
+        logger.error("Error watching calendar: %s", e)
+        raise HTTPException(status_code=500,
+                            detail=f"Failed to watch calendar: {str(e)}")
+
+
+@router.delete("/watch/{watch_id}")
+async def unwatch_calendar(watch_id: str, credentials: CalendarCredentials):
+    """Stop push notifications for a calendar"""
+    try:
+        row = await asyncio.to_thread(calendar_push.hub.store.get, watch_id)
+        if row is None or row["status"] == "stopped":
+            raise HTTPException(status_code=404, detail="Watch not found")
+        if not hmac.compare_digest(
+                event_cache.cache_key(credentials.dict(), row["calendar_id"]),
+                row["cache_key"]):
+            raise HTTPException(status_code=403,
+                                detail="Credentials do not match the watch")
+        await asyncio.to_thread(calendar_push.hub.close_channel, row)
+        return {"message": "Watch stopped successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error stopping watch %s: %s", watch_id, e)
+        raise HTTPException(status_code=500,
+                            detail=f"Failed to stop watch: {str(e)}")
+
+
+@router.get("/watch/{watch_id}/stream")
+async def stream_calendar_changes(watch_id: str, token: str,
+                                  request: Request):
+    """Server-sent `change` events for a watched calendar.
+
+    Each carries the new `seq` and the ids of the changed and removed
+    events (`full` when too many changed to list); a client refetches its
+    view, which is served from the refreshed cache.
+    """
+    try:
+        row = await asyncio.to_thread(calendar_push.hub.store.get, watch_id)
+    except Exception as e:
+        logger.error("Error loading watch %s: %s", watch_id, e)
+        raise HTTPException(status_code=500,
+                            detail=f"Failed to load watch: {str(e)}")
+    if (row is None or row["status"] == "stopped"
+            or not hmac.compare_digest(token, row["stream_token"])):
+        raise HTTPException(status_code=404, detail="Watch not found")
+
+    async def changes():
+        queue = calendar_push.hub.subscribe(watch_id)
+        try:
+            yield (f"retry: 5000\nevent: ready\n"
+                   f"data: {json.dumps({'seq': row['change_seq']})}\n\n")
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(),
+                                                     STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield (f"id: {message['seq']}\nevent: change\n"
+                       f"data: {json.dumps(message)}\n\n")
+        finally:
+            calendar_push.hub.unsubscribe(watch_id, queue)
+
+    return StreamingResponse(changes(),
+                             media_type="text/event-stream",
+                             headers={
+                                 "Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"
+                             })
+
+
+@router.post("/webhook")
+async def calendar_webhook(request: Request):
+    """Receive Google Calendar change notifications (events.watch)"""
+    channel_id = request.headers.get("x-goog-channel-id")
+    state = request.headers.get("x-goog-resource-state")
+    if not channel_id:
+        raise HTTPException(status_code=400,
+                            detail="Missing X-Goog-Channel-ID header")
+    try:
+        row = await asyncio.to_thread(calendar_push.hub.store.by_channel,
+                                      channel_id)
+    except Exception as e:
+        logger.error("Error loading calendar channel %s: %s", channel_id, e)
+        # Google retries failed deliveries with backoff
+        raise HTTPException(status_code=500,
+                            detail=f"Failed to load channel: {str(e)}")
+    if row is None or row["status"] == "stopped":
+        # Replaced by a renewal or stopped; the live channel reports changes
+        logger.info("Ignoring notification for retired channel %s",
+                    channel_id)
+        return {"status": "ignored"}
+    if not hmac.compare_digest(
+            request.headers.get("x-goog-channel-token", ""), row["token"]):
+        raise HTTPException(status_code=403, detail="Invalid channel token")
+
+    logger.info("Calendar notification %s on channel %s: %s",
+                request.headers.get("x-goog-message-number"), row["id"], state)
+    # "sync" only confirms a new channel; anything else is a change
+    if state != "sync":
+        calendar_push.hub.notify(row)
+    return {"status": "ok"}
+
+
 @router.post("/colors")
 async def get_calendar_colors(credentials: CalendarCredentials):
     """Get available calendar colors"""
@@ -496,11 +1078,11 @@ async def get_calendar_colors(credentials: CalendarCredentials):
         colors = service.colors().get().execute()
         return colors
     except HttpError as e:
-        logger.error(f"Google API error getting colors: {str(e)}")
+        logger.error("Google API error getting colors: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Google Calendar API error: {str(e)}")
     except Exception as e:
-        logger.error(f"Error getting colors: {str(e)}")
+        logger.error("Error getting colors: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Failed to get colors: {str(e)}")
 
@@ -517,10 +1099,10 @@ async def get_event(event_id: str, credentials_json: str):
 
         return event
     except HttpError as e:
-        logger.error(f"Google API error getting event: {str(e)}")
+        logger.error("Google API error getting event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Google Calendar API error: {str(e)}")
     except Exception as e:
-        logger.error(f"Error getting event: {str(e)}")
+        logger.error("Error getting event: %s", e)
         raise HTTPException(status_code=500,
                             detail=f"Failed to get event: {str(e)}")
@@ -1,17 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel, ConfigDict
-from typing import List, Optional, Union, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import List, Optional, Union, Dict, Any, Literal
 from datetime import datetime
 from database import get_db, supabase
+from client_index import UDF_INDEX_MODE, ensure_loaded, udf_index
+from document_cleanup import schedule_cleanup, schedule_many
+from storage import document_prefix
+from responses import FastJSONResponse, conditional_response, parse_timestamp
+import event_index
 import logging
+import re
 
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Query parameters of the form udf.<field>=<value> filter on
+# user_defined_fields
+UDF_PARAM_PREFIX = "udf."
+UDF_FIELD_PATTERN = re.compile(r"^[A-Za-z0-9_ -]{1,64}$")
+# Ids per `in.(...)` filter, keeping request URLs well under proxy limits
+ID_CHUNK_SIZE = 200
+# Most rows a single bulk request may touch
+BULK_MAX_ROWS = 5000
+# Per-client JSON columns; a bulk update would replace them wholesale
+BULK_EXCLUDED_FIELDS = {"user_defined_fields", "client_documents"}
+
 
 class ClientBase(BaseModel):
     # Allow extra fields to be included in the model
@@ -58,7 +72,9 @@ class ClientBase(BaseModel):
     record_manager: Optional[str] = None
     created_by: Optional[str] = None
     user_defined_fields: Optional[Dict[str, str]] = {}
-    client_documents: Optional[Dict[str, str]] = {}
+    # Manifest of uploaded documents keyed by document id; the files live in
+    # the client-documents bucket (see routers/documents.py)
+    client_documents: Optional[Dict[str, Any]] = {}
 
 
 class ClientCreate(ClientBase):
@@ -71,6 +87,76 @@ class ClientUpdate(ClientBase):
     last_name: Optional[str] = None
 
 
+# Columns the generic query endpoint may filter, sort and group on
+QUERY_FIELDS = {
+    name
+    for name in ClientBase.model_fields
+    if name not in ("user_defined_fields", "client_documents")
+} | {"id", "created_at", "updated_at"}
+# Columns that may be returned by a projection
+PROJECTION_FIELDS = QUERY_FIELDS | {"user_defined_fields", "client_documents"}
+# Columns min/max may be computed over
+RANGE_FIELDS = {
+    "case_date", "date_of_injury", "birth_date", "created_at", "updated_at"
+}
+
+
+class QueryFilter(BaseModel):
+    field: str
+    op: Literal["eq", "neq", "gt", "gte", "lt", "lte", "in", "like", "ilike",
+                "is"]
+    value: Union[str, int, float, bool, None, List[Union[str, int,
+                                                         float]]] = None
+
+
+class QuerySort(BaseModel):
+    field: str
+    direction: Literal["asc", "desc"] = "asc"
+
+
+class QueryAggregate(BaseModel):
+    group_by: List[str] = []
+    count: bool = True
+    min: List[str] = []
+    max: List[str] = []
+
+
+class ClientQuery(BaseModel):
+    filters: List[QueryFilter] = []
+    sort: List[QuerySort] = []
+    fields: Optional[List[str]] = None
+    limit: int = Field(100, ge=1, le=1000)
+    offset: int = Field(0, ge=0)
+    include_total: bool = False
+    aggregate: Optional[QueryAggregate] = None
+
+
+class ClientBulkSelector(BaseModel):
+    """Rows targeted by a bulk operation: explicit ids or a filter"""
+    ids: Optional[List[Union[str, int]]] = None
+    filters: Optional[List[QueryFilter]] = None
+
+
+class ClientBulkChanges(ClientUpdate):
+    """Changes a bulk update may apply: any column but the JSON ones"""
+
+    @model_validator(mode="after")
+    def _check_excluded(self):
+        excluded = BULK_EXCLUDED_FIELDS & self.model_fields_set
+        if excluded:
+            raise ValueError(
+                f"{', '.join(sorted(excluded))} can't be changed in bulk")
+        return self
+
+
+class ClientBulkUpdate(ClientBulkSelector):
+    changes: ClientBulkChanges
+
+
+class ClientBulkDelete(ClientBulkSelector):
+    pass
+
+
 def process_date_fields(client_data: Dict[str, Any]) -> Dict[str, Any]:
     """Process date fields to ensure they are in ISO format"""
     date_fields = ["birth_date", "case_date", "date_of_injury"]
@@ -102,17 +188,14 @@ def process_date_fields(client_data: Dict[str, Any]) -> Dict[str, Any]:
                     if parsed_date:
                         client_data[field] = parsed_date.date().isoformat()
                     else:
-                        logger.error(
-                            f"Invalid date format for {field}: {client_data[field]}"
-                        )
+                        logger.error("Invalid date format for %s", field)
                         raise HTTPException(
                             status_code=status.HTTP_400_BAD_REQUEST,
                             detail=
                             f"Invalid date format for {field}. Expected formats: YYYY-MM-DD, MM/DD/YYYY, DD/MM/YYYY"
                         )
             except ValueError as ve:
-                logger.error(
-                    f"Invalid date format for {field}: {client_data[field]}")
+                logger.error("Invalid date format for %s", field)
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=
@@ -122,15 +205,63 @@ def process_date_fields(client_data: Dict[str, Any]) -> Dict[str, Any]:
     return client_data
 
 
-@router.get("", response_model=List[dict])
-async def get_clients():
+def parse_udf_filters(request: Request) -> Dict[str, str]:
+    """Collect udf.<field>=<value> query parameters into a filter dict"""
+    filters = {}
+    for key, value in request.query_params.items():
+        if not key.startswith(UDF_PARAM_PREFIX):
+            continue
+        field = key[len(UDF_PARAM_PREFIX):]
+        if not UDF_FIELD_PATTERN.match(field):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Invalid user-defined field: {field}")
+        filters[field] = value
+    return filters
+
+
+def _fetch_clients_by_ids(client_ids) -> List[dict]:
+    ids = sorted(client_ids, key=lambda x: (len(x), x))
+    rows = []
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        rows.extend(
+            supabase.table("clients").select("*").in_(
+                "id", ids[start:start + ID_CHUNK_SIZE]).execute().data)
+    return rows
+
+
+@router.get("")
+async def get_clients(request: Request):
+    """List clients, optionally filtered by user-defined fields.
+
+    `?udf.insurer=Acme&udf.adjuster=Smith` returns clients whose
+    user_defined_fields contain all of the given pairs. The filter is sent
+    to PostgREST as a JSONB containment (`cs`) test, which the GIN index in
+    migrations/001 serves; with CLIENT_UDF_INDEX=local it is resolved
+    through the in-process inverted index instead.
+    """
     try:
-        logger.info("Fetching all clients")
-        response = supabase.table("clients").select("*").execute()
-        logger.info(f"Successfully retrieved {len(response.data)} clients")
-        return response.data
+        udf_filters = parse_udf_filters(request)
+        if not udf_filters:
+            logger.info("Fetching all clients")
+            response = supabase.table("clients").select("*").execute()
+            logger.info("Successfully retrieved %s clients",
+                        len(response.data))
+            return FastJSONResponse(response.data)
+
+        logger.info("Fetching clients by user-defined fields %s",
+                    sorted(udf_filters))
+        if UDF_INDEX_MODE == "local":
+            client_ids = ensure_loaded().lookup(udf_filters)
+            return FastJSONResponse(
+                _fetch_clients_by_ids(client_ids) if client_ids else [])
+
+        response = supabase.table("clients").select("*").contains(
+            "user_defined_fields", udf_filters).execute()
+        return FastJSONResponse(response.data)
+    except HTTPException as he:
+        raise he
     except Exception as e:
-        logger.error(f"Failed to fetch clients: {str(e)}")
+        logger.error("Failed to fetch clients: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to fetch clients: {str(e)}")
 
@@ -138,8 +269,7 @@ async def get_clients():
 @router.post("", status_code=status.HTTP_201_CREATED)
 async def create_client(client: ClientCreate):
     try:
-        logger.info(
-            f"Creating new client: {client.first_name} {client.last_name}")
+        logger.info("Creating new client")
 
         # Validate required fields
         if not client.first_name or not client.last_name:
@@ -165,47 +295,219 @@ async def create_client(client: ClientCreate):
 
         response = supabase.table("clients").insert(client_data).execute()
         new_client = response.data[0]
-        logger.info(f"Successfully created client with ID: {new_client['id']}")
+        udf_index.upsert(new_client["id"],
+                         new_client.get("user_defined_fields"))
+        logger.info("Successfully created client with ID: %s",
+                    new_client['id'])
         return new_client
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Failed to create client: {str(e)}")
+        logger.error("Failed to create client: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to create client: {str(e)}")
 
 
-@router.get("/{client_id}", response_model=dict)
-async def get_client(client_id: Union[str, int]):
+def _check_bulk_selector(selector: ClientBulkSelector) -> None:
+    if bool(selector.ids) == bool(selector.filters):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide either a non-empty 'ids' list or 'filters'")
+    if selector.ids and len(selector.ids) > BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BULK_MAX_ROWS} ids per bulk request")
+    if selector.filters:
+        _check_fields([f.field for f in selector.filters], QUERY_FIELDS,
+                      "filter")
+
+
+def _id_chunks(ids: List[Union[str, int]]):
+    ids = [str(i) for i in dict.fromkeys(ids)]
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+@router.patch("/bulk")
+async def bulk_update_clients(bulk: ClientBulkUpdate):
+    """Apply the same changes to many clients in set-based updates.
+
+    Targets either `ids` (one UPDATE per 200 ids) or `filters` (a single
+    UPDATE, refused if it matches more than BULK_MAX_ROWS clients), e.g.
+    reassigning record_manager for a departing attorney.
+    """
+    try:
+        _check_bulk_selector(bulk)
+
+        changes = bulk.changes.model_dump(exclude_unset=True)
+        changes = process_date_fields(changes)
+        changes = {k: v for k, v in changes.items() if v is not None}
+        if not changes:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="No changes provided")
+        changes["updated_at"] = datetime.utcnow().isoformat()
+
+        logger.info("Bulk updating fields %s", sorted(changes))
+        updated = 0
+        if bulk.ids:
+            for chunk in _id_chunks(bulk.ids):
+                response = supabase.table("clients").update(
+                    changes, count="exact",
+                    returning="minimal").in_("id", chunk).execute()
+                updated += response.count or 0
+        else:
+            matching = apply_query_filters(
+                supabase.table("clients").select("id",
+                                                 count="exact",
+                                                 head=True),
+                bulk.filters).execute().count or 0
+            if matching > BULK_MAX_ROWS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Filter matches more than {BULK_MAX_ROWS} "
+                    "clients; narrow it down")
+            query = supabase.table("clients").update(changes,
+                                                     count="exact",
+                                                     returning="minimal")
+            response = apply_query_filters(query, bulk.filters).execute()
+            updated = response.count or 0
+
+        logger.info("Bulk updated %s clients", updated)
+        return {"updated": updated}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to bulk update clients: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to bulk update clients: {str(e)}")
+
+
+@router.delete("/bulk")
+async def bulk_delete_clients(bulk: ClientBulkDelete):
+    """Delete many clients and queue their document cleanup.
+
+    The matching ids are resolved in one SELECT, then deleted 200 per
+    statement; clients with documents get a background cleanup job, at
+    most a few of which run at a time.
+    """
     try:
-        logger.info(f"Fetching client with ID: {client_id}")
+        _check_bulk_selector(bulk)
+
+        if bulk.ids:
+            targets = []
+            for chunk in _id_chunks(bulk.ids):
+                targets.extend(
+                    supabase.table("clients").select(
+                        "id, client_documents").in_("id",
+                                                     chunk).execute().data)
+        else:
+            query = supabase.table("clients").select("id, client_documents")
+            targets = apply_query_filters(query, bulk.filters).limit(
+                BULK_MAX_ROWS + 1).execute().data
+            if len(targets) > BULK_MAX_ROWS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Filter matches more than {BULK_MAX_ROWS} "
+                    "clients; narrow it down")
+
+        deleted = 0
+        for chunk in _id_chunks([row["id"] for row in targets]):
+            response = supabase.table("clients").delete(
+                count="exact", returning="minimal").in_("id",
+                                                        chunk).execute()
+            deleted += response.count or 0
+
+        for row in targets:
+            udf_index.remove(row["id"])
+        jobs = schedule_many([
+            document_prefix(row["id"]) for row in targets
+            if row.get("client_documents")
+        ])
+
+        logger.info("Bulk deleted %s clients, queued %s document cleanups",
+                    deleted, len(jobs))
+        return {"deleted": deleted, "document_cleanups": len(jobs)}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to bulk delete clients: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to bulk delete clients: {str(e)}")
+
+
+@router.get("/{client_id}")
+async def get_client(client_id: Union[str, int], request: Request):
+    try:
+        logger.info("Fetching client with ID: %s", client_id)
         response = supabase.table("clients").select("*").eq(
             "id", client_id).execute()
         if not response.data:
-            logger.warning(f"Client with ID {client_id} not found")
+            logger.warning("Client with ID %s not found", client_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Client with ID {client_id} not found")
-        logger.info(f"Successfully retrieved client with ID: {client_id}")
-        return response.data[0]
+        logger.info("Successfully retrieved client with ID: %s", client_id)
+        client = response.data[0]
+        return conditional_response(request, client,
+                                    client.get("updated_at"))
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Failed to fetch client {client_id}: {str(e)}")
+        logger.error("Failed to fetch client %s: %s", client_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to fetch client: {str(e)}")
 
 
+@router.get("/{client_id}/events")
+async def get_client_events(client_id: str,
+                            request: Request,
+                            time_min: Optional[str] = None,
+                            time_max: Optional[str] = None,
+                            limit: int = Query(250, ge=1, le=2500)):
+    """Calendar events linked to a client, from the client event index.
+
+    Kept current by the calendar routes and POST /api/calendar/sync; no
+    Google call is made here.
+    """
+    try:
+        bounds = {}
+        for name, value in (("time_min", time_min), ("time_max", time_max)):
+            if value is not None:
+                parsed = parse_timestamp(value)
+                if parsed is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Invalid {name}: {value}")
+                bounds[name] = parsed.isoformat()
+
+        events = event_index.events_for_client(client_id, limit=limit,
+                                               **bounds)
+        logger.info("Found %s indexed events for client %s", len(events),
+                    client_id)
+        # ETag only: removing an event moves no timestamp
+        return conditional_response(request, {
+            "client_id": client_id,
+            "events": events
+        })
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to fetch events for client %s: %s", client_id,
+                     e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to fetch client events: {str(e)}")
+
+
 @router.put("/{client_id}")
 async def update_client(client_id: Union[str, int], client: ClientUpdate):
     try:
-        logger.info(f"Updating client with ID: {client_id}")
+        logger.info("Updating client with ID: %s", client_id)
 
         # First check if client exists
         check_response = supabase.table("clients").select("*").eq(
             "id", client_id).execute()
         if not check_response.data:
-            logger.warning(
-                f"Client with ID {client_id} not found during update")
+            logger.warning("Client with ID %s not found during update",
+                           client_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Client with ID {client_id} not found")
 
@@ -221,16 +523,20 @@ async def update_client(client_id: Union[str, int], client: ClientUpdate):
         # Remove None values to avoid overwriting existing data with None
         client_data = {k: v for k, v in client_data.items() if v is not None}
 
-        logger.info(f"Update data: {client_data}")
+        logger.debug("Updating fields %s for client %s", sorted(client_data),
+                     client_id)
 
         response = supabase.table("clients").update(client_data).eq(
             "id", client_id).execute()
-        logger.info(f"Successfully updated client with ID: {client_id}")
+        logger.info("Successfully updated client with ID: %s", client_id)
+        if "user_defined_fields" in client_data:
+            udf_index.upsert(client_id,
+                             response.data[0].get("user_defined_fields"))
         return response.data[0]
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Failed to update client {client_id}: {str(e)}")
+        logger.error("Failed to update client %s: %s", client_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to update client: {str(e)}")
 
@@ -238,40 +544,148 @@ async def update_client(client_id: Union[str, int], client: ClientUpdate):
 @router.delete("/{client_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_client(client_id: Union[str, int]):
     try:
-        logger.info(f"Attempting to delete client with ID: {client_id}")
+        logger.info("Attempting to delete client with ID: %s", client_id)
 
         # First check if client exists
-        check_response = supabase.table("clients").select("*").eq(
-            "id", client_id).execute()
+        check_response = supabase.table("clients").select(
+            "id, client_documents").eq("id", client_id).execute()
         if not check_response.data:
-            logger.warning(
-                f"Client with ID {client_id} not found during deletion")
+            logger.warning("Client with ID %s not found during deletion",
+                           client_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Client with ID {client_id} not found")
 
-        # Delete associated documents from storage
+        response = supabase.table("clients").delete().eq("id",
+                                                         client_id).execute()
+        logger.info("Successfully deleted client with ID: %s", client_id)
+        udf_index.remove(client_id)
+
+        # Remove associated documents from storage in the background; progress
+        # is reported by GET /api/clients/{client_id}/document-cleanup
         if check_response.data[0].get('client_documents'):
             try:
-                folder_name = f"client_{client_id}"
-                supabase.storage.from_('client-documents').remove(
-                    [folder_name])
-                logger.info(
-                    f"Deleted client documents for client ID: {client_id}")
+                schedule_cleanup(document_prefix(client_id))
             except Exception as e:
-                logger.warning(f"Failed to delete client documents: {str(e)}")
-
-        response = supabase.table("clients").delete().eq("id",
-                                                         client_id).execute()
-        logger.info(f"Successfully deleted client with ID: {client_id}")
+                logger.warning("Failed to schedule document cleanup: %s", e)
         return None
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Failed to delete client {client_id}: {str(e)}")
+        logger.error("Failed to delete client %s: %s", client_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to delete client: {str(e)}")
 
 
+def _check_fields(fields, allowed, kind: str) -> None:
+    invalid = sorted(set(fields) - allowed)
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid {kind} field(s): {', '.join(invalid)}")
+
+
+def _quote_in_value(value) -> str:
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def apply_query_filters(query, filters: List[QueryFilter]):
+    """Translate whitelisted filters into PostgREST query parameters"""
+    for item in filters:
+        if item.op == "in":
+            values = item.value if isinstance(item.value, list) else [
+                item.value
+            ]
+            query = query.filter(
+                item.field, "in",
+                "(" + ",".join(_quote_in_value(v) for v in values) + ")")
+        elif item.op == "is":
+            if item.value not in (None, True, False, "null", "true", "false"):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="'is' only accepts null, true or false")
+            value = "null" if item.value is None else str(item.value).lower()
+            query = query.is_(item.field, value)
+        else:
+            if isinstance(item.value, list) or item.value is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Operator '{item.op}' needs a single value")
+            value = str(item.value).lower() if isinstance(
+                item.value, bool) else str(item.value)
+            query = query.filter(item.field, item.op, value)
+    return query
+
+
+@router.post("/query")
+async def query_clients(spec: ClientQuery):
+    """Filter, sort, project or aggregate clients in a single PostgREST call.
+
+    Without `aggregate`, returns one page of rows. With it, groups the
+    filtered rows by `group_by` and returns per-group counts and min/max
+    of date columns, computed by PostgREST aggregate functions (enabled by
+    migrations/002) so only the groups cross the wire.
+    """
+    try:
+        _check_fields([f.field for f in spec.filters], QUERY_FIELDS,
+                      "filter")
+
+        if spec.aggregate is not None:
+            agg = spec.aggregate
+            _check_fields(agg.group_by, QUERY_FIELDS, "group_by")
+            _check_fields(agg.min + agg.max, RANGE_FIELDS, "min/max")
+            columns = list(agg.group_by)
+            if agg.count:
+                columns.append("count()")
+            columns += [f"min_{f}:{f}.min()" for f in agg.min]
+            columns += [f"max_{f}:{f}.max()" for f in agg.max]
+            if len(columns) == len(agg.group_by):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail="No aggregate requested")
+            outputs = set(agg.group_by) | {f"min_{f}" for f in agg.min} | {
+                f"max_{f}" for f in agg.max
+            } | ({"count"} if agg.count else set())
+            _check_fields([s.field for s in spec.sort], outputs, "sort")
+
+            logger.info("Aggregating clients by %s", agg.group_by)
+            query = supabase.table("clients").select(",".join(columns))
+            query = apply_query_filters(query, spec.filters)
+            groups = query.execute().data
+
+            # Groups are few; order them here so sorting may also use the
+            # aggregate outputs (e.g. "count")
+            for sort in reversed(spec.sort or []):
+                groups.sort(key=lambda g: (g.get(sort.field) is None,
+                                           g.get(sort.field)),
+                            reverse=sort.direction == "desc")
+            return {"groups": groups}
+
+        _check_fields([s.field for s in spec.sort], QUERY_FIELDS, "sort")
+        if spec.fields:
+            _check_fields(spec.fields, PROJECTION_FIELDS, "projection")
+        select = ",".join(spec.fields) if spec.fields else "*"
+
+        logger.info("Querying clients with %s filters", len(spec.filters))
+        query = supabase.table("clients").select(
+            select, count="exact" if spec.include_total else None)
+        query = apply_query_filters(query, spec.filters)
+        for sort in spec.sort:
+            query = query.order(sort.field, desc=sort.direction == "desc")
+        response = query.range(spec.offset,
+                               spec.offset + spec.limit - 1).execute()
+
+        result = {"rows": response.data}
+        if spec.include_total:
+            result["total"] = response.count
+        return result
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to query clients: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to query clients: {str(e)}")
+
+
 # Optional: Add an endpoint to get all possible fields for a client
 @router.get("/schema/fields")
 async def get_client_fields():
@@ -292,6 +706,6 @@ async def get_client_fields():
             return {"available_fields": known_fields}
 
     except Exception as e:
-        logger.error(f"Failed to fetch client fields: {str(e)}")
+        logger.error("Failed to fetch client fields: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to fetch client fields: {str(e)}")
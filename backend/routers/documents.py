@@ -0,0 +1,338 @@
+from fastapi import APIRouter, HTTPException, status, Request
+from fastapi.responses import RedirectResponse
+from typing import Dict, Any, Optional, Tuple, AsyncIterator
+from datetime import datetime
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from database import supabase
+from storage import (DOCUMENTS_BUCKET, SIGNED_URL_TTL, StorageError,
+                     create_signed_url, document_prefix, remove_objects,
+                     upload_stream)
+from document_cleanup import get_job
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Largest document accepted by the upload endpoint
+MAX_DOCUMENT_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES",
+                                   str(50 * 1024 * 1024)))
+
+
+class DocumentTooLarge(Exception):
+    pass
+
+
+def _safe_filename(filename: str) -> str:
+    name = os.path.basename(filename.replace("\\", "/")).strip()
+    name = re.sub(r"[^A-Za-z0-9._ -]", "_", name)
+    return name[:200] or "document"
+
+
+def _get_documents(client_id: str) -> Dict[str, Any]:
+    response = supabase.table("clients").select("id, client_documents").eq(
+        "id", client_id).execute()
+    if not response.data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Client with ID {client_id} not found")
+    return response.data[0].get("client_documents") or {}
+
+
+def _put_document(client_id: str, entry: Dict[str, Any]) -> bool:
+    """Add a manifest entry in one statement; False if the client is gone"""
+    return bool(
+        supabase.rpc("client_document_put", {
+            "p_client_id": client_id,
+            "p_document_id": entry["id"],
+            "p_entry": entry
+        }).execute().data)
+
+
+def _remove_document(client_id: str,
+                     document_id: str) -> Optional[Dict[str, Any]]:
+    """Remove a manifest entry in one statement and return it, if present"""
+    return supabase.rpc("client_document_remove", {
+        "p_client_id": client_id,
+        "p_document_id": document_id
+    }).execute().data
+
+
+class _FilePartStream:
+    """Incrementally parse a multipart body and expose its first file part.
+
+    The request body is fed through python-multipart chunk by chunk; data of
+    the file part is handed to the consumer through a bounded queue, so at
+    most a few chunks are held in memory at any time.
+    """
+
+    def __init__(self, request: Request, boundary: bytes):
+        self.request = request
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=8)
+        self.pending = []
+        self.header_field = b""
+        self.headers: Dict[bytes, bytes] = {}
+        self.in_file = False
+        self.file_seen = False
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self) -> None:
+        self.headers = {}
+        self.header_field = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        key = self.header_field.lower()
+        self.headers[key] = self.headers.get(key, b"") + data[start:end]
+        self.header_field = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(
+            self.headers.get(b"content-disposition", b""))
+        if b"filename" in options and not self.file_seen:
+            self.in_file = self.file_seen = True
+            content_type = self.headers.get(
+                b"content-type", b"application/octet-stream").decode(
+                    "latin-1")
+            self.pending.append(
+                ("start", options[b"filename"].decode("utf-8", "replace"),
+                 content_type))
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_file:
+            self.pending.append(("data", data[start:end]))
+
+    def _on_part_end(self) -> None:
+        if self.in_file:
+            self.in_file = False
+            self.pending.append(("end", ))
+
+    async def feed(self) -> None:
+        """Producer task: read the body and push parsed events to the queue"""
+        try:
+            async for chunk in self.request.stream():
+                self.parser.write(chunk)
+                for event in self.pending:
+                    await self.queue.put(event)
+                self.pending = []
+            self.parser.finalize()
+            for event in self.pending:
+                await self.queue.put(event)
+            await self.queue.put(("eof", ))
+        except Exception as e:
+            await self.queue.put(("error", e))
+
+    async def next_event(self) -> Tuple:
+        event = await self.queue.get()
+        if event[0] == "error":
+            raise event[1]
+        return event
+
+    async def file_start(self) -> Optional[Tuple[str, str]]:
+        """Wait for the file part's headers; None if the body has no file"""
+        while True:
+            event = await self.next_event()
+            if event[0] == "start":
+                return event[1], event[2]
+            if event[0] == "eof":
+                return None
+
+    async def file_chunks(self, digest, limit: int) -> AsyncIterator[bytes]:
+        self.size = 0
+        while True:
+            event = await self.next_event()
+            if event[0] != "data":
+                return
+            self.size += len(event[1])
+            if self.size > limit:
+                raise DocumentTooLarge()
+            digest.update(event[1])
+            yield event[1]
+
+
+@router.get("/{client_id}/documents")
+async def list_documents(client_id: str):
+    """List the document manifest stored on the client row"""
+    try:
+        documents = _get_documents(client_id)
+        return {"client_id": client_id, "documents": documents}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to list documents for client %s: %s",
+                     client_id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to list documents: {str(e)}")
+
+
+@router.get("/{client_id}/document-cleanup")
+async def get_document_cleanup(client_id: str):
+    """Progress of the background document removal started by delete_client"""
+    try:
+        job = get_job(document_prefix(client_id))
+    except Exception as e:
+        logger.error("Failed to read document cleanup for client %s: %s",
+                     client_id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to get document cleanup: {str(e)}")
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No document cleanup found for client {client_id}")
+    return {"client_id": client_id, **job}
+
+
+@router.post("/{client_id}/documents", status_code=status.HTTP_201_CREATED)
+async def upload_document(client_id: str, request: Request):
+    """Stream a multipart file upload straight into the documents bucket.
+
+    Expects multipart/form-data with a single file part. Only the manifest
+    entry (name, size, type, checksum, storage path) is kept on the client
+    row.
+    """
+    content_type, options = parse_options_header(
+        request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Expected a multipart/form-data upload")
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > (
+            MAX_DOCUMENT_BYTES + 64 * 1024):
+        raise HTTPException(status_code=413,
+                            detail="Document is too large")
+
+    feeder = None
+    try:
+        _get_documents(client_id)
+
+        stream = _FilePartStream(request, options[b"boundary"])
+        feeder = asyncio.create_task(stream.feed())
+        started = await stream.file_start()
+        if started is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="No file part in upload")
+        filename, file_type = started
+
+        document_id = uuid.uuid4().hex
+        path = (f"{document_prefix(client_id)}/{document_id}/"
+                f"{_safe_filename(filename)}")
+        digest = hashlib.sha256()
+
+        logger.info("Uploading document %s for client %s", document_id,
+                    client_id)
+        await upload_stream(DOCUMENTS_BUCKET, path,
+                            stream.file_chunks(digest, MAX_DOCUMENT_BYTES),
+                            file_type)
+
+        entry = {
+            "id": document_id,
+            "name": _safe_filename(filename),
+            "path": path,
+            "size": stream.size,
+            "content_type": file_type,
+            "sha256": digest.hexdigest(),
+            "uploaded_at": datetime.utcnow().isoformat()
+        }
+        if not _put_document(client_id, entry):
+            # Client deleted while the file was uploading
+            await remove_objects(DOCUMENTS_BUCKET, [path])
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Client with ID {client_id} not found")
+
+        logger.info("Stored document %s (%s bytes) for client %s",
+                    document_id, stream.size, client_id)
+        return entry
+    except DocumentTooLarge:
+        raise HTTPException(status_code=413,
+                            detail="Document is too large")
+    except HTTPException as he:
+        raise he
+    except StorageError as se:
+        logger.error("Storage rejected upload for client %s: %s", client_id,
+                     se)
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                            detail=f"Failed to store document: {str(se)}")
+    except Exception as e:
+        logger.error("Failed to upload document for client %s: %s",
+                     client_id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to upload document: {str(e)}")
+    finally:
+        if feeder is not None and not feeder.done():
+            feeder.cancel()
+
+
+@router.get("/{client_id}/documents/{document_id}")
+async def get_document(client_id: str,
+                       document_id: str,
+                       redirect: bool = False):
+    """Return a short-lived signed download URL for a document.
+
+    With `redirect=true` the response is a 307 to the signed URL, so the
+    browser downloads directly from storage.
+    """
+    try:
+        documents = _get_documents(client_id)
+        entry = documents.get(document_id)
+        if not isinstance(entry, dict) or not entry.get("path"):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Document {document_id} not found for client "
+                f"{client_id}")
+
+        url = await create_signed_url(DOCUMENTS_BUCKET, entry["path"],
+                                      SIGNED_URL_TTL)
+        if redirect:
+            return RedirectResponse(url, status_code=307)
+        return {**entry, "url": url, "expires_in": SIGNED_URL_TTL}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to sign document %s for client %s: %s",
+                     document_id, client_id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to get document: {str(e)}")
+
+
+@router.delete("/{client_id}/documents/{document_id}",
+               status_code=status.HTTP_204_NO_CONTENT)
+async def delete_document(client_id: str, document_id: str):
+    try:
+        entry = _get_documents(client_id).get(document_id)
+        if entry is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Document {document_id} not found for client "
+                f"{client_id}")
+        # The file goes first: if that fails the entry stays and the delete
+        # can be retried. Removing a missing object is a no-op, so a
+        # concurrent delete of the same document is harmless.
+        if isinstance(entry, dict) and entry.get("path"):
+            await remove_objects(DOCUMENTS_BUCKET, [entry["path"]])
+        _remove_document(client_id, document_id)
+        logger.info("Deleted document %s for client %s", document_id,
+                    client_id)
+        return None
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to delete document %s for client %s: %s",
+                     document_id, client_id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to delete document: {str(e)}")
@@ -1,38 +1,77 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Header, Query
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
-import telnyx
+from datetime import datetime, timedelta, timezone
+import asyncio
+import base64
+import json
 import os
 import logging
+import threading
 from database import get_db, supabase
+from responses import FastJSONResponse, conditional_response, parse_timestamp
+import delivery_stats
+import resilience
+from resilience import CircuitOpenError, telnyx_dependency
+from health import prober
+import scheduler
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Debug: Print environment variables (remove in production)
-logger.info(f"TELNYX_API_KEY exists: {bool(os.getenv('TELNYX_API_KEY'))}")
-logger.info(
-    f"TELNYX_MESSAGING_PROFILE_ID: {os.getenv('TELNYX_MESSAGING_PROFILE_ID')}")
-logger.info(f"TELNYX_PHONE_NUMBER: {os.getenv('TELNYX_PHONE_NUMBER')}")
-
 # Initialize Telnyx
 try:
-    telnyx.api_key = os.getenv("TELNYX_API_KEY")
+    TELNYX_API_KEY = os.getenv("TELNYX_API_KEY")
     TELNYX_MESSAGING_PROFILE_ID = os.getenv("TELNYX_MESSAGING_PROFILE_ID")
     TELNYX_PHONE_NUMBER = os.getenv("TELNYX_PHONE_NUMBER")
+    # Optional override, e.g. to point at a local stand-in for load tests
+    TELNYX_API_BASE = os.getenv("TELNYX_API_BASE")
 
-    if not telnyx.api_key:
+    if not TELNYX_API_KEY:
         logger.error("TELNYX_API_KEY not found in environment variables")
     if not TELNYX_MESSAGING_PROFILE_ID:
-        logger.error(
-            "TELNYX_MESSAGING_PROFILE_ID not found in environment variables")
+        logger.error("TELNYX_MESSAGING_PROFILE_ID not found in environment variables")
     if not TELNYX_PHONE_NUMBER:
         logger.error("TELNYX_PHONE_NUMBER not found in environment variables")
 
     logger.info("Telnyx configuration loaded successfully")
 except Exception as e:
-    logger.error(f"Error loading Telnyx configuration: {str(e)}")
+    logger.error("Error loading Telnyx configuration: %s", e)
+
+# Characters of the last message shown per inbox thread
+INBOX_PREVIEW_LENGTH = 160
+
+_telnyx = None
+_telnyx_lock = threading.Lock()
+
+
+def get_telnyx():
+    """Import and configure the Telnyx SDK on first use.
+
+    The SDK takes over a second to import, so it is kept off the app's
+    import path; `warmup()` loads it ahead of the first request.
+    """
+    global _telnyx
+    if _telnyx is None:
+        with _telnyx_lock:
+            if _telnyx is None:
+                import telnyx
+                from telnyx.http_client import RequestsClient
+                telnyx.api_key = TELNYX_API_KEY
+                if TELNYX_API_BASE:
+                    telnyx.api_base = TELNYX_API_BASE
+                # The SDK default is 80s; resilience.call() gives up sooner,
+                # this bounds how long the abandoned thread lingers. No SDK
+                # retries either: a retried send can go out twice.
+                telnyx.default_http_client = RequestsClient(
+                    timeout=telnyx_dependency.ceiling)
+                telnyx.max_network_retries = 0
+                _telnyx = telnyx
+    return _telnyx
+
+
+def warmup() -> None:
+    get_telnyx()
 
 
 class SMSCreate(BaseModel):
@@ -42,6 +81,10 @@ class SMSCreate(BaseModel):
     from_phone_number: Optional[str] = None  # Operator's phone number
 
 
+class ScheduledSMSCreate(SMSCreate):
+    send_at: datetime  # Naive values are taken as UTC
+
+
 class SMSMessage(BaseModel):
     id: str
     client_id: str
@@ -90,7 +133,11 @@ def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
 
 @router.get("/test")
 async def test_messages_endpoint():
-    """Test endpoint to verify messages router is working"""
+    """Test endpoint to verify messages router is working.
+
+    Kept for existing callers; Telnyx reachability comes from the health
+    prober (see /api/health/ready).
+    """
     try:
         return {
             "status":
@@ -98,22 +145,25 @@ async def test_messages_endpoint():
             "timestamp":
             datetime.now().isoformat(),
             "telnyx_configured":
-            bool(telnyx.api_key and TELNYX_MESSAGING_PROFILE_ID
-                 and TELNYX_PHONE_NUMBER)
+            bool(TELNYX_API_KEY and TELNYX_MESSAGING_PROFILE_ID
+                 and TELNYX_PHONE_NUMBER),
+            "telnyx":
+            prober.status("telnyx")
         }
     except Exception as e:
-        logger.error(f"Test endpoint error: {str(e)}")
+        logger.error("Test endpoint error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/client/{client_id}")
 async def get_client_messages(
-    client_id: str, 
+    client_id: str,
+    request: Request,
     authorization: Optional[str] = Header(None)
 ):
     """Get SMS messages for a specific client - filtered by operator's phone number"""
     try:
-        logger.info(f"Fetching messages for client: {client_id}")
+        logger.info("Fetching messages for client: %s", client_id)
 
         # Get current user
         user = get_current_user(authorization)
@@ -121,25 +171,23 @@ async def get_client_messages(
         user_phone = user.get('phone_number')
 
         if not user_phone:
-            logger.warning(f"User {user_id} has no phone number assigned")
+            logger.warning("User %s has no phone number assigned", user_id)
             return {
                 "client_id": client_id,
                 "client_phone": None,
                 "messages": []
             }
 
-        logger.info(f"User ID: {user_id}, Phone: {user_phone}")
+        logger.debug("Resolved operator %s", user_id)
 
         # First verify client exists
         client_response = supabase.table("clients").select(
             "id, primary_phone").eq("id", client_id).execute()
         if not client_response.data:
-            logger.warning(f"Client with ID {client_id} not found")
+            logger.warning("Client with ID %s not found", client_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Client with ID {client_id} not found")
 
-        logger.info(f"Client found: {client_response.data[0]}")
-
         # Get messages for this client where:
         # 1. Outbound: from_number matches operator's phone
         # 2. Inbound: to_number matches operator's phone
@@ -149,254 +197,683 @@ async def get_client_messages(
             f"from_number.eq.{user_phone},to_number.eq.{user_phone}"
         ).order("created_at").execute()
 
-        logger.info(
-            f"Found {len(messages_response.data)} messages for client {client_id} and operator phone {user_phone}"
-        )
+        logger.info("Found %s messages for client %s and operator %s",
+                    len(messages_response.data), client_id, user_id)
 
-        return {
-            "client_id": client_id,
-            "client_phone": client_response.data[0].get("primary_phone"),
-            "messages": messages_response.data
-        }
+        # ETag only: webhook status updates don't move any timestamp the
+        # thread could use for Last-Modified. The thread depends on the
+        # operator, so caches key on Authorization.
+        return conditional_response(
+            request, {
+                "client_id": client_id,
+                "client_phone": client_response.data[0].get("primary_phone"),
+                "messages": messages_response.data
+            },
+            vary="Authorization")
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(
-            f"Failed to fetch messages for client {client_id}: {str(e)}")
+        logger.error("Failed to fetch messages for client %s: %s", client_id,
+                     e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to fetch messages: {str(e)}")
 
 
-@router.post("/send")
-async def send_sms(
-    sms: SMSCreate,
-    authorization: Optional[str] = Header(None)
-):
-    """Send SMS to a client"""
+def _date_bound(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Invalid {name}: {value}")
+    return parsed
+
+
+@router.get("/search")
+async def search_messages(
+        q: Optional[str] = None,
+        direction: Optional[str] = Query(None,
+                                         pattern="^(inbound|outbound)$"),
+        client_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=200),
+        offset: int = Query(0, ge=0, le=10000),
+        authorization: Optional[str] = Header(None)):
+    """Search the operator's SMS history, newest first.
+
+    `q` takes web search syntax ("quoted phrases", or, -excluded) and is
+    matched against the content index; dates bound created_at, date_to
+    exclusive.
+    """
     try:
-        logger.info(f"Attempting to send SMS to client: {sms.client_id}")
-        logger.info(f"Message content: {sms.content[:50]}...")
-
-        # Get current user
         user = get_current_user(authorization)
-        user_id = user['id']
         user_phone = user.get('phone_number')
-
-        if not user_phone and not sms.from_phone_number:
-            logger.error(f"User {user_id} has no phone number assigned")
+        start = _date_bound(date_from, "date_from")
+        end = _date_bound(date_to, "date_to")
+        if not user_phone:
+            logger.warning("User %s has no phone number assigned", user['id'])
+            return {"messages": [], "limit": limit, "offset": offset,
+                    "has_more": False}
+
+        query = supabase.table("messages").select("*")
+        # Same operator scoping as the client thread
+        if direction == "outbound":
+            query = query.eq("direction", "outbound").eq(
+                "from_number", user_phone)
+        elif direction == "inbound":
+            query = query.eq("direction", "inbound").eq(
+                "to_number", user_phone)
+        else:
+            query = query.or_(
+                f"from_number.eq.{user_phone},to_number.eq.{user_phone}")
+        if q and q.strip():
+            # websearch_to_tsquery('english', q), served by the index on
+            # to_tsvector('english', content); text_search() can't be
+            # followed by order()/range() in this client
+            query = query.filter("content", "wfts(english)", q.strip())
+        if client_id:
+            query = query.eq("client_id", client_id)
+        if start:
+            query = query.gte("created_at", start.isoformat())
+        if end:
+            query = query.lt("created_at", end.isoformat())
+
+        # One row past the page tells whether there is a next one
+        rows = query.order("created_at", desc=True).range(
+            offset, offset + limit).execute().data
+        return FastJSONResponse({
+            "messages": rows[:limit],
+            "limit": limit,
+            "offset": offset,
+            "has_more": len(rows) > limit
+        })
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to search messages: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to search messages: {str(e)}")
+
+
+def _operator_summary(operator_phone: str) -> dict:
+    return {
+        "operator_phone": operator_phone,
+        "outbound": 0,
+        "inbound": 0,
+        "by_status": {},
+        "delivery_rate": None,
+        "response_time": None
+    }
+
+
+@router.get("/stats")
+async def message_stats(date_from: Optional[str] = None,
+                        date_to: Optional[str] = None,
+                        operator_phone: Optional[str] = None,
+                        authorization: Optional[str] = Header(None)):
+    """Volume, delivery rate and response times of the operator's phone.
+
+    Defaults to the last 30 days. Counts come from the hourly rollups
+    (see delivery_stats.py) and response times from the messages, both
+    through SQL functions; only their per-day buckets come back here.
+    `operator_phone`, if given, must be the caller's own number.
+    """
+    try:
+        user = get_current_user(authorization)
+        user_phone = user.get('phone_number')
+        if operator_phone and operator_phone != user_phone:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Your account does not have a phone number assigned. Please contact the administrator."
-            )
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Stats are only available for your own phone number")
+        try:
+            # Counts this worker hasn't flushed yet
+            await asyncio.to_thread(delivery_stats.aggregator.flush)
+        except Exception as flush_error:
+            logger.warning("Message stats flush failed: %s", flush_error)
+        end = _date_bound(date_to, "date_to") or datetime.now(timezone.utc)
+        start = _date_bound(date_from, "date_from") or end - timedelta(days=30)
+        if start >= end:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="date_from must be before date_to")
 
-        logger.info(f"User ID: {user_id}, Phone: {user_phone}")
+        if not user_phone:
+            logger.warning("User %s has no phone number assigned", user['id'])
+            return {
+                "date_from": start.isoformat(),
+                "date_to": end.isoformat(),
+                "operators": [],
+                "daily": [],
+                "response_times": []
+            }
 
-        # Validate Telnyx configuration
-        if not telnyx.api_key:
-            logger.error("Telnyx API key not configured")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="SMS service not properly configured - missing API key")
+        params = {
+            "p_from": start.isoformat(),
+            "p_to": end.isoformat(),
+            "p_operator": user_phone
+        }
+        daily = supabase.rpc("message_stats", params).execute().data or []
+        response_times = supabase.rpc("message_response_times",
+                                      params).execute().data or []
+
+        operators = {}
+        for row in daily:
+            summary = operators.setdefault(
+                row["operator_phone"],
+                _operator_summary(row["operator_phone"]))
+            summary[row["direction"]] += row["messages"]
+            if row["direction"] == "outbound":
+                by_status = summary["by_status"]
+                by_status[row["status"]] = (by_status.get(row["status"], 0) +
+                                            row["messages"])
+        for summary in operators.values():
+            # Of the messages Telnyx reported a final status for
+            delivered = summary["by_status"].get("delivered", 0)
+            settled = delivered + summary["by_status"].get("failed", 0)
+            if settled:
+                summary["delivery_rate"] = delivered / settled
+
+        daily_response_times = []
+        for row in response_times:
+            if row["day"] is not None:
+                daily_response_times.append(row)
+                continue
+            # Rows without a day are the totals over the whole period
+            summary = operators.setdefault(
+                row["operator_phone"],
+                _operator_summary(row["operator_phone"]))
+            summary["response_time"] = {
+                key: row[key]
+                for key in ("replies", "avg_seconds", "p50_seconds",
+                            "p90_seconds")
+            }
 
-        if not TELNYX_MESSAGING_PROFILE_ID:
-            logger.error("Telnyx messaging profile ID not configured")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=
-                "SMS service not properly configured - missing messaging profile ID"
-            )
+        return FastJSONResponse({
+            "date_from": start.isoformat(),
+            "date_to": end.isoformat(),
+            "operators": sorted(operators.values(),
+                                key=lambda s: s["operator_phone"] or ""),
+            "daily": daily,
+            "response_times": daily_response_times
+        })
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to compute message stats: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to compute message stats: {str(e)}")
 
-        if not TELNYX_PHONE_NUMBER:
-            logger.error("Telnyx phone number not configured")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=
-                "SMS service not properly configured - missing phone number")
 
-        # Get client details
-        logger.info(f"Looking up client {sms.client_id}")
-        client_response = supabase.table("clients").select("*").eq(
-            "id", sms.client_id).execute()
-        if not client_response.data:
-            logger.warning(f"Client with ID {sms.client_id} not found")
+def _encode_cursor(thread: dict) -> str:
+    cursor = json.dumps({
+        "t": thread["last_message_at"],
+        "c": thread["client_id"]
+    })
+    return base64.urlsafe_b64encode(cursor.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))
+        last_message_at = parse_timestamp(position["t"])
+        if last_message_at is None:
+            raise ValueError("bad timestamp")
+        return last_message_at.isoformat(), str(position["c"])
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid cursor")
+
+
+@router.get("/inbox")
+async def get_inbox(cursor: Optional[str] = None,
+                    limit: int = Query(25, ge=1, le=100),
+                    unread_only: bool = False,
+                    authorization: Optional[str] = Header(None)):
+    """The operator's conversations, latest activity first.
+
+    Read from the message_threads summary a page at a time; pass
+    next_cursor back as `cursor` for the following page.
+    """
+    try:
+        user = get_current_user(authorization)
+        user_phone = user.get('phone_number')
+        if not user_phone:
+            logger.warning("User %s has no phone number assigned", user['id'])
+            return {"threads": [], "next_cursor": None}
+
+        query = supabase.table("message_threads").select(
+            "client_id, client_phone, last_message_at, last_direction, "
+            "last_preview, unread_count, message_count, last_read_at").eq(
+                "operator_phone", user_phone)
+        if unread_only:
+            query = query.gt("unread_count", 0)
+        if cursor:
+            # Keyset on the inbox index: strictly after the last thread of
+            # the previous page
+            last_message_at, client_id = _decode_cursor(cursor)
+            query = query.or_(
+                f'last_message_at.lt."{last_message_at}",'
+                f'and(last_message_at.eq."{last_message_at}",'
+                f'client_id.lt."{client_id}")')
+        threads = query.order("last_message_at", desc=True).order(
+            "client_id", desc=True).limit(limit + 1).execute().data
+
+        next_cursor = None
+        if len(threads) > limit:
+            threads = threads[:limit]
+            next_cursor = _encode_cursor(threads[-1])
+
+        if threads:
+            clients_response = supabase.table("clients").select(
+                "id, first_name, last_name").in_(
+                    "id", [thread["client_id"] for thread in threads]).execute()
+            names = {
+                str(client["id"]): " ".join(
+                    part for part in (client.get("first_name"),
+                                      client.get("last_name")) if part)
+                for client in clients_response.data
+            }
+            for thread in threads:
+                thread["client_name"] = names.get(thread["client_id"])
+
+        return FastJSONResponse({
+            "threads": threads,
+            "next_cursor": next_cursor
+        })
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to fetch inbox: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to fetch inbox: {str(e)}")
+
+
+@router.post("/inbox/{client_id}/read")
+async def mark_thread_read(client_id: str,
+                           authorization: Optional[str] = Header(None)):
+    """Clear the unread count of the operator's thread with a client"""
+    try:
+        user = get_current_user(authorization)
+        user_phone = user.get('phone_number')
+        if not user_phone:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Client with ID {sms.client_id} not found")
+                detail=f"No conversation with client {client_id}")
+
+        response = supabase.table("message_threads").update({
+            "unread_count": 0,
+            "last_read_at": datetime.now(timezone.utc).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }).eq("operator_phone", user_phone).eq("client_id",
+                                               client_id).execute()
+        if not response.data:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No conversation with client {client_id}")
+        return response.data[0]
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to mark thread with client %s read: %s",
+                     client_id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to mark thread read: {str(e)}")
 
-        client = client_response.data[0]
-        logger.info(
-            f"Client found: {client.get('first_name')} {client.get('last_name')}"
+
+def _touch_thread(message: dict) -> None:
+    """Fold a stored message into its inbox thread (migrations/010).
+
+    The message is already stored, so a failure here is logged rather than
+    failing the send or webhook.
+    """
+    operator_phone = delivery_stats.operator_phone(message)
+    created_at = parse_timestamp(message.get("created_at"))
+    if not (message.get("client_id") and operator_phone and created_at):
+        return
+    outbound = message.get("direction") == "outbound"
+    try:
+        supabase.rpc(
+            "message_thread_touch", {
+                "p_operator_phone": operator_phone,
+                "p_client_id": str(message["client_id"]),
+                "p_client_phone": message.get(
+                    "to_number" if outbound else "from_number"),
+                "p_direction": message.get("direction"),
+                "p_preview": (message.get("content")
+                              or "")[:INBOX_PREVIEW_LENGTH],
+                "p_at": created_at.isoformat()
+            }).execute()
+    except Exception as e:
+        logger.error("Failed to update inbox thread of client %s: %s",
+                     message.get("client_id"), e)
+
+
+def _rejected(error: Exception) -> bool:
+    """Whether Telnyx answered the send with an error status.
+
+    Only then is the message known not to have gone out, so another sender
+    may try it; a timeout or connection error leaves that open.
+    """
+    status_code = getattr(error, "http_status", None)
+    return isinstance(status_code, int) and 400 <= status_code < 600
+
+
+def _store_unsent(sms: SMSCreate, to_phone_number: str, from_number: str,
+                  user_id, message_status: str) -> None:
+    """Record a message Telnyx didn't accept ("failed") or never answered
+    for ("unknown")"""
+    message_data = {
+        "client_id": sms.client_id,
+        "to_number": to_phone_number,
+        "from_number": from_number,
+        "content": sms.content,  # Store original content even if failed
+        "direction": "outbound",
+        "status": message_status,
+        "user_id": user_id,
+        "created_at": datetime.utcnow().isoformat()
+    }
+
+    try:
+        supabase.table("messages").insert(message_data).execute()
+        logger.info("Unsent message stored in database (%s)",
+                    message_status)
+        delivery_stats.aggregator.record(message_data)
+        _touch_thread(message_data)
+    except Exception as db_error:
+        logger.error("Failed to store %s message: %s", message_status,
+                     db_error)
+
+
+async def deliver_sms(sms: SMSCreate, user: dict) -> dict:
+    """Send `sms` as `user` and store it in the messages table.
+
+    Shared by the send endpoint and the scheduler. Raises HTTPException for
+    anything the caller should report: 4xx for bad input, 503 while every
+    sender's circuit breaker is open, and 504 when Telnyx didn't answer in
+    time. Only a sender Telnyx rejected falls back to the next one; after a
+    504 the message may have gone out and must not be sent again.
+    """
+    user_id = user['id']
+    user_phone = user.get('phone_number')
+
+    if not user_phone and not sms.from_phone_number:
+        logger.error("User %s has no phone number assigned", user_id)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Your account does not have a phone number assigned. Please contact the administrator."
         )
 
-        # Use provided phone number or client's primary phone
-        to_phone_number = sms.phone_number or client.get("primary_phone")
-        if not to_phone_number:
-            logger.warning(
-                f"No phone number available for client {sms.client_id}")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No phone number available for this client")
+    logger.debug("Resolved operator %s", user_id)
+
+    # Validate Telnyx configuration
+    if not TELNYX_API_KEY:
+        logger.error("Telnyx API key not configured")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="SMS service not properly configured - missing API key")
+
+    if not TELNYX_MESSAGING_PROFILE_ID:
+        logger.error("Telnyx messaging profile ID not configured")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=
+            "SMS service not properly configured - missing messaging profile ID"
+        )
+
+    if not TELNYX_PHONE_NUMBER:
+        logger.error("Telnyx phone number not configured")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=
+            "SMS service not properly configured - missing phone number")
+
+    # Get client details
+    logger.debug("Looking up client %s", sms.client_id)
+    client_response = supabase.table("clients").select("*").eq(
+        "id", sms.client_id).execute()
+    if not client_response.data:
+        logger.warning("Client with ID %s not found", sms.client_id)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Client with ID {sms.client_id} not found")
+
+    client = client_response.data[0]
+
+    # Use provided phone number or client's primary phone
+    to_phone_number = sms.phone_number or client.get("primary_phone")
+    if not to_phone_number:
+        logger.warning("No phone number available for client %s",
+                       sms.client_id)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No phone number available for this client")
+
+    # Determine the "from" phone number - prioritize operator's phone
+    from_number = user_phone if user_phone else (sms.from_phone_number if sms.from_phone_number else TELNYX_PHONE_NUMBER)
+
 
-        # Determine the "from" phone number - prioritize operator's phone
-        from_number = user_phone if user_phone else (sms.from_phone_number if sms.from_phone_number else TELNYX_PHONE_NUMBER)
+    # Preserve formatting: ensure newlines and emojis are maintained
+    formatted_content = sms.content.strip(
+    )  # Remove leading/trailing whitespace but preserve internal formatting
 
-        logger.info(f"To number: {to_phone_number}")
-        logger.info(f"From number: {from_number}")
+    # Senders in order of preference: the operator's number, the default
+    # number, then the alpha sender. Each has its own circuit breaker, so
+    # while one is tripped the send goes straight to the next.
+    senders = [("primary" if from_number != TELNYX_PHONE_NUMBER else
+                "default", from_number)]
+    if from_number != TELNYX_PHONE_NUMBER:
+        senders.append(("default", TELNYX_PHONE_NUMBER))
+    senders.append(("alpha", "TESTCRM"))
 
-        # Send SMS via Telnyx
+    errors = {}
+    for kind, sender in senders:
         try:
-            logger.info("Attempting to send SMS via Telnyx...")
-            logger.info(f"From: {from_number}")
-            logger.info(f"To: {to_phone_number}")
-            logger.info(f"Message content (raw): {repr(sms.content)}"
-                        )  # Show raw content with escape chars
-            logger.info(f"Messaging Profile ID: {TELNYX_MESSAGING_PROFILE_ID}")
-
-            # Preserve formatting: ensure newlines and emojis are maintained
-            formatted_content = sms.content.strip(
-            )  # Remove leading/trailing whitespace but preserve internal formatting
-
-            telnyx_response = telnyx.Message.create(
-                from_=from_number,
+            logger.debug("Attempting to send SMS via Telnyx (%s sender)",
+                         kind)
+            telnyx_response = await resilience.call(
+                telnyx_dependency,
+                get_telnyx().Message.create,
+                part=kind,
+                from_=sender,
                 to=to_phone_number,
                 text=formatted_content,  # Use formatted content
                 messaging_profile_id=TELNYX_MESSAGING_PROFILE_ID)
+        except CircuitOpenError as open_error:
+            logger.warning("Skipping %s sender: %s", kind, open_error)
+            errors[kind] = open_error
+            continue
+        except Exception as telnyx_error:
+            if not _rejected(telnyx_error):
+                # Timed out or lost the connection: Telnyx may still send
+                # it, and another sender would deliver a second copy
+                logger.error("No answer from Telnyx with %s sender: %s",
+                             kind, telnyx_error)
+                _store_unsent(sms, to_phone_number, sender, user_id,
+                              "unknown")
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                    detail="SMS service did not answer; the message may "
+                    f"or may not have been sent: {str(telnyx_error)}")
+            logger.error("Telnyx API error with %s sender: %s", kind,
+                         telnyx_error)
+            errors[kind] = telnyx_error
+            continue
+
+        logger.info("Telnyx accepted message %s via %s sender",
+                    telnyx_response.id, kind)
+
+        # Store message in database with proper to/from numbers
+        message_data = {
+            "client_id": sms.client_id,
+            "to_number": to_phone_number,
+            "from_number": sender,
+            "content": formatted_content,  # Store formatted content
+            "direction": "outbound",
+            "status": "sent",
+            "telnyx_message_id": telnyx_response.id,
+            "user_id": user_id,  # Store the operator who sent this message
+            "created_at": datetime.utcnow().isoformat()
+        }
 
-            logger.info(f"Telnyx response: {telnyx_response}")
-
-            # Store message in database with proper to/from numbers
-            message_data = {
-                "client_id": sms.client_id,
-                "to_number": to_phone_number,
-                "from_number": from_number,
-                "content": formatted_content,  # Store formatted content
-                "direction": "outbound",
-                "status": "sent",
-                "telnyx_message_id": telnyx_response.id,
-                "user_id": user_id,  # Store the operator who sent this message
-                "created_at": datetime.utcnow().isoformat()
-            }
+        logger.debug("Storing message in database")
+        db_response = supabase.table("messages").insert(
+            message_data).execute()
+        logger.debug("Message stored successfully")
+        delivery_stats.aggregator.record(message_data)
+        _touch_thread(message_data)
 
-            logger.info("Storing message in database...")
-            db_response = supabase.table("messages").insert(
-                message_data).execute()
-            logger.info("Message stored successfully")
+        return db_response.data[0]
 
-            return db_response.data[0]
+    # Every sender failed or is tripped - store as failed
+    _store_unsent(sms, to_phone_number, from_number, user_id, "failed")
 
-        except Exception as telnyx_error:
-            logger.error(
-                f"Telnyx API error with phone number: {str(telnyx_error)}")
-
-            # If using operator's phone failed, try with default TELNYX_PHONE_NUMBER
-            if from_number != TELNYX_PHONE_NUMBER:
-                logger.info(f"Attempting fallback with default phone number {TELNYX_PHONE_NUMBER}...")
-                try:
-                    formatted_content = sms.content.strip()
-
-                    telnyx_response_fallback = telnyx.Message.create(
-                        from_=TELNYX_PHONE_NUMBER,
-                        to=to_phone_number,
-                        text=formatted_content,
-                        messaging_profile_id=TELNYX_MESSAGING_PROFILE_ID)
-
-                    logger.info(f"Fallback success: {telnyx_response_fallback}")
-
-                    # Store successful message
-                    message_data = {
-                        "client_id": sms.client_id,
-                        "to_number": to_phone_number,
-                        "from_number": TELNYX_PHONE_NUMBER,
-                        "content": formatted_content,
-                        "direction": "outbound",
-                        "status": "sent",
-                        "telnyx_message_id": telnyx_response_fallback.id,
-                        "user_id": user_id,
-                        "created_at": datetime.utcnow().isoformat()
-                    }
-
-                    logger.info("Storing fallback message in database...")
-                    db_response = supabase.table("messages").insert(
-                        message_data).execute()
-                    logger.info("Fallback message stored successfully")
-
-                    return db_response.data[0]
-
-                except Exception as fallback_error:
-                    logger.error(f"Fallback also failed: {str(fallback_error)}")
-
-            # Try alpha sender as last resort
-            logger.info("Attempting fallback with alpha sender 'TESTCRM'...")
-
-            # Fallback: Try sending with alpha sender
-            try:
-                formatted_content = sms.content.strip(
-                )  # Preserve formatting for fallback too
-
-                telnyx_response_alpha = telnyx.Message.create(
-                    from_="TESTCRM",  # Alpha sender
-                    to=to_phone_number,
-                    text=formatted_content,  # Use formatted content
-                    messaging_profile_id=TELNYX_MESSAGING_PROFILE_ID)
-
-                logger.info(f"Alpha sender success: {telnyx_response_alpha}")
-
-                # Store successful message with alpha sender
-                message_data = {
-                    "client_id": sms.client_id,
-                    "to_number": to_phone_number,
-                    "from_number": "TESTCRM",
-                    "content": formatted_content,  # Store formatted content
-                    "direction": "outbound",
-                    "status": "sent",
-                    "telnyx_message_id": telnyx_response_alpha.id,
-                    "user_id": user_id,
-                    "created_at": datetime.utcnow().isoformat()
-                }
+    if all(isinstance(error, CircuitOpenError)
+           for error in errors.values()):
+        retry_after = min(error.retry_after for error in errors.values())
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="SMS service is temporarily unavailable",
+            headers={"Retry-After": str(max(1, round(retry_after)))})
 
-                logger.info("Storing alpha sender message in database...")
-                db_response = supabase.table("messages").insert(
-                    message_data).execute()
-                logger.info("Alpha sender message stored successfully")
+    raise HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=
+        f"Failed to send SMS with both phone number and alpha sender. Phone error: {str(errors[senders[0][0]])}. Alpha error: {str(errors['alpha'])}"
+    )
 
-                return db_response.data[0]
 
-            except Exception as alpha_error:
-                logger.error(f"Alpha sender also failed: {str(alpha_error)}")
+@router.post("/send")
+async def send_sms(
+    sms: SMSCreate,
+    authorization: Optional[str] = Header(None)
+):
+    """Send SMS to a client"""
+    try:
+        logger.info("Attempting to send SMS to client: %s", sms.client_id)
 
-                # Both phone number and alpha sender failed - store as failed
-                message_data = {
-                    "client_id": sms.client_id,
-                    "to_number": to_phone_number,
-                    "from_number": from_number,
-                    "content":
-                    sms.content,  # Store original content even if failed
-                    "direction": "outbound",
-                    "status": "failed",
-                    "user_id": user_id,
-                    "created_at": datetime.utcnow().isoformat()
-                }
+        # Get current user
+        user = get_current_user(authorization)
+        return await deliver_sms(sms, user)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Unexpected error in send_sms: %s", e)
+        logger.error("Error type: %s", type(e))
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to send SMS: {str(e)}")
 
-                try:
-                    supabase.table("messages").insert(message_data).execute()
-                    logger.info("Failed message stored in database")
-                except Exception as db_error:
-                    logger.error(
-                        f"Failed to store failed message: {str(db_error)}")
 
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=
-                    f"Failed to send SMS with both phone number and alpha sender. Phone error: {str(telnyx_error)}. Alpha error: {str(alpha_error)}"
-                )
+@router.post("/schedule")
+async def schedule_sms(
+    sms: ScheduledSMSCreate,
+    authorization: Optional[str] = Header(None)
+):
+    """Schedule an SMS to a client for `send_at`"""
+    try:
+        user = get_current_user(authorization)
+        # Resolved now, so the text goes out from the scheduling operator's
+        # number; the recipient is resolved at send time unless overridden
+        from_number = user.get('phone_number') or sms.from_phone_number
+        if not from_number:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Your account does not have a phone number assigned. Please contact the administrator."
+            )
+
+        send_at = sms.send_at
+        if send_at.tzinfo is None:
+            send_at = send_at.replace(tzinfo=timezone.utc)
+        if send_at < datetime.now(timezone.utc) - timedelta(minutes=5):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="send_at is in the past")
 
+        client_response = supabase.table("clients").select("id").eq(
+            "id", sms.client_id).execute()
+        if not client_response.data:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Client with ID {sms.client_id} not found")
+
+        scheduled = scheduler.schedule([{
+            "client_id": sms.client_id,
+            "user_id": user['id'],
+            "to_number": sms.phone_number,
+            "from_number": from_number,
+            "content": sms.content.strip(),
+            "kind": "follow_up",
+            "send_at": send_at.isoformat()
+        }])[0]
+        logger.info("Scheduled message %s for client %s at %s",
+                    scheduled["id"], sms.client_id, scheduled["send_at"])
+        return scheduled
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Unexpected error in send_sms: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
+        logger.error("Failed to schedule SMS for client %s: %s",
+                     sms.client_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=f"Failed to send SMS: {str(e)}")
+                            detail=f"Failed to schedule SMS: {str(e)}")
+
+
+@router.get("/scheduled")
+async def list_scheduled_messages(
+        client_id: Optional[str] = None,
+        status_filter: Optional[str] = Query(None, alias="status"),
+        event_id: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=1000),
+        authorization: Optional[str] = Header(None)):
+    """List the operator's scheduled messages, soonest first"""
+    try:
+        user = get_current_user(authorization)
+        query = supabase.table(scheduler.TABLE).select(
+            "id, client_id, user_id, to_number, from_number, content, kind, "
+            "event_id, send_at, status, attempts, last_error, message_id, "
+            "created_at, updated_at").eq("user_id", user['id'])
+        if client_id:
+            query = query.eq("client_id", client_id)
+        if status_filter:
+            query = query.eq("status", status_filter)
+        if event_id:
+            query = query.eq("event_id", event_id)
+        response = query.order("send_at").limit(limit).execute()
+        return {"scheduled_messages": response.data}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to list scheduled messages: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to list scheduled messages: {str(e)}")
+
+
+@router.delete("/scheduled/{message_id}")
+async def cancel_scheduled_message(
+        message_id: str, authorization: Optional[str] = Header(None)):
+    """Cancel one of the operator's scheduled messages not yet sent"""
+    try:
+        user = get_current_user(authorization)
+        if scheduler.cancel({"id": message_id, "user_id": user['id']}):
+            logger.info("Cancelled scheduled message %s", message_id)
+            return {"message": "Scheduled message cancelled"}
+
+        # Other operators' messages are reported as missing
+        existing = supabase.table(scheduler.TABLE).select("status").eq(
+            "id", message_id).eq("user_id", user['id']).execute()
+        if not existing.data:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Scheduled message {message_id} not found")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Scheduled message is already {existing.data[0]['status']}")
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error("Failed to cancel scheduled message %s: %s", message_id,
+                     e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Failed to cancel scheduled message: {str(e)}")
 
 
 @router.post("/webhook")
@@ -404,11 +881,11 @@ async def telnyx_webhook(request: Request):
     """Handle incoming SMS webhooks from Telnyx"""
     try:
         payload = await request.json()
-        logger.info(f"Received Telnyx webhook: {payload}")
 
         # Extract message data from webhook
         data = payload.get("data", {})
         event_type = data.get("event_type")
+        logger.info("Received Telnyx webhook: %s", event_type)
 
         if event_type == "message.received":
             payload_data = data.get("payload", {})
@@ -419,9 +896,7 @@ async def telnyx_webhook(request: Request):
             telnyx_message_id = payload_data.get(
                 "id")  # Message ID, not event ID
 
-            logger.info(
-                f"Processing message from {from_number} to {to_number}: {message_content}"
-            )
+            logger.debug("Processing inbound message %s", telnyx_message_id)
 
             # Find client by phone number
             client_response = supabase.table("clients").select("*").eq(
@@ -444,10 +919,12 @@ async def telnyx_webhook(request: Request):
                 }
 
                 supabase.table("messages").insert(message_data).execute()
-                logger.info(f"Stored incoming message from client {client_id} to {to_number}")
+                logger.info("Stored incoming message from client %s",
+                            client_id)
+                delivery_stats.aggregator.record(message_data)
+                _touch_thread(message_data)
             else:
-                logger.warning(
-                    f"Received SMS from unknown number: {from_number}")
+                logger.warning("Received SMS from unknown number")
 
                 # Optional: Store message from unknown sender
                 message_data = {
@@ -472,29 +949,36 @@ async def telnyx_webhook(request: Request):
             telnyx_message_id = payload_data.get("id")
             new_status = event_type.split(".")[1]  # sent, delivered, or failed
 
-            # Update message status in database
-            update_result = supabase.table("messages").update({
-                "status":
-                new_status
-            }).eq("telnyx_message_id", telnyx_message_id).execute()
-
-            logger.info(
-                f"Updated message {telnyx_message_id} status to {new_status}")
+            # Update message status in database; only the messages whose
+            # status changed come back, with the status they had
+            changed = supabase.rpc(
+                "message_set_status", {
+                    "p_telnyx_message_id": telnyx_message_id,
+                    "p_status": new_status
+                }).execute().data or []
+            for message in changed:
+                delivery_stats.aggregator.transition(message,
+                                                     message["old_status"],
+                                                     new_status)
+
+            logger.info("Updated message %s status to %s", telnyx_message_id,
+                        new_status)
 
         return {"status": "success"}
 
     except Exception as e:
-        logger.error(f"Error processing webhook: {str(e)}")
+        logger.error("Error processing webhook: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Error processing webhook: {str(e)}")
 
 
 @router.get("/client/{client_id}/phone-numbers")
-async def get_client_phone_numbers(client_id: str):
+async def get_client_phone_numbers(client_id: str, request: Request):
     """Get all available phone numbers for a client"""
     try:
-        client_response = supabase.table("clients").select("*").eq(
-            "id", client_id).execute()
+        client_response = supabase.table("clients").select(
+            "id, primary_phone, mobile_phone, alternate_phone, home_phone, "
+            "work_phone, updated_at").eq("id", client_id).execute()
         if not client_response.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Client with ID {client_id} not found")
@@ -515,12 +999,16 @@ async def get_client_phone_numbers(client_id: str):
                     "number": client[field]
                 })
 
-        return {"client_id": client_id, "phone_numbers": phone_numbers}
+        return conditional_response(
+            request, {
+                "client_id": client_id,
+                "phone_numbers": phone_numbers
+            }, client.get("updated_at"))
 
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(
-            f"Failed to fetch phone numbers for client {client_id}: {str(e)}")
+        logger.error("Failed to fetch phone numbers for client %s: %s",
+                     client_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to fetch phone numbers: {str(e)}")
\ No newline at end of file
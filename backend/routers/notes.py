@@ -1,13 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Union, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 from database import get_db, supabase
+from responses import conditional_response
 import logging
 
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -32,15 +30,16 @@ class NoteUpdate(NoteBase):
     updated_at: Optional[str] = None
 
 
-@router.get("/{client_id}", response_model=List[dict])
-async def get_notes(client_id: str):
+@router.get("/{client_id}")
+async def get_notes(client_id: str, request: Request):
     try:
         logger.info("Fetching all notes")
         response = supabase.table("notes").select("*").eq("client_id", client_id).execute()
-        logger.info(f"Successfully retrieved {len(response.data)} notes")
-        return response.data
+        logger.info("Successfully retrieved %s notes", len(response.data))
+        # ETag only: deleting a note moves no timestamp
+        return conditional_response(request, response.data)
     except Exception as e:
-        logger.error(f"Failed to fetch notes: {str(e)}")
+        logger.error("Failed to fetch notes: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to fetch notes: {str(e)}")
 
@@ -54,7 +53,7 @@ async def create_note(note:NoteBase):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail="Client ID, Created By, and Content are required")
 
-        logger.info(f"Creating new note for client: {note.client_id}")
+        logger.info("Creating new note for client: %s", note.client_id)
 
         if not note.created_by:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
@@ -62,9 +61,8 @@ async def create_note(note:NoteBase):
 
         # Convert note to dict (this now includes extra fields thanks to extra="allow")
         note_data = note.model_dump()
-        logger.info(f"Note data before processing: {note_data}")
         # Add timestamps
-        note_data["created_at"] = datetime.now().isoformat()
+        note_data["created_at"] = datetime.now(timezone.utc).isoformat()
         note_data["updated_at"] = note_data["created_at"]
 
         # Remove None values to avoid overwriting database defaults
@@ -72,12 +70,12 @@ async def create_note(note:NoteBase):
 
         response = supabase.table("notes").insert(note_data).execute()
         new_note = response.data[0]
-        logger.info(f"Successfully created note with ID: {new_note['id']}")
+        logger.info("Successfully created note with ID: %s", new_note['id'])
         return new_note
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Failed to create note: {str(e)}")
+        logger.error("Failed to create note: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to create note: {str(e)}")
 
@@ -86,19 +84,18 @@ async def create_note(note:NoteBase):
 async def update_note(note: NoteBase):
     try:
         note_id = note.model_dump().get("id")
-        logger.info(f"Received request to update note with ID: {note_id}")
+        logger.info("Received request to update note with ID: %s", note_id)
         if not note_id:
             logger.error("Note ID is required for update")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail="Note ID is required for update")
-        logger.info(f"Updating note with ID: {note_id}")
+        logger.info("Updating note with ID: %s", note_id)
 
         # First check if note exists
         check_response = supabase.table("notes").select("*").eq(
             "id", note_id).execute()
         if not check_response.data:
-            logger.warning(
-                f"Note with ID {note_id} not found during update")
+            logger.warning("Note with ID %s not found during update", note_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Note with ID {note_id} not found")
 
@@ -106,21 +103,22 @@ async def update_note(note: NoteBase):
         note_data = note.model_dump(exclude_unset=True)
 
         # Add updated timestamp
-        note_data["updated_at"] = datetime.now().isoformat()
+        note_data["updated_at"] = datetime.now(timezone.utc).isoformat()
 
         # Remove None values to avoid overwriting existing data with None
         note_data = {k: v for k, v in note_data.items() if v is not None}
 
-        logger.info(f"Update data: {note_data}")
+        logger.debug("Updating fields %s for note %s", sorted(note_data),
+                     note_id)
 
         response = supabase.table("notes").update(note_data).eq(
             "id", note_id).execute()
-        logger.info(f"Successfully updated note with ID: {note_id}")
+        logger.info("Successfully updated note with ID: %s", note_id)
         return response.data[0]
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Failed to update note {note_id}: {str(e)}")
+        logger.error("Failed to update note %s: %s", note_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to update note: {str(e)}")
 
@@ -128,24 +126,24 @@ async def update_note(note: NoteBase):
 @router.delete("/{note_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_note(note_id: str):
     try:
-        logger.info(f"Attempting to delete note with ID: {note_id}")
+        logger.info("Attempting to delete note with ID: %s", note_id)
 
         # First check if note exists
         check_response = supabase.table("notes").select("*").eq(
             "id", note_id).execute()
         if not check_response.data:
-            logger.warning(
-                f"Note with ID {note_id} not found during deletion")
+            logger.warning("Note with ID %s not found during deletion",
+                           note_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Note with ID {note_id} not found")
 
         response = supabase.table("notes").delete().eq("id", note_id).execute()
-        logger.info(f"Successfully deleted note with ID: {note_id}")
+        logger.info("Successfully deleted note with ID: %s", note_id)
         return None
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Failed to delete note {note_id}: {str(e)}")
+        logger.error("Failed to delete note %s: %s", note_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Failed to delete note: {str(e)}")
 
@@ -0,0 +1,442 @@
+"""Scheduled SMS: follow-up texts and appointment reminders.
+
+Rows in `scheduled_messages` (migrations/005) carry a `send_at`. Each worker
+runs a Scheduler task that leases the pending rows falling due within the
+next SCHEDULER_LOOKAHEAD seconds, keeps them in a heap ordered by send_at
+and sleeps until the earliest one is due. Due rows go through the regular
+send path (`routers.messages.deliver_sms`), sender fallback and circuit
+breakers included.
+
+Only the look-ahead window is ever loaded: leasing is a range scan of the
+partial index on pending rows' send_at, done every SCHEDULER_POLL_INTERVAL
+seconds (or right away while it keeps returning full batches), so the cost
+of a tick doesn't grow with the number of reminders further out.
+
+Leases let several workers share the table. scheduled_messages_lease()
+hands out disjoint rows, and a lease runs out SCHEDULER_LEASE_GRACE seconds
+after the row's send_at, so the rows of a worker that died are sent by
+another one shortly after. Before sending, a worker moves the row from
+pending to sending only if it still holds the lease, so a row moved or
+cancelled in the meantime is never sent, and never sent twice.
+
+Sends are at most once. A row still in sending SENDING_TIMEOUT seconds
+after its claim belonged to a worker that died mid-send; the text may
+have gone out, so the refill marks it failed instead of sending it again.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import secrets
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+import tracing
+from database import supabase
+from responses import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED",
+                              "true").lower() not in ("0", "false", "no")
+SCHEDULER_LOOKAHEAD = float(os.getenv("SCHEDULER_LOOKAHEAD", "300"))
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", "30"))
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "4"))
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "3"))
+SCHEDULER_LEASE_GRACE = int(os.getenv("SCHEDULER_LEASE_GRACE", "60"))
+# Delay before the first retry of a failed send; doubled for each attempt
+RETRY_DELAY = 60
+# A row in sending this long after its claim was abandoned mid-send
+SENDING_TIMEOUT = 600
+
+TABLE = "scheduled_messages"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _release_changes() -> dict:
+    return {"lease_owner": None, "lease_expires_at": None}
+
+
+class ScheduleStore:
+    """scheduled_messages rows through the Supabase client"""
+
+    def create(self, rows: List[dict]) -> List[dict]:
+        if not rows:
+            return []
+        return supabase.table(TABLE).insert(rows).execute().data
+
+    def lease(self, owner: str, until: datetime, limit: int) -> List[dict]:
+        return supabase.rpc(
+            "scheduled_messages_lease", {
+                "p_owner": owner,
+                "p_until": until.isoformat(),
+                "p_limit": limit,
+                "p_grace": SCHEDULER_LEASE_GRACE
+            }).execute().data or []
+
+    def claim(self, message_id: str, owner: str, attempts: int) -> bool:
+        """Move a leased row from pending to sending; False if it changed"""
+        return bool(
+            supabase.table(TABLE).update({
+                "status": "sending",
+                "attempts": attempts,
+                "updated_at": _now().isoformat()
+            }).eq("id", message_id).eq("status", "pending").eq(
+                "lease_owner", owner).execute().data)
+
+    def update(self,
+               message_id: str,
+               changes: dict,
+               status: Optional[str] = None) -> None:
+        """Change a row; only if it is in `status`, when given"""
+        query = supabase.table(TABLE).update({
+            **changes, "updated_at": _now().isoformat()
+        }, returning="minimal").eq("id", message_id)
+        if status is not None:
+            query = query.eq("status", status)
+        query.execute()
+
+    def fail_abandoned(self) -> List[dict]:
+        """Mark rows stuck in sending as failed; returns them"""
+        cutoff = (_now() - timedelta(seconds=SENDING_TIMEOUT)).isoformat()
+        return supabase.table(TABLE).update({
+            "status": "failed",
+            "last_error": "Worker stopped while sending; the message may "
+            "have been sent",
+            "updated_at": _now().isoformat(),
+            **_release_changes()
+        }).eq("status", "sending").lt("updated_at", cutoff).execute().data
+
+    def release(self, owner: str) -> None:
+        supabase.table(TABLE).update(_release_changes(),
+                                     returning="minimal").eq(
+                                         "lease_owner", owner).eq(
+                                             "status", "pending").execute()
+
+
+class Scheduler:
+
+    def __init__(self, store: Optional[ScheduleStore] = None):
+        self.store = store or ScheduleStore()
+        self.owner: Optional[str] = None
+        self._heap: List[Tuple[float, str]] = []
+        # Leased rows by id; heap entries whose row is gone or whose
+        # send_at moved are skipped when popped
+        self._rows: Dict[str, dict] = {}
+        self._inflight: Set[asyncio.Task] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_refill = 0.0
+        self.stats = {
+            "leased": 0,
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "skipped": 0
+        }
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        # Set here rather than at import: server.py forks after importing
+        self.owner = (f"{socket.gethostname()}:{os.getpid()}:"
+                      f"{secrets.token_hex(3)}")
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._inflight:
+            await asyncio.wait(self._inflight, timeout=10)
+        # Hand unsent rows back so another worker needn't wait for the
+        # leases to run out
+        try:
+            await asyncio.to_thread(self.store.release, self.owner)
+        except Exception as e:
+            logger.warning("Failed to release scheduled message leases: %s",
+                           e)
+        self._heap.clear()
+        self._rows.clear()
+
+    def _push(self, row: dict) -> None:
+        send_at = parse_timestamp(row["send_at"]).timestamp()
+        row["_due"] = send_at
+        self._rows[str(row["id"])] = row
+        heapq.heappush(self._heap, (send_at, str(row["id"])))
+
+    def lease_for_new(self, send_at: datetime) -> dict:
+        """Lease columns for a row created by this worker.
+
+        Rows due within the look-ahead window are leased to this worker
+        right away and handed to `offer()`, instead of waiting for the next
+        refill.
+        """
+        if (self._task is None
+                or send_at > _now() + timedelta(seconds=SCHEDULER_LOOKAHEAD)):
+            return {}
+        return {
+            "lease_owner":
+            self.owner,
+            "lease_expires_at":
+            (max(send_at, _now()) +
+             timedelta(seconds=SCHEDULER_LEASE_GRACE)).isoformat()
+        }
+
+    def offer(self, rows: List[dict]) -> None:
+        for row in rows:
+            if self.owner and row.get("lease_owner") == self.owner:
+                self._push(row)
+        if self._wake is not None:
+            self._wake.set()
+
+    def forget(self, message_ids: List[str]) -> None:
+        """Drop rows that were cancelled or moved from the heap"""
+        for message_id in message_ids:
+            self._rows.pop(str(message_id), None)
+
+    async def _refill(self) -> bool:
+        """Lease rows due within the window; True if the batch was full"""
+        abandoned = await asyncio.to_thread(self.store.fail_abandoned)
+        if abandoned:
+            self.stats["failed"] += len(abandoned)
+            logger.warning("Marked %s scheduled messages abandoned while "
+                           "sending as failed", len(abandoned))
+        limit = SCHEDULER_BATCH_SIZE - len(self._rows)
+        rows = await asyncio.to_thread(
+            self.store.lease, self.owner,
+            _now() + timedelta(seconds=SCHEDULER_LOOKAHEAD), limit)
+        for row in rows:
+            if str(row["id"]) not in self._rows:
+                self._push(row)
+        self.stats["leased"] += len(rows)
+        if rows:
+            logger.info("Leased %s scheduled messages", len(rows))
+        return len(rows) >= limit
+
+    def _dispatch_due(self) -> None:
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            due, message_id = heapq.heappop(self._heap)
+            row = self._rows.get(message_id)
+            if row is None or row["_due"] != due:
+                continue
+            row["_due"] = None
+            task = asyncio.create_task(self._dispatch(row))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    def _next_wait(self) -> float:
+        now = time.time()
+        wait = SCHEDULER_POLL_INTERVAL
+        if self._heap:
+            wait = min(wait, self._heap[0][0] - now)
+        if len(self._rows) < SCHEDULER_BATCH_SIZE:
+            wait = min(wait, self._next_refill - now)
+        return max(0.0, wait)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if (time.time() >= self._next_refill
+                        and len(self._rows) < SCHEDULER_BATCH_SIZE):
+                    full = await self._refill()
+                    self._next_refill = time.time() + (
+                        0 if full else SCHEDULER_POLL_INTERVAL)
+                self._dispatch_due()
+            except Exception as e:
+                logger.error("Scheduler iteration failed: %s", e)
+                self._next_refill = time.time() + SCHEDULER_POLL_INTERVAL
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._next_wait())
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _dispatch(self, row: dict) -> None:
+        # Imported here: the messages router imports this module
+        from routers.messages import SMSCreate, deliver_sms
+
+        message_id = str(row["id"])
+        attempts = (row.get("attempts") or 0) + 1
+        try:
+            async with self._slots:
+                if not await asyncio.to_thread(self.store.claim, message_id,
+                                               self.owner, attempts):
+                    self.stats["skipped"] += 1
+                    return
+                error, permanent = None, False
+                with tracing.span("scheduler dispatch",
+                                  attributes={
+                                      "scheduled_message.id": message_id,
+                                      "scheduled_message.kind":
+                                      row.get("kind"),
+                                      "scheduled_message.attempt": attempts
+                                  }):
+                    try:
+                        message = await deliver_sms(
+                            SMSCreate(client_id=str(row["client_id"]),
+                                      content=row["content"],
+                                      phone_number=row.get("to_number"),
+                                      from_phone_number=row.get(
+                                          "from_number")), {
+                                              "id": row.get("user_id"),
+                                              "phone_number":
+                                              row.get("from_number")
+                                          })
+                    except HTTPException as e:
+                        # 4xx: missing client or phone number, retrying
+                        # won't help. 504: Telnyx may have sent it, a retry
+                        # could send it twice.
+                        error, permanent = str(e.detail), (
+                            e.status_code < 500 or e.status_code == 504)
+                    except Exception as e:
+                        error = str(e)
+                await self._finish(row, attempts, error, permanent,
+                                   None if error else message)
+        except Exception as e:
+            logger.error("Failed to dispatch scheduled message %s: %s",
+                         message_id, e)
+        finally:
+            self._rows.pop(message_id, None)
+
+    async def _finish(self, row: dict, attempts: int, error: Optional[str],
+                      permanent: bool, message: Optional[dict]) -> None:
+        message_id = str(row["id"])
+        if error is None:
+            self.stats["sent"] += 1
+            logger.info("Sent scheduled message %s", message_id)
+            await asyncio.to_thread(
+                self.store.update, message_id, {
+                    "status": "sent",
+                    "message_id": str(message.get("id")),
+                    "last_error": None,
+                    **_release_changes()
+                })
+        elif permanent or attempts >= SCHEDULER_MAX_ATTEMPTS:
+            self.stats["failed"] += 1
+            logger.warning("Scheduled message %s failed after %s attempts: "
+                           "%s", message_id, attempts, error)
+            await asyncio.to_thread(self.store.update, message_id, {
+                "status": "failed",
+                "last_error": error[:500],
+                **_release_changes()
+            })
+        else:
+            self.stats["retried"] += 1
+            retry_at = _now() + timedelta(seconds=RETRY_DELAY *
+                                          2**(attempts - 1))
+            logger.info("Retrying scheduled message %s at %s: %s",
+                        message_id, retry_at.isoformat(), error)
+            await asyncio.to_thread(
+                self.store.update, message_id, {
+                    "status": "pending",
+                    "send_at": retry_at.isoformat(),
+                    "last_error": error[:500],
+                    **_release_changes()
+                })
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "owner": self.owner,
+            "leased_rows": len(self._rows),
+            "next_due_in": (round(self._heap[0][0] - time.time(), 1)
+                            if self._heap else None),
+            **self.stats,
+        }
+
+
+scheduler = Scheduler()
+
+
+def schedule(rows: List[dict]) -> List[dict]:
+    """Insert scheduled_messages rows, leasing the ones due soon"""
+    prepared = []
+    for row in rows:
+        send_at = parse_timestamp(row["send_at"])
+        prepared.append({
+            **row, "send_at": send_at.isoformat(),
+            **scheduler.lease_for_new(send_at)
+        })
+    created = scheduler.store.create(prepared)
+    scheduler.offer(created)
+    return created
+
+
+def cancel(filters: Dict[str, str]) -> List[dict]:
+    """Cancel the pending rows matching all `filters` (column: value)"""
+    query = supabase.table(TABLE).update({
+        "status": "cancelled",
+        "updated_at": _now().isoformat(),
+        **_release_changes()
+    }).eq("status", "pending")
+    for column, value in filters.items():
+        query = query.eq(column, value)
+    cancelled = query.execute().data
+    scheduler.forget([row["id"] for row in cancelled])
+    return cancelled
+
+
+def reminder_rows(event_id: str,
+                  client_id: str,
+                  start: datetime,
+                  minutes_before: List[int],
+                  text: str,
+                  user_id: Optional[str] = None,
+                  from_number: Optional[str] = None) -> List[dict]:
+    """Reminder rows for an event; those already in the past are skipped"""
+    now = _now()
+    rows = []
+    for minutes in sorted(set(minutes_before), reverse=True):
+        send_at = start - timedelta(minutes=minutes)
+        if send_at <= now:
+            continue
+        rows.append({
+            "client_id": client_id,
+            "user_id": user_id,
+            "from_number": from_number,
+            "content": text,
+            "kind": "reminder",
+            "event_id": event_id,
+            "send_at": send_at.isoformat(),
+        })
+    return rows
+
+
+def move_event_reminders(event_id: str,
+                         delta: timedelta,
+                         rewrite: Optional[Dict[str, str]] = None) -> int:
+    """Shift an event's pending reminders after its start time moved.
+
+    Reminder texts found in `rewrite` are replaced by the mapped text.
+    """
+    rows = supabase.table(TABLE).select("id, send_at, content").eq(
+        "event_id", event_id).eq("status", "pending").execute().data
+    for row in rows:
+        send_at = parse_timestamp(row["send_at"]) + delta
+        changes = {"send_at": send_at.isoformat(), **_release_changes()}
+        if rewrite and row["content"] in rewrite:
+            changes["content"] = rewrite[row["content"]]
+        # Clearing the lease makes whoever held the row skip it; the next
+        # refill picks it up at its new time. A row sent or claimed since
+        # the select is left alone.
+        scheduler.store.update(row["id"], changes, status="pending")
+    scheduler.forget([row["id"] for row in rows])
+    return len(rows)
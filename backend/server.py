@@ -0,0 +1,189 @@
+"""Server entry point.
+
+    python server.py                 # production: pre-forked workers
+    python server.py --reload        # development: single auto-reloading process
+
+Production mode imports the app once in the parent process, warms shared
+state, then forks the workers so they start from an already-initialized,
+copy-on-write image. SIGTERM/SIGINT drain the workers gracefully before the
+parent exits.
+"""
+import argparse
+import gc
+import importlib.util
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+from logging_config import shutdown_logging
+
+logger = logging.getLogger(__name__)
+
+
+def _default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+def _pick_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def _pick_http() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def preload():
+    """Import the application and warm shared state before forking"""
+    started = time.perf_counter()
+    import main
+
+    main.warmup()
+    # Build the OpenAPI schema once instead of on the first /docs hit in
+    # every worker
+    main.app.openapi()
+
+    # Move everything allocated so far out of the GC's tracked generations,
+    # so collections in the workers don't touch (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+
+    logger.info("Application preloaded in %.1f ms",
+                (time.perf_counter() - started) * 1000)
+    return main.app
+
+
+class Supervisor:
+    """Fork and babysit uvicorn worker processes sharing one socket"""
+
+    def __init__(self, config: uvicorn.Config, workers: int,
+                 graceful_timeout: float):
+        self.config = config
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.children: Dict[int, int] = {}
+        self.should_exit = False
+        self.socket = None
+
+    def _spawn(self, slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # Child: uvicorn installs its own SIGTERM/SIGINT handlers and
+            # finishes in-flight requests before exiting
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            server = uvicorn.Server(self.config)
+            server.run(sockets=[self.socket])
+            shutdown_logging()
+            os._exit(0)
+        self.children[pid] = slot
+        logger.info("Started worker %s (pid %s)", slot, pid)
+
+    def _handle_exit(self, signum, frame) -> None:
+        self.should_exit = True
+
+    def run(self) -> None:
+        self.socket = self.config.bind_socket()
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        while not self.should_exit:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in self.children:
+                slot = self.children.pop(pid)
+                if not self.should_exit:
+                    logger.warning("Worker %s (pid %s) exited, restarting",
+                                   slot, pid)
+                    self._spawn(slot)
+                continue
+            time.sleep(0.2)
+
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        logger.info("Draining %s workers", len(self.children))
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in self.children:
+            logger.warning("Worker pid %s did not drain in time, killing",
+                           pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.children.clear()
+        self.socket.close()
+        logger.info("Shutdown complete")
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the Law Firm CRM API")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port",
+                        type=int,
+                        default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers",
+                        type=int,
+                        default=_default_workers(),
+                        help="worker processes (default: WEB_CONCURRENCY "
+                        "or the CPU count)")
+    parser.add_argument("--graceful-timeout",
+                        type=float,
+                        default=float(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="seconds to wait for in-flight requests on "
+                        "shutdown")
+    parser.add_argument("--reload",
+                        action="store_true",
+                        help="development mode: one auto-reloading process")
+    args = parser.parse_args(argv)
+
+    if args.reload:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
+        return
+
+    app = preload()
+    config = uvicorn.Config(app,
+                            host=args.host,
+                            port=args.port,
+                            loop=_pick_loop(),
+                            http=_pick_http(),
+                            log_config=None,
+                            access_log=False,
+                            timeout_graceful_shutdown=args.graceful_timeout)
+    logger.info("Serving on %s:%s with %s workers (loop=%s, http=%s)",
+                args.host, args.port, args.workers, config.loop, config.http)
+
+    if args.workers <= 1:
+        uvicorn.Server(config).run()
+        return
+    Supervisor(config, args.workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
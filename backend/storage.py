@@ -0,0 +1,118 @@
+import os
+import threading
+from typing import AsyncIterator, List, Optional
+from urllib.parse import quote
+
+import httpx
+
+from database import supabase_key, supabase_url
+from resilience import AsyncBreakerTransport, storage_dependency
+
+# Bucket holding uploaded client documents, one "client_<id>/" prefix each
+DOCUMENTS_BUCKET = "client-documents"
+
+# Lifetime of download links handed out to the browser
+SIGNED_URL_TTL = int(os.getenv("DOCUMENT_URL_TTL", "60"))
+
+
+def document_prefix(client_id) -> str:
+    """Storage folder holding one client's documents"""
+    return f"client_{client_id}"
+
+
+_http: Optional[httpx.AsyncClient] = None
+_http_lock = threading.Lock()
+
+
+class StorageError(Exception):
+    """Raised when the Storage API rejects a request"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_storage_http() -> httpx.AsyncClient:
+    """Shared async client for the Supabase Storage REST API.
+
+    The supabase-py storage client is synchronous and needs the whole
+    payload in memory; talking to the REST API directly lets uploads stream
+    and keeps storage calls off the event loop.
+    """
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                _http = httpx.AsyncClient(
+                    base_url=f"{supabase_url}/storage/v1",
+                    transport=AsyncBreakerTransport(storage_dependency),
+                    headers={
+                        "apikey": supabase_key,
+                        "Authorization": f"Bearer {supabase_key}"
+                    },
+                    timeout=httpx.Timeout(30.0, read=120.0))
+    return _http
+
+
+def _object_path(path: str) -> str:
+    return quote(path, safe="/")
+
+
+def _raise_for_status(response: httpx.Response) -> None:
+    if response.status_code >= 400:
+        raise StorageError(response.status_code,
+                           f"Storage API error {response.status_code}: "
+                           f"{response.text[:200]}")
+
+
+async def upload_stream(bucket: str,
+                        path: str,
+                        chunks: AsyncIterator[bytes],
+                        content_type: str = "application/octet-stream",
+                        upsert: bool = False) -> None:
+    """Upload an object from an async byte stream without buffering it"""
+    response = await get_storage_http().post(
+        f"/object/{bucket}/{_object_path(path)}",
+        content=chunks,
+        headers={
+            "Content-Type": content_type,
+            "x-upsert": "true" if upsert else "false"
+        })
+    _raise_for_status(response)
+
+
+async def create_signed_url(bucket: str,
+                            path: str,
+                            expires_in: int = SIGNED_URL_TTL) -> str:
+    response = await get_storage_http().post(
+        f"/object/sign/{bucket}/{_object_path(path)}",
+        json={"expiresIn": expires_in})
+    _raise_for_status(response)
+    return f"{supabase_url}/storage/v1{response.json()['signedURL']}"
+
+
+async def list_objects(bucket: str,
+                       prefix: str,
+                       limit: int = 100,
+                       offset: int = 0) -> List[dict]:
+    """List one level under `prefix`; folders come back with a null id"""
+    response = await get_storage_http().post(f"/object/list/{bucket}",
+                                             json={
+                                                 "prefix": prefix,
+                                                 "limit": limit,
+                                                 "offset": offset,
+                                                 "sortBy": {
+                                                     "column": "name",
+                                                     "order": "asc"
+                                                 }
+                                             })
+    _raise_for_status(response)
+    return response.json()
+
+
+async def remove_objects(bucket: str, paths: List[str]) -> List[dict]:
+    response = await get_storage_http().request("DELETE",
+                                                f"/object/{bucket}",
+                                                json={"prefixes": paths})
+    _raise_for_status(response)
+    return response.json()
@@ -0,0 +1,481 @@
+"""Request tracing with W3C Trace Context propagation.
+
+TracingMiddleware opens a server span for every request, continuing the
+trace from an incoming `traceparent` header when there is one. The
+resilience hooks open a client span for each Supabase, Telnyx and Google
+call made while handling it, and pass `traceparent` on to Supabase and
+Google. Log records written inside a span carry its trace_id and span_id.
+
+Finished spans go onto a bounded queue; a background thread exports them in
+batches, so request handlers never wait on the exporter. When the queue is
+full new spans are dropped and counted rather than blocking.
+
+Configuration:
+
+- TRACING_EXPORTER: "none" (default, tracing off), "memory" (kept in
+  process and served by /api/admin/traces), "file" (JSON lines appended to
+  TRACING_FILE), or "package.module:attribute" naming an exporter class or
+  factory with `export(spans)` and `shutdown()` methods.
+- TRACING_SAMPLE_RATE: fraction of new traces recorded (default 0.1). The
+  decision is derived from the trace id, and requests arriving with a
+  `traceparent` follow its sampled flag, so a trace is either complete or
+  absent.
+"""
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").strip()
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.1"))
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "law-firm-crm-api")
+TRACING_BATCH_SIZE = int(os.getenv("TRACING_BATCH_SIZE", "256"))
+TRACING_EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", "2"))
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", "4096"))
+MEMORY_EXPORTER_MAX_SPANS = 10000
+
+_TRACEPARENT = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return (f"00-{self.trace_id}-{self.span_id}-"
+                f"{'01' if self.sampled else '00'}")
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """Parse a W3C traceparent header; None if absent or invalid"""
+    match = _TRACEPARENT.match((value or "").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    # Version 00 has no trailing fields; ff is forbidden
+    if version == "ff" or (version == "00" and rest):
+        return None
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("trace_context",
+                                                         default=None)
+
+
+def current_context() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def inject(headers: Dict[str, str]) -> None:
+    """Add the current traceparent to outgoing request headers"""
+    context = _current.get()
+    if context is not None:
+        headers["traceparent"] = context.traceparent
+
+
+class Span:
+    """A recorded operation; exported once `end()` is called"""
+
+    recording = True
+
+    def __init__(self, name: str, context: SpanContext,
+                 parent_id: Optional[str], kind: str,
+                 attributes: Optional[Dict[str, Any]]):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "unset"
+        self.status_message: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: Optional[str] = None) -> None:
+        self.status = "error"
+        self.status_message = message
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.attributes["exception.type"] = type(exc).__name__
+        self.attributes["exception.message"] = str(exc)[:500]
+        self.set_error(type(exc).__name__)
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.status == "unset":
+            self.status = "ok"
+        if _processor is not None:
+            _processor.on_end(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": TRACING_SERVICE_NAME,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "status_message": self.status_message,
+            "attributes": self.attributes,
+        }
+
+
+class NonRecordingSpan:
+    """Stand-in for unsampled spans; propagates context, records nothing"""
+
+    recording = False
+
+    def __init__(self, context: Optional[SpanContext]):
+        self.context = context
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, message: Optional[str] = None) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+def _should_sample(trace_id: str) -> bool:
+    # Derived from the trace id so every service sampling at the same rate
+    # makes the same decision
+    return int(trace_id[16:], 16) < TRACING_SAMPLE_RATE * (1 << 64)
+
+
+def enabled() -> bool:
+    return _processor is not None
+
+
+@contextmanager
+def span(name: str,
+         kind: str = "internal",
+         attributes: Optional[Dict[str, Any]] = None,
+         parent: Optional[SpanContext] = None):
+    """Run the block inside a child span of `parent` or the current span.
+
+    Without either, a new trace is started and sampled at
+    TRACING_SAMPLE_RATE. Exceptions escaping the block mark the span as an
+    error and are re-raised.
+    """
+    if _processor is None:
+        yield NonRecordingSpan(None)
+        return
+    parent = parent or _current.get()
+    if parent is None:
+        trace_id = secrets.token_hex(16)
+        context = SpanContext(trace_id, secrets.token_hex(8),
+                              _should_sample(trace_id))
+    else:
+        context = SpanContext(parent.trace_id, secrets.token_hex(8),
+                              parent.sampled)
+    current = (Span(name, context, parent.span_id if parent else None, kind,
+                    attributes)
+               if context.sampled else NonRecordingSpan(context))
+    token = _current.set(context)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+class MemorySpanExporter:
+    """Keeps the most recent spans in process, for local testing"""
+
+    def __init__(self, max_spans: int = MEMORY_EXPORTER_MAX_SPANS):
+        self._spans: Deque[dict] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[dict]) -> None:
+        with self._lock:
+            self._spans.extend(spans)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            return [
+                span for span in self._spans
+                if trace_id is None or span["trace_id"] == trace_id
+            ]
+
+    def traces(self, limit: int = 50) -> List[dict]:
+        """One summary per trace, most recently finished first"""
+        grouped: "OrderedDict[str, List[dict]]" = OrderedDict()
+        for span in reversed(self.spans()):
+            grouped.setdefault(span["trace_id"], []).append(span)
+        summaries = []
+        for trace_id, spans in list(grouped.items())[:limit]:
+            span_ids = {span["span_id"] for span in spans}
+            root = next((span for span in spans
+                         if span["parent_span_id"] not in span_ids), spans[-1])
+            summaries.append({
+                "trace_id": trace_id,
+                "root": root["name"],
+                "duration_ms": root["duration_ms"],
+                "spans": len(spans),
+                "errors": sum(span["status"] == "error" for span in spans),
+            })
+        return summaries
+
+    def shutdown(self) -> None:
+        pass
+
+
+class FileSpanExporter:
+    """Appends spans as JSON lines, one span per line"""
+
+    def __init__(self, path: str = TRACING_FILE):
+        self.path = path
+
+    def export(self, spans: List[dict]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(
+                json.dumps(span, default=str, separators=(",", ":")) + "\n"
+                for span in spans))
+
+    def shutdown(self) -> None:
+        pass
+
+
+class _Flush:
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class BatchSpanProcessor:
+    """Queues finished spans and exports them in batches from a thread"""
+
+    def __init__(self,
+                 exporter,
+                 batch_size: int = TRACING_BATCH_SIZE,
+                 interval: float = TRACING_EXPORT_INTERVAL,
+                 max_queue: int = TRACING_QUEUE_SIZE):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_thread(self) -> queue.Queue:
+        # Started on first use and again after fork, since server.py forks
+        # its workers once the app is imported
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.max_queue)
+                    threading.Thread(target=self._run,
+                                     args=(self._queue, ),
+                                     name="span-exporter",
+                                     daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def on_end(self, span: Span) -> None:
+        try:
+            self._ensure_thread().put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _export(self, batch: List[Span]) -> None:
+        if not batch:
+            return
+        try:
+            self.exporter.export([span.to_dict() for span in batch])
+        except Exception as e:
+            logger.warning("Failed to export %s spans: %s", len(batch), e)
+
+    def _run(self, spans: queue.Queue) -> None:
+        while True:
+            batch: List[Span] = []
+            flush: Optional[_Flush] = None
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = spans.get(timeout=max(0.0, deadline -
+                                                 time.monotonic()))
+                except queue.Empty:
+                    break
+                if isinstance(item, _Flush):
+                    flush = item
+                    break
+                batch.append(item)
+            self._export(batch)
+            if flush is not None:
+                flush.done.set()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Export everything queued so far; False if it took too long"""
+        if self._pid != os.getpid():
+            return True
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        self.flush(timeout)
+        if self.dropped:
+            logger.warning("Dropped %s spans with a full export queue",
+                           self.dropped)
+        self.exporter.shutdown()
+
+
+_processor: Optional[BatchSpanProcessor] = None
+
+
+def _make_exporter(name: str):
+    if name == "memory":
+        return MemorySpanExporter()
+    if name == "file":
+        return FileSpanExporter()
+    module, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown TRACING_EXPORTER {name!r}")
+    return getattr(importlib.import_module(module), attribute)()
+
+
+def configure(exporter=None) -> None:
+    """Install `exporter`, or the one named by TRACING_EXPORTER"""
+    global _processor
+    if exporter is None:
+        if TRACING_EXPORTER.lower() in ("", "none", "off"):
+            _processor = None
+            return
+        exporter = _make_exporter(TRACING_EXPORTER)
+    _processor = BatchSpanProcessor(exporter)
+
+
+def exporter():
+    return _processor.exporter if _processor is not None else None
+
+
+def flush(timeout: float = 5.0) -> bool:
+    return _processor.flush(timeout) if _processor is not None else True
+
+
+def shutdown() -> None:
+    if _processor is not None:
+        _processor.shutdown()
+
+
+class TraceContextFilter(logging.Filter):
+    """Adds trace_id and span_id to records logged inside a span"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _current.get()
+        if context is not None and context.sampled:
+            record.trace_id = context.trace_id
+            record.span_id = context.span_id
+        return True
+
+
+def _route_template(scope) -> Optional[str]:
+    """Full path template of the matched route, e.g. /api/clients/{client_id}
+
+    Routes of an included router may only know the part after the router
+    prefix, so the prefix is taken from the request path.
+    """
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    regex = getattr(route, "path_regex", None)
+    if template is None or regex is None:
+        return None
+    match = re.search(regex.pattern.lstrip("^"), scope["path"])
+    return scope["path"][:match.start()] + template if match else template
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span around every request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _processor is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        remote = parse_traceparent(
+            headers.get(b"traceparent", b"").decode("latin-1"))
+        method = scope["method"]
+        with span(f"{method} {scope['path']}",
+                  kind="server",
+                  parent=remote,
+                  attributes={
+                      "http.method": method,
+                      "http.target": scope["path"],
+                  }) as current:
+
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    current.set_attribute("http.status_code", status_code)
+                    if status_code >= 500:
+                        current.set_error(f"HTTP {status_code}")
+                    if current.recording:
+                        # W3C Trace Context Level 2 response header, so
+                        # callers can look the trace up
+                        message["headers"] = list(
+                            message.get("headers", [])) + [
+                                (b"traceresponse",
+                                 current.context.traceparent.encode())
+                            ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = _route_template(scope)
+                if current.recording and route:
+                    current.name = f"{method} {route}"
+                    current.set_attribute("http.route", route)
+                endpoint = scope.get("endpoint")
+                if endpoint is not None:
+                    current.set_attribute(
+                        "code.function",
+                        f"{endpoint.__module__}.{endpoint.__qualname__}")
+
+
+configure()